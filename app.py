@@ -1,13 +1,13 @@
 #----------------------------------------------------------------------------#
 # Imports
 #----------------------------------------------------------------------------#
-from asyncio.windows_events import NULL
-from distutils.command.sdist import show_formats
 import os
 import json
+import functools
+from datetime import datetime, timedelta
 import dateutil.parser
 import babel
-from flask import render_template, request, flash, redirect, url_for, jsonify
+from flask import Flask, Blueprint, current_app, render_template, request, flash, redirect, url_for, jsonify, abort, Response, stream_with_context
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
@@ -15,32 +15,218 @@ from forms import *
 from flask_migrate import Migrate
 
 import models as models 
-from models import app, db
+import listings
+import search
+import cache
+import counters
+import export
+import importer
+import bookings
+import metrics
+import database
+import conditional
+import assets
+import fragments
+import geo
+import matchmaking
+import calendars
+import jobs
+import deletes
+from models import db, migrate, moment
 
+#----------------------------------------------------------------------------#
+# App Config.
+#
+# create_app() builds a configured app; nothing here touches the database
+# at import time. The schema is owned by the migrations (flask db upgrade).
+#----------------------------------------------------------------------------#
+
+bp = Blueprint('main', __name__)
+
+def create_app(config_object='config', **overrides):
+  app = Flask(__name__)
+  app.config.from_object(config_object)
+  app.config.update(overrides)
+  app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(app.config)
+  app.config['SQLALCHEMY_BINDS'] = database.replica_binds(app.config)
+  if not app.config['ETAG_SALT']:
+    app.config['ETAG_SALT'] = conditional.template_digest(app)
 
+  db.init_app(app)
+  migrate.init_app(app, db)
+  moment.init_app(app)
+  database.init_app(app, db)
+  app.extensions['page_cache'] = cache.from_config(app.config)
+  app.extensions['fragment_cache'] = fragments.FragmentCache(cache.from_config(app.config, prefix='FRAGMENT_CACHE_'))
+  database.init_replicas(app, db)
+  app.extensions['metrics'] = metrics.init_app(app, db)
+  app.extensions['assets'] = assets.load_manifest(app.static_folder)
+  app.extensions['matchmaker'] = matchmaking.Matchmaker()
+  app.extensions['jobs'] = jobs.init_app(app)
+
+  app.jinja_env.filters['datetime'] = format_datetime
+  app.jinja_env.globals['asset_urls'] = assets.asset_urls
+  app.jinja_env.globals['filter_url'] = filter_url
+  app.jinja_env.add_extension(fragments.FragmentCacheExtension)
+  app.register_blueprint(bp)
+  app.cli.add_command(counters.counters_cli)
+  app.cli.add_command(importer.import_command)
+  app.cli.add_command(assets.assets_cli)
+  app.cli.add_command(geo.geo_cli)
+  app.cli.add_command(jobs.jobs_cli)
+
+  if not app.debug:
+    file_handler = FileHandler('error.log')
+    file_handler.setFormatter(
+        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    )
+    app.logger.setLevel(logging.INFO)
+    file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+    app.logger.info('errors')
+  return app
 
-db.create_all()
-# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+def page_cache():
+  return current_app.extensions['page_cache']
+
+def fragment_cache():
+  return current_app.extensions['fragment_cache']
+
+def cached_page(key, build):
+  # page data read through the page cache, once per request (a page's
+  # validator and its view share it; the environ, unlike g, never outlives
+  # the request); a miss is built from the primary (see database.py), as
+  # everyone reads what goes in the cache
+  pages = request.environ.setdefault('fyyur.cached_pages', {})
+  if key not in pages:
+    pages[key] = page_cache().get_or_set(key, lambda: database.from_primary(build))
+  return pages[key]
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@functools.lru_cache(maxsize=None)
+def datetime_formatter(pattern, locale='en'):
+  # the babel pattern and locale are parsed once per (pattern, locale)
+  compiled = babel.dates.parse_pattern(pattern)
+  locale = babel.Locale.parse(locale)
+  return functools.lru_cache(maxsize=4096)(lambda value: compiled.apply(value, locale))
+
+def format_datetime(value, format='medium', locale='en'):
+  # takes a datetime, or the str() / ISO form of one (cached page data is JSON)
+  if not isinstance(value, datetime):
+    try:
+      value = datetime.fromisoformat(value)
+    except ValueError:
+      value = dateutil.parser.parse(value)
+  return datetime_formatter(DATETIME_FORMATS.get(format, format), locale)(value)
 
-app.jinja_env.filters['datetime'] = format_datetime
+
+def filter_url(filters, **changes):
+  # the current listing's URL with some filters changed; None drops one
+  args = dict(filters, **changes)
+  return url_for(request.endpoint, **dict(
+    (name, str(value).lower() if isinstance(value, bool) else value)
+    for name, value in args.items() if value is not None))
+
+
+#----------------------------------------------------------------------------#
+# Page and fragment cache invalidation.
+#----------------------------------------------------------------------------#
+
+def venue_page_keys(venue_id):
+  # a venue's page and calendar, plus every artist page that lists one of its
+  # shows: one row per artist, so a long history is never loaded
+  artists = db.session.query(models.Show.artist_id, db.func.min(models.Show.start_time), db.func.max(models.Show.end_time)) \
+    .filter(models.Show.venue_id == venue_id).group_by(models.Show.artist_id).all()
+  # the calendar months are the venue's own, over the span of all its shows
+  span = [(venue_id, min(first for _, first, _ in artists), max(last for _, _, last in artists))] if artists else []
+  return set([cache.venue_key(venue_id)] + [cache.artist_key(artist_id) for artist_id, _, _ in artists]) \
+    | calendars.keys(span)
+
+def artist_page_keys(artist_id):
+  # an artist's page, plus every venue page and calendar month that lists one
+  # of their shows, one row per venue
+  venues = db.session.query(models.Show.venue_id, db.func.min(models.Show.start_time), db.func.max(models.Show.end_time)) \
+    .filter(models.Show.artist_id == artist_id).group_by(models.Show.venue_id).all()
+  return set([cache.artist_key(artist_id)] + [cache.venue_key(venue_id) for venue_id, _, _ in venues]) \
+    | calendars.keys(venues)
+
+# Call these after committing, so no request can cache the old rows again in
+# between. A delete takes the shows with it: read the keys before it and
+# pass them in.
+def invalidate_venue_pages(venue_id, keys=None):
+  page_cache().invalidate(*(venue_page_keys(venue_id) if keys is None else keys))
+  fragment_cache().invalidate(cache.venue_key(venue_id), 'venues')
+
+def invalidate_artist_pages(artist_id, keys=None):
+  page_cache().invalidate(*(artist_page_keys(artist_id) if keys is None else keys))
+  fragment_cache().invalidate(cache.artist_key(artist_id), 'artists')
+
+def invalidate_show_pages(venue_id, artist_id, start_time, end_time):
+  page_cache().invalidate(cache.venue_key(venue_id), cache.artist_key(artist_id),
+                          *calendars.keys([(venue_id, start_time, end_time)]))
+
+#----------------------------------------------------------------------------#
+# Background jobs (see jobs.py).
+#----------------------------------------------------------------------------#
+
+@jobs.handler('warm_pages')
+def warm_pages(payload):
+  # caches freshly built data for the pages a write changed, over whatever
+  # is cached, so the next visitor hits the cache
+  for venue_id in payload.get('venues', ()):
+    rebuild_page(cache.venue_key(venue_id), lambda: venue_page_data(venue_id))
+  for artist_id in payload.get('artists', ()):
+    rebuild_page(cache.artist_key(artist_id), lambda: artist_page_data(artist_id))
+  for venue_id, month in payload.get('calendars', ()):
+    rebuild_page(cache.calendar_key(venue_id, month),
+                 lambda: calendars.month_summary(venue_id, calendars.parse_month(month)))
+
+def rebuild_page(key, build):
+  data = build()
+  if data is None:
+    page_cache().invalidate(key)
+  else:
+    page_cache().set(key, data)
+
+@jobs.handler('recount')
+def recount_shows(payload):
+  counters.recount(payload.get('venues', ()), payload.get('artists', ()))
+
+@jobs.handler('purge')
+def purge_archived(payload):
+  # the hard delete behind a DELETE_MODE=archive delete, {"venue": id} or {"artist": id}
+  if 'venue' in payload:
+    counters.recount(artist_ids=deletes.purge('venue', payload['venue']))
+  else:
+    counters.recount(venue_ids=deletes.purge('artist', payload['artist']))
+
+@jobs.periodic('roll_over', timedelta(hours=1))
+def roll_over_shows(payload):
+  counters.roll_over()
+
+def warm_pages_later(venue_ids=(), artist_ids=(), shows=()):
+  # queues warm_pages for these venues and artists and the calendar months of
+  # these (venue_id, start_time, end_time) shows; call before committing
+  jobs.enqueue('warm_pages', {
+    "venues" : sorted(set(venue_ids)),
+    "artists" : sorted(set(artist_ids)),
+    "calendars" : sorted(set((venue_id, month) for venue_id, start_time, end_time in shows
+                             for month in calendars.months(start_time, end_time))),
+  })
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@bp.route('/')
 def index():
   venues = models.Venue.query.order_by(db.desc('id')).limit(10).all()
   artists = models.Artist.query.order_by(db.desc('id')).limit(10).all()
@@ -50,60 +236,90 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@bp.route('/venues')
+@conditional.validated_by(conditional.venue_list)
 def venues():
-  # TODO: replace with real venues data.
-  #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  data=[]
-
+  # areas, venues and num_upcoming_shows all come from one grouped query,
+  # the facet counts from another
+  filters = listings.parse_filters(request.args)
   try:
-    venues = models.Venue.query.all()
-    for venue in venues:
-      location = {
-        "city" : venue.city,
-        "state" : venue.state,
-        "venues" : []
-      }
-      venues_in_location = models.Venue.query.filter_by(city = venue.city, state = venue.state ).all()
-      location["venues"] = venues_in_location
-      if location in data:
-        continue
-      else:
-        data.append(location)     
+    data = listings.venue_areas(filters)
+    facets = listings.facets(models.Venue, filters)
   except:
     return jsonify({'Error' : 'Something wrong happened!'})
-      
-  return render_template('pages/venues.html', areas=data)
 
-@app.route('/venues/search', methods=['POST'])
+  return render_template('pages/venues.html', areas=data, facets=facets, filters=filters)
+
+@bp.route('/venues/search', methods=['POST'])
 def search_venues():
   # TODO: implement search on venues with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
   search_term = request.form.get('search_term', '')
-  venues = models.Venue.query.filter(models.Venue.name.ilike('%'+search_term+'%')).all()
-  response = {
-    "count" : len(venues),
-    "data" : []
-  }
-  for venue in venues:
-    data = {
-      "id" : venue.id,
-      "name" : venue.name,
-      "num_upcoming_shows" : 0
-    }
-    response["data"].append(data)
+  response = search.search_venues(search_term)
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-  # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  
-  venue = models.Venue.query.get(venue_id)
+NEARBY_DEFAULT_RADIUS_KM = 30
+NEARBY_MAX_K = 100
+NEARBY_MAX_LIMIT = 1000
+
+@bp.route('/venues/nearby')
+def nearby_venues():
+  # venues around ?lat=&lng= (or the ?city=&state= of the Geocode table),
+  # within ?radius= km (default 30), or the ?k= nearest (within ?radius=
+  # when given); radius searches return the first ?limit= (default 100)
+  try:
+    latitude, longitude, radius = [float(request.args[name]) if request.args.get(name) else None
+                                   for name in ('lat', 'lng', 'radius')]
+  except ValueError:
+    return jsonify({'Error' : 'lat, lng and radius must be numbers'}), 400
+  try:
+    k = int(request.args['k']) if request.args.get('k') else None
+    limit = int(request.args.get('limit') or 100)
+  except ValueError:
+    return jsonify({'Error' : 'k and limit must be integers'}), 400
+  if latitude is None or longitude is None:
+    point = geo.locate(request.args.get('city'), request.args.get('state'))
+    if point is None:
+      return jsonify({'Error' : 'give lat and lng, or a known city and state'}), 400
+    latitude, longitude = point
+  if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+    return jsonify({'Error' : 'lat must be within [-90, 90] and lng within [-180, 180]'}), 400
+  if radius is not None and not 0 < radius <= geo.MAX_RADIUS_KM:
+    return jsonify({'Error' : 'radius must be more than 0 and at most %d km' % geo.MAX_RADIUS_KM}), 400
+  if k is not None and not 0 < k <= NEARBY_MAX_K:
+    return jsonify({'Error' : 'k must be between 1 and %d' % NEARBY_MAX_K}), 400
+  if not 0 < limit <= NEARBY_MAX_LIMIT:
+    return jsonify({'Error' : 'limit must be between 1 and %d' % NEARBY_MAX_LIMIT}), 400
+
+  if k is not None:
+    venues, scanned = geo.nearest(latitude, longitude, k, radius or geo.MAX_RADIUS_KM)
+    count = len(venues)
+  else:
+    radius = radius or NEARBY_DEFAULT_RADIUS_KM
+    venues, count, scanned = geo.within(latitude, longitude, radius, limit)
+  return jsonify({
+    "latitude" : latitude,
+    "longitude" : longitude,
+    "radius_km" : radius,
+    "k" : k,
+    "count" : count,
+    "scanned" : scanned,
+    "data" : venues
+  })
+
+def venue_page_data(venue_id):
+  # builds the dict rendered by pages/show_venue.html, or None for an unknown venue.
+  # Its validator is read first and kept in the dict (see
+  # conditional.from_page_data): a write that lands meanwhile leaves it
+  # older than the data, never newer.
   today = datetime.now()
-  venue_past_shows = db.session.query(models.Show).join(models.Venue).filter(models.Show.venue_id == venue_id).filter(models.Show.start_time < today).all()
-  venue_upcoming_shows = db.session.query(models.Show).join(models.Venue).filter(models.Show.artist_id == venue_id).filter(models.Show.start_time > today).all()
+  found = conditional.venue_page(today, venue_id)
+  venue = models.Venue.query.get(venue_id)
+  if found is None or venue is None:
+    return None
+  venue_past_shows = db.session.query(models.Show).join(models.Artist).options(db.contains_eager(models.Show.artist)).filter(models.Show.venue_id == venue_id).filter(models.Show.start_time < today).all()
+  venue_upcoming_shows = db.session.query(models.Show).join(models.Artist).options(db.contains_eager(models.Show.artist)).filter(models.Show.venue_id == venue_id).filter(models.Show.start_time > today).all()
   data = {
     "id" : venue.id,
     "name": venue.name,
@@ -115,21 +331,21 @@ def show_venue(venue_id):
     "website_link": venue.website_link,
     "facebook_link": venue.facebook_link,
     "seeking_talent": venue.seeking_talent,
+    "seeking_description": venue.seeking_description,
     "image_link": venue.image_link,
     "past_shows": [],
     "upcoming_shows": [],
     "past_shows_count": 0,
     "upcoming_shows_count": 0,
+    "last_modified": found[0].isoformat(),
   }
  
   for show in venue_past_shows:
-    print(show.artist)
     past_show_details = {
       "artist_id": show.artist_id,
       "artist_name": show.artist.name,
       "artist_image_link": show.artist.image_link,
       "start_time": str(show.start_time)
-      # "start_time": "2035-04-15T20:00:00.000Z"
     }
     data["past_shows"].append(past_show_details)
   for show in venue_upcoming_shows:  
@@ -138,22 +354,64 @@ def show_venue(venue_id):
       "artist_name": show.artist.name,
       "artist_image_link": show.artist.image_link,
       "start_time": str(show.start_time)
-      # "start_time": "2035-04-15T20:00:00.000Z"
     }
     data["upcoming_shows"].append(upcoming_show_details)
   data['past_shows_count'] = len(venue_past_shows)
   data['upcoming_shows_count'] = len(venue_upcoming_shows)    
+  return data
+
+def cached_venue_page(venue_id):
+  return cached_page(cache.venue_key(venue_id), lambda: venue_page_data(venue_id))
+
+@bp.route('/venues/<int:venue_id>')
+@conditional.validated_by(conditional.from_page_data(cached_venue_page))
+def show_venue(venue_id):
+  # shows the venue page with the given venue_id, read through the page cache
+  data = cached_venue_page(venue_id)
+  if data is None:
+    abort(404)
   return render_template('pages/show_venue.html', venue=data)
 
+#  Venue calendar
+#  ----------------------------------------------------------------
+
+def venue_calendar_data(venue_id):
+  # (venue, month summary) for ?month=YYYY-MM, this month by default; aborts
+  # with 404 for an unknown venue and 400 for a malformed month
+  venue = db.session.query(models.Venue.id, models.Venue.name, models.Venue.seeking_talent) \
+    .filter(models.Venue.id == venue_id).first()
+  if venue is None:
+    abort(404)
+  try:
+    month = calendars.parse_month(request.args.get('month') or datetime.now().strftime(calendars.MONTH_FORMAT))
+  except ValueError:
+    abort(400)
+  key = cache.calendar_key(venue_id, month.strftime(calendars.MONTH_FORMAT))
+  return venue, cached_page(key, lambda: calendars.month_summary(venue_id, month))
+
+@bp.route('/venues/<int:venue_id>/calendar')
+def venue_calendar(venue_id):
+  venue, summary = venue_calendar_data(venue_id)
+  month = calendars.parse_month(summary["month"])
+  return render_template('pages/venue_calendar.html', venue=venue, calendar=summary,
+                         weeks=calendars.weeks(summary), today=str(datetime.now().date()),
+                         previous_month=calendars.previous_month(month).strftime(calendars.MONTH_FORMAT),
+                         next_month=calendars.next_month(month).strftime(calendars.MONTH_FORMAT))
+
+@bp.route('/api/v1/venues/<int:venue_id>/calendar')
+def venue_calendar_api(venue_id):
+  venue, summary = venue_calendar_data(venue_id)
+  return jsonify(dict(summary, venue_name=venue.name))
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@bp.route('/venues/create', methods=['GET'])
 def create_venue_form():  
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@bp.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   error = False
   # TODO: insert form data as a new Venue record in the db, instead
@@ -167,8 +425,10 @@ def create_venue_submission():
     seeking_description = form.seeking_description.data
     )
     if form.validate(): 
+      geo.place(venue)
       db.session.add(venue)
       db.session.commit()
+      fragment_cache().invalidate('venues')
     else:
       error = True
   except:
@@ -189,7 +449,7 @@ def create_venue_submission():
 # -------------------------------------------------------------------------------------
 # Delete Venue
 # -------------------------------------------------------------------------------------
-@app.route('/venues/<venue_id>/delete', methods=['DELETE', 'GET'])
+@bp.route('/venues/<venue_id>/delete', methods=['DELETE', 'GET'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
@@ -197,8 +457,20 @@ def delete_venue(venue_id):
   try:
     venue = models.Venue.query.get(venue_id)
     venue_name = venue.name
-    db.session.delete(venue)
+    # as an int, and read now: once the row is deleted venue.id can't be loaded
+    venue_id = venue.id
+    keys = venue_page_keys(venue_id)
+    if deletes.archiving():
+      deletes.archive('venue', venue_id)
+      jobs.enqueue('purge', {"venue" : venue_id})
+    else:
+      # the shows go with the venue: their artists' counters drop in this
+      # transaction, and a queued recount checks them after
+      conditional.touch_artists_of(venue_id)
+      counters.forget_venue_shows(venue_id)
+      jobs.enqueue('recount', {"artists" : deletes.purge('venue', venue_id)})
     db.session.commit()
+    invalidate_venue_pages(venue_id, keys)
   except:
     error = True  
     db.session.rollback()
@@ -210,35 +482,20 @@ def delete_venue(venue_id):
       flash(venue_name + " was successfully deleted!")
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  return redirect(url_for('index'))
+  return redirect(url_for('main.index'))
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@bp.route('/artists')
+@conditional.validated_by(conditional.artist_list)
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data=[
-  #   {
-  #   "id": 4,
-  #   "name": "Guns N Petals",
-  # }, {
-  #   "id": 5,
-  #   "name": "Matt Quevedo",
-  # }, {
-  #   "id": 6,
-  #   "name": "The Wild Sax Band",
-  # }
-  ]
-  artists = models.Artist.query.order_by('id').all()
-  for artist in artists:
-    artist_info = {
-      "id" : artist.id,
-      "name" : artist.name
-    }
-    data.append(artist_info)
-  return render_template('pages/artists.html', artists=data)
+  # the artists matching the filters, and the facet counts, one query each
+  filters = listings.parse_filters(request.args)
+  data = listings.artist_list(filters)
+  facets = listings.facets(models.Artist, filters)
+  return render_template('pages/artists.html', artists=data, facets=facets, filters=filters)
 
-@app.route('/artists/search', methods=['POST'])
+@bp.route('/artists/search', methods=['POST'])
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
@@ -251,22 +508,67 @@ def search_artists():
     #   "num_upcoming_shows": 0,
     # }]
   # }
-  search_term = request.form["search_term"]
-  artists = models.Artist.query.filter(models.Artist.name.ilike('%'+search_term+'%')).all()
-  response = {
-    "count" : len(artists),
-    "data" : []
+  search_term = request.form.get('search_term', '')
+  response = search.search_artists(search_term)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+def artist_page_data(artist_id):
+  # builds the dict rendered by pages/show_artist.html, or None for an unknown artist.
+  # Its validator is read first and kept in the dict (see
+  # conditional.from_page_data): a write that lands meanwhile leaves it
+  # older than the data, never newer.
+  today = datetime.now()
+  found = conditional.artist_page(today, artist_id)
+  artist = models.Artist.query.get(artist_id)
+  if found is None or artist is None:
+    return None
+  artist_past_shows = db.session.query(models.Show).join(models.Venue).options(db.contains_eager(models.Show.venue)).filter(models.Show.artist_id == artist_id).filter(models.Show.start_time < today).all()
+  artist_upcoming_shows = db.session.query(models.Show).join(models.Venue).options(db.contains_eager(models.Show.venue)).filter(models.Show.artist_id == artist_id).filter(models.Show.start_time > today).all()
+  data = {
+    "id" : artist.id,
+    "name" : artist.name,
+    "genres" : artist.genres,
+    "city" : artist.city,
+    "state": artist.state,
+    "phone" : artist.phone,
+    "website_link" : artist.website_link,
+    "seeking_venue" : artist.seeking_venue,
+    "seeking_description" : artist.seeking_description,
+    "facebook_link" : artist.facebook_link,
+    "image_link" : artist.image_link,
+    "past_shows" : [],
+    "upcoming_shows" : [],
+    "past_shows_count": 0,
+    "upcoming_shows_count" : 0,
+    "last_modified" : found[0].isoformat(),
   }
-  for artist in artists:
-    artist_info = {
-      "id" : artist.id,
-      "name" : artist.name,
-      "num_upcomig_shows" : 0
+  for show in artist_past_shows:
+    past_show_details = {
+      "venue_id": show.venue_id,
+      "venue_name": show.venue.name,
+      "venue_image_link": show.venue.image_link,
+      "start_time": str(show.start_time)
     }
-    response["data"].append(artist_info)
-  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+    data["past_shows"].append(past_show_details)
 
-@app.route('/artists/<int:artist_id>')
+  for show in artist_upcoming_shows:
+    upcoming_show_details = {
+      "venue_id": show.venue_id,
+      "venue_name": show.venue.name,
+      "venue_image_link": show.venue.image_link,
+      "start_time": str(show.start_time)
+    }
+    data["upcoming_shows"].append(upcoming_show_details)
+
+  data['past_shows_count'] = len(artist_past_shows)
+  data['upcoming_shows_count'] = len(artist_upcoming_shows) 
+  return data
+
+def cached_artist_page(artist_id):
+  return cached_page(cache.artist_key(artist_id), lambda: artist_page_data(artist_id))
+
+@bp.route('/artists/<int:artist_id>')
+@conditional.validated_by(conditional.from_page_data(cached_artist_page))
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
   # TODO: replace with real artist data from the artist table, using artist_id
@@ -342,54 +644,14 @@ def show_artist(artist_id):
   #   "upcoming_shows_count": 3,
   # }
   # data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
-  artist = models.Artist.query.get(artist_id)
-  today = datetime.now()
-  artist_past_shows = db.session.query(models.Show).join(models.Artist).filter(models.Show.artist_id == artist_id).filter(models.Show.start_time < today).all()
-  artist_upcoming_shows = db.session.query(models.Show).join(models.Artist).filter(models.Show.artist_id == artist_id).filter(models.Show.start_time > today).all()
-  data = {
-    "id" : artist.id,
-    "name" : artist.name,
-    "genres" : artist.genres,
-    "city" : artist.city,
-    "state": artist.state,
-    "phone" : artist.phone,
-    "website_link" : artist.website_link,
-    "seeking_venue" : artist.seeking_venue,
-    "facebook_link" : artist.facebook_link,
-    "image_link" : artist.image_link,
-    "past_shows" : [],
-    "upcoming_shows" : [],
-    "past_shows_count": 0,
-    "upcoming_shows_count" : 0
-  }
-  for show in artist_past_shows:
-    print(show.venue)
-    past_show_details = {
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link,
-      "start_time": str(show.start_time)
-      # "start_time": "2035-04-15T20:00:00.000Z"
-    }
-    data["past_shows"].append(past_show_details)
-
-  for show in artist_upcoming_shows:
-    upcoming_show_details = {
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link,
-      "start_time": str(show.start_time)
-      # "start_time": "2035-04-15T20:00:00.000Z"
-    }
-    data["upcoming_shows"].append(upcoming_show_details)
-
-  data['past_shows_count'] = len(artist_past_shows)
-  data['upcoming_shows_count'] = len(artist_upcoming_shows) 
+  data = cached_artist_page(artist_id)
+  if data is None:
+    abort(404)
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@bp.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
   # artist={
@@ -420,7 +682,7 @@ def edit_artist(artist_id):
   # TODO: populate form with fields from artist with ID <artist_id>
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@bp.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
@@ -437,14 +699,17 @@ def edit_artist_submission(artist_id):
     artist.seeking_venue = form.seeking_venue.data
     artist.seeking_description = form.seeking_description.data
     artist.image_link = form.image_link.data
+    conditional.touch_venues_of(artist_id)
+    warm_pages_later(artist_ids=[artist_id])
     db.session.commit()
+    invalidate_artist_pages(artist_id)
   except :
     db.session.rollback()
   finally:
     db.session.close()    
-  return redirect(url_for('show_artist', artist_id=artist_id))
+  return redirect(url_for('main.show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   form = VenueForm(request.form)
   # venue={
@@ -478,7 +743,7 @@ def edit_venue(venue_id):
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
@@ -496,24 +761,28 @@ def edit_venue_submission(venue_id):
     venue.image_link = form.image_link.data
     venue.seeking_talent = form.seeking_talent.data
     venue.seeking_description = form.seeking_description.data
+    geo.place(venue)
+    conditional.touch_artists_of(venue_id)
+    warm_pages_later(venue_ids=[venue_id])
     db.session.commit()
+    invalidate_venue_pages(venue_id)
   except:
     db.session.rollback()
   finally: 
     db.session.close()    
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@bp.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@bp.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # TODO: insert form data as a new Venue record in the db, instead
@@ -530,6 +799,7 @@ def create_artist_submission():
     if form.validate():
       db.session.add(artist)
       db.session.commit()
+      fragment_cache().invalidate('artists')
     else :
       error = True  
   except:
@@ -549,7 +819,7 @@ def create_artist_submission():
 # -------------------------------------------------------------------------------------
 # Delete Artist
 # -------------------------------------------------------------------------------------
-@app.route('/artists/<artist_id>/delete', methods=['DELETE', 'GET'])
+@bp.route('/artists/<artist_id>/delete', methods=['DELETE', 'GET'])
 def delete_artist(artist_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
@@ -558,8 +828,20 @@ def delete_artist(artist_id):
     artist = models.Artist.query.get(artist_id)
     # shows = models.Show.query.filter_by(artist_id = artist_id).all()
     artist_name = artist.name
-    db.session.delete(artist) 
+    # as an int, and read now: once the row is deleted artist.id can't be loaded
+    artist_id = artist.id
+    keys = artist_page_keys(artist_id)
+    if deletes.archiving():
+      deletes.archive('artist', artist_id)
+      jobs.enqueue('purge', {"artist" : artist_id})
+    else:
+      # the shows go with the artist: their venues' counters drop in this
+      # transaction, and a queued recount checks them after
+      conditional.touch_venues_of(artist_id)
+      counters.forget_artist_shows(artist_id)
+      jobs.enqueue('recount', {"venues" : deletes.purge('artist', artist_id)})
     db.session.commit()
+    invalidate_artist_pages(artist_id, keys)
   except:
     error = True  
     db.session.rollback()
@@ -571,12 +853,13 @@ def delete_artist(artist_id):
       flash(artist_name + " was successfully deleted!")
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  return redirect(url_for('index'))
+  return redirect(url_for('main.index'))
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@bp.route('/shows')
+@conditional.validated_by(conditional.show_list)
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
@@ -616,29 +899,27 @@ def shows():
   #   "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
   #   "start_time": "2035-04-15T20:00:00.000Z"
   # }]
-  data = []
-  shows = models.Show.query.order_by(db.desc(models.Show.start_time)).all()
-  for show in shows:
-    venue = models.Venue.query.get(show.venue_id)
-    artist = models.Artist.query.get(show.artist_id)
-    show_info= {
-      "venue_id" : venue.id,
-      "venue_name" : venue.name,
-      "artist_id" : artist.id,
-      "artist_name" : artist.name,
-      "artist_image_link" : artist.image_link,
-      "start_time" : str(show.start_time)
-    }
-    data.append(show_info)
-  return render_template('pages/shows.html', shows=data)
+  when = request.args.get('when')
+  if when not in ('upcoming', 'past'):
+    when = None
+  try:
+    data, next_cursor = listings.show_feed(when=when, cursor=request.args.get('cursor'))
+  except ValueError:
+    abort(404)
+  return render_template('pages/shows.html', shows=data, when=when, next_cursor=next_cursor)
+
+def show_duration(form):
+  if form.duration.data:
+    return timedelta(minutes=form.duration.data)
+  return models.DEFAULT_SHOW_DURATION
 
-@app.route('/shows/create')
+@bp.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@bp.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
@@ -649,28 +930,30 @@ def create_show_submission():
   # e.g., flash('An error occurred. Show could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   error = False
+  message = 'An error occurred. Show could not be listed.'
   try:
     form = ShowForm(request.form)
     if form.validate():
       artist_id = int(form.artist_id.data)
       venue_id = int(form.venue_id.data)
-      venue = models.Venue.query.get(venue_id)
-      artist = models.Artist.query.get(artist_id)
-      if venue and artist:
-        show = models.Show(artist_id=artist_id, venue_id=venue_id, start_time=form.start_time.data)
-        db.session.add(show)
-        db.session.commit()
-      else:
-        error = True
+      show = bookings.book(venue_id, artist_id, form.start_time.data, show_duration(form))
+      start_time, end_time = show.start_time, show.end_time
+      warm_pages_later([venue_id], [artist_id], [(venue_id, start_time, end_time)])
+      db.session.commit()
+      invalidate_show_pages(venue_id, artist_id, start_time, end_time)
     else:
       error = True  
+  except bookings.BookingError as e:
+    error = True
+    message = str(e)
+    db.session.rollback()
   except:
     error = True
     db.session.rollback()
   finally:
     db.session.close()  
     if error == True:
-      flash('An error occurred. Show could not be listed.')
+      flash(message)
     else:
       flash('Show was successfully listed!')
   return render_template('pages/home.html')
@@ -678,37 +961,45 @@ def create_show_submission():
 # ----------------------------------------------------------------
 # Book Venue for show
 # ----------------------------------------------------------------
-@app.route('/venues/<int:venue_id>/book', methods=['GET'])
+@bp.route('/venues/<int:venue_id>/book', methods=['GET'])
 def book_venue(venue_id):
   form = ShowForm()
   form.venue_id.data = venue_id
-  return render_template('forms/new_show.html', form=form)
+  # a free slot picked on the venue calendar
+  if request.args.get('start_time'):
+    try:
+      form.start_time.data = dateutil.parser.parse(request.args['start_time'])
+    except (ValueError, OverflowError):
+      pass
+  return render_template('forms/new_show.html', form=form, calendar_venue_id=venue_id)
 
-@app.route('/venues/<int:venue_id>/book', methods=['POST'])
+@bp.route('/venues/<int:venue_id>/book', methods=['POST'])
 def book_venue_submission(venue_id):
   error = False
+  message = 'An error occurred. Show could not be listed.'
   try:
     form = ShowForm(request.form)
     if form.validate():
       artist_id = int(form.artist_id.data)
       venue_id = int(form.venue_id.data)
-      venue = models.Venue.query.get(venue_id)
-      artist = models.Artist.query.get(artist_id)
-      if venue and artist:
-        show = models.Show(artist_id = artist_id, venue_id = venue_id, start_time = form.start_time.data)
-        db.session.add(show)
-        db.session.commit()
-      else:
-        error = True
+      show = bookings.book(venue_id, artist_id, form.start_time.data, show_duration(form))
+      start_time, end_time = show.start_time, show.end_time
+      warm_pages_later([venue_id], [artist_id], [(venue_id, start_time, end_time)])
+      db.session.commit()
+      invalidate_show_pages(venue_id, artist_id, start_time, end_time)
     else:
       error = True  
+  except bookings.BookingError as e:
+    error = True
+    message = str(e)
+    db.session.rollback()
   except:
     error = True
     db.session.rollback()
   finally:
     db.session.close()  
     if error == True:
-      flash('An error occurred. Show could not be listed.')
+      flash(message)
     else:
       flash('Show was successfully listed!')
   return render_template('pages/home.html')
@@ -717,73 +1008,187 @@ def book_venue_submission(venue_id):
 # ----------------------------------------------------------------
 # Book Artist for show
 # ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/book', methods=['GET'])
+@bp.route('/artists/<int:artist_id>/book', methods=['GET'])
 def book_artist(artist_id):
   form = ShowForm()
   form.artist_id.data = artist_id
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/artists/<int:artist_id>/book', methods=['POST'])
+@bp.route('/artists/<int:artist_id>/book', methods=['POST'])
 def book_artist_submission(artist_id):
   error = False
+  message = 'An error occurred. Show could not be listed.'
   try:
     form = ShowForm(request.form)
     if form.validate():
       artist_id = int(form.artist_id.data)
       venue_id = int(form.venue_id.data)
-      venue = models.Venue.query.get(venue_id)
-      artist = models.Artist.query.get(artist_id)
-      if venue and artist:
-        show = models.Show(artist_id=artist_id, venue_id=venue_id, start_time=form.start_time.data)
-        db.session.add(show)
-        db.session.commit()
-      else:
-        error = True
+      show = bookings.book(venue_id, artist_id, form.start_time.data, show_duration(form))
+      start_time, end_time = show.start_time, show.end_time
+      warm_pages_later([venue_id], [artist_id], [(venue_id, start_time, end_time)])
+      db.session.commit()
+      invalidate_show_pages(venue_id, artist_id, start_time, end_time)
     else:
       error = True  
+  except bookings.BookingError as e:
+    error = True
+    message = str(e)
+    db.session.rollback()
   except:
     error = True
     db.session.rollback()
   finally:
     db.session.close()  
     if error == True:
-      flash('An error occurred. Show could not be listed.')
+      flash(message)
     else:
       flash('Show was successfully listed!')
   return render_template('pages/home.html')
   
-@app.errorhandler(404)
+# ----------------------------------------------------------------
+# Batch booking
+# ----------------------------------------------------------------
+@bp.route('/api/v1/shows/batch', methods=['POST'])
+def book_shows_batch():
+  # {"shows": [{"artist_id", "venue_id", "start_time", "duration"}, ...], "atomic": false}
+  payload = request.get_json(silent=True)
+  if not isinstance(payload, dict) or not isinstance(payload.get('shows'), list):
+    return jsonify({'Error' : 'expected a JSON object with a "shows" list'}), 400
+  try:
+    results, booked = bookings.book_many(payload['shows'], atomic=bool(payload.get('atomic')))
+    if booked:
+      warm_pages_later([venue_id for venue_id, _, _, _ in booked], [artist_id for _, artist_id, _, _ in booked],
+                       [(venue_id, start_time, end_time) for venue_id, _, start_time, end_time in booked])
+    db.session.commit()
+  except bookings.BookingError as e:
+    db.session.rollback()
+    return jsonify({'Error' : str(e)}), 400
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+  page_cache().invalidate(*set(key for venue_id, artist_id, _, _ in booked
+                               for key in (cache.venue_key(venue_id), cache.artist_key(artist_id)))
+                          | calendars.keys((venue_id, start_time, end_time) for venue_id, _, start_time, end_time in booked))
+  created = len(booked)
+  rejected = sum(1 for result in results if result["status"] == 'rejected')
+  status = 201 if created and not rejected else (422 if not created and rejected else 200)
+  return jsonify({"created" : created, "rejected" : rejected, "results" : results}), status
+
+# ----------------------------------------------------------------
+# Artist availability
+# ----------------------------------------------------------------
+@bp.route('/api/v1/artists/available')
+def available_artists():
+  # artists of ?genre= with no show on ?date=YYYY-MM-DD
+  genre = request.args.get('genre')
+  if genre not in Genres.fetch_genres():
+    return jsonify({'Error' : 'genre must be one of %s' % ', '.join(Genres.fetch_genres())}), 400
+  try:
+    day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+  except ValueError:
+    return jsonify({'Error' : 'date must be given as YYYY-MM-DD'}), 400
+  artists = bookings.free_artists(genre, day)
+  return jsonify({
+    "genre" : genre,
+    "date" : day.isoformat(),
+    "count" : len(artists),
+    "data" : [{
+      "id" : artist.id,
+      "name" : artist.name,
+      "city" : artist.city,
+      "state" : artist.state,
+      "seeking_venue" : artist.seeking_venue,
+    } for artist in artists]
+  })
+
+# ----------------------------------------------------------------
+# Recommendations
+# ----------------------------------------------------------------
+RECOMMENDATIONS_DEFAULT = 10
+RECOMMENDATIONS_MAX = 100
+
+def recommendations(for_artist, entity_id):
+  try:
+    limit = int(request.args.get('limit') or RECOMMENDATIONS_DEFAULT)
+  except ValueError:
+    limit = 0
+  if not 0 < limit <= RECOMMENDATIONS_MAX:
+    return jsonify({'Error' : 'limit must be between 1 and %d' % RECOMMENDATIONS_MAX}), 400
+  ranked = current_app.extensions['matchmaker'].rank(for_artist, entity_id, limit)
+  if ranked is None:
+    return jsonify({'Error' : '%s %d does not exist' % ('Artist' if for_artist else 'Venue', entity_id)}), 404
+  return jsonify({
+    ("artist_id" if for_artist else "venue_id") : entity_id,
+    "count" : len(ranked),
+    "data" : ranked
+  })
+
+@bp.route('/api/v1/artists/<int:artist_id>/recommended-venues')
+def recommended_venues(artist_id):
+  # venues seeking talent, best match for the artist first; ?limit=
+  return recommendations(True, artist_id)
+
+@bp.route('/api/v1/venues/<int:venue_id>/recommended-artists')
+def recommended_artists(venue_id):
+  # artists seeking a venue, best match for the venue first; ?limit=
+  return recommendations(False, venue_id)
+
+# ----------------------------------------------------------------
+# Export API
+# ----------------------------------------------------------------
+@bp.route('/api/v1/export/<any(shows, venues, artists):kind>')
+def export_data(kind):
+  # streams a whole table; ?format=ndjson|csv, ?fields=id,name,... and ?since=<ISO date> (rows changed since)
+  fmt = request.args.get('format', 'ndjson')
+  try:
+    rows = export.stream(kind, fmt, fields=request.args.get('fields'), since=request.args.get('since'))
+  except export.ExportError as e:
+    return jsonify({'Error' : str(e)}), 400
+  response = Response(stream_with_context(rows), mimetype=export.FORMATS[fmt])
+  response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (kind, fmt)
+  return response
+
+# ----------------------------------------------------------------
+# Page cache statistics
+# ----------------------------------------------------------------
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+  return assets.send_bundle(filename)
+
+@bp.route('/cache/stats')
+def cache_stats():
+  return jsonify(dict(page_cache().stats(), fragments=fragment_cache().stats()))
+
+# ----------------------------------------------------------------
+# Prometheus metrics
+# ----------------------------------------------------------------
+@bp.route('/metrics')
+def metrics_endpoint():
+  return Response(current_app.extensions['metrics'].render(page_cache(), fragment_cache()), mimetype='text/plain; version=0.0.4')
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
-
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
-    app.debug = True
+    app = create_app(DEBUG=True)
     app.run()
 
 # Or specify port manually:
 
 if __name__ == '__main__':
-    app.debug = True
+    app = create_app(DEBUG=True)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
 
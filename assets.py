@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+import brotli
+import click
+import rcssmin
+import rjsmin
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+from werkzeug.exceptions import NotFound
+
+#----------------------------------------------------------------------------#
+# Static asset bundles.
+#
+# `flask assets build` concatenates and minifies the files of each bundle in
+# BUNDLES into static/dist/<name>.<content hash>.<ext>, next to a gzip (.gz)
+# and a brotli (.br) copy, and records the file names in
+# static/dist/manifest.json. Since the URL changes whenever the content
+# does, /assets/ serves them as immutable for a year, picking the smallest
+# encoding the browser accepts.
+#
+# asset_urls() is the template helper. Without a manifest (in development)
+# it lists the bundle's source files instead.
+#----------------------------------------------------------------------------#
+
+BUNDLES = {
+  'main.css': [
+    'css/bootstrap.min.css',
+    'css/layout.main.css',
+    'css/main.css',
+    'css/main.responsive.css',
+    'css/main.quickfix.css',
+  ],
+  # loaded in <head>, before the page renders
+  'head.js': [
+    'js/libs/modernizr-2.8.2.min.js',
+    'js/libs/moment.min.js',
+  ],
+  # deferred, at the end of <body>, after jQuery
+  'main.js': [
+    'js/script.js',
+    'js/libs/bootstrap-3.1.1.min.js',
+    'js/plugins.js',
+  ],
+}
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+MAX_AGE = 365 * 24 * 3600
+# best first
+ENCODINGS = (
+  ('br', '.br'),
+  ('gzip', '.gz'),
+)
+MIMETYPES = {
+  '.css': 'text/css',
+  '.js': 'text/javascript',
+}
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def _absolute_urls(css, source, static_url_path):
+  # relative url()s point from the source file; the bundle lives elsewhere
+  base = posixpath.dirname(source)
+
+  def rewrite(match):
+    quote, url = match.groups()
+    if re.match(r'^([a-z]+:|/|#)', url):
+      return match.group(0)
+    path, query = re.match(r'^([^?#]*)(.*)$', url).groups()
+    path = posixpath.normpath(posixpath.join(base, path))
+    return 'url(%s%s/%s%s%s)' % (quote, static_url_path, path, query, quote)
+
+  return CSS_URL.sub(rewrite, css)
+
+
+def bundle(name, static_folder, static_url_path):
+  # the minified content of one bundle
+  parts = []
+  for source in BUNDLES[name]:
+    with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+      content = f.read()
+    if name.endswith('.css'):
+      parts.append(rcssmin.cssmin(_absolute_urls(content, source, static_url_path), keep_bang_comments=True))
+    else:
+      # the semicolon keeps one file's last statement from running into the next
+      parts.append(rjsmin.jsmin(content, keep_bang_comments=True) + ';')
+  return '\n'.join(parts)
+
+
+def _write(directory, filename, content):
+  with open(os.path.join(directory, filename), 'wb') as f:
+    f.write(content)
+
+
+def build(static_folder, static_url_path):
+  # writes every bundle and the manifest, removes older builds, and returns
+  # the manifest
+  dist = os.path.join(static_folder, DIST)
+  os.makedirs(dist, exist_ok=True)
+  manifest = {}
+  for name in sorted(BUNDLES):
+    content = bundle(name, static_folder, static_url_path).encode('utf-8')
+    stem, ext = os.path.splitext(name)
+    filename = '%s.%s%s' % (stem, hashlib.sha256(content).hexdigest()[:12], ext)
+    _write(dist, filename, content)
+    _write(dist, filename + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    _write(dist, filename + '.br', brotli.compress(content, mode=brotli.MODE_TEXT, quality=11))
+    manifest[name] = filename
+  _write(dist, MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+  current = set(manifest.values())
+  for filename in os.listdir(dist):
+    built = filename
+    for _, suffix in ENCODINGS:
+      if built.endswith(suffix):
+        built = built[:-len(suffix)]
+    if filename != MANIFEST and built not in current:
+      os.remove(os.path.join(dist, filename))
+  return manifest
+
+
+def load_manifest(static_folder):
+  # the built bundles, or None when `flask assets build` hasn't been run
+  try:
+    with open(os.path.join(static_folder, DIST, MANIFEST), encoding='utf-8') as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+
+
+def asset_urls(name):
+  # template helper: the URLs that load bundle `name`, in order
+  manifest = current_app.extensions['assets']
+  if manifest is not None and name in manifest:
+    return [url_for('main.asset', filename=manifest[name])]
+  return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+
+def send_bundle(filename):
+  # a built bundle, precompressed if the browser takes it, cached for good
+  directory = os.path.join(current_app.static_folder, DIST)
+  mimetype = MIMETYPES.get(os.path.splitext(filename)[1])
+  if mimetype is None:
+    raise NotFound()
+  for encoding, suffix in ENCODINGS:
+    if request.accept_encodings[encoding]:
+      try:
+        response = send_from_directory(directory, filename + suffix, mimetype=mimetype, max_age=MAX_AGE)
+      except NotFound:
+        continue
+      response.content_encoding = encoding
+      break
+  else:
+    response = send_from_directory(directory, filename, mimetype=mimetype, max_age=MAX_AGE)
+  response.vary.add('Accept-Encoding')
+  response.cache_control.immutable = True
+  return response
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+assets_cli = AppGroup('assets', help='Build the fingerprinted static bundles.')
+
+
+@assets_cli.command('build')
+def build_command():
+  """Concatenate, minify and compress the bundles into static/dist."""
+  manifest = build(current_app.static_folder, current_app.static_url_path)
+  dist = os.path.join(current_app.static_folder, DIST)
+  for name, filename in sorted(manifest.items()):
+    sizes = [os.path.getsize(os.path.join(dist, filename + suffix)) for suffix in ('', '.gz', '.br')]
+    click.echo('%-9s %-28s %8d bytes, gzip %7d, brotli %7d' % ((name, filename) + tuple(sizes)))
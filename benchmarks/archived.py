@@ -0,0 +1,86 @@
+#----------------------------------------------------------------------------#
+# Archived-row regression check.
+#
+# Seeds a database, deletes a few venues and artists with
+# DELETE_MODE=archive (so they stay in the tables until their purge jobs
+# run, which this script never does) and walks every page of the /shows feed
+# and every export. Exits non-zero if an archived venue or artist, or one of
+# their shows, turns up in any of them.
+#
+#   python benchmarks/archived.py
+#   DATABASE_URL=postgresql://... python benchmarks/archived.py
+#----------------------------------------------------------------------------#
+import html
+import json
+import os
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['CACHE_BACKEND'] = 'null'
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+from app import create_app
+
+# the purge jobs must not run: the archived rows have to stay
+app = create_app(WTF_CSRF_ENABLED=False, DELETE_MODE='archive', JOBS_WORKERS=0)
+
+ARCHIVED = {
+  'venues': [1, 2, 3],
+  'artists': [1, 2, 3],
+}
+LINK = re.compile(r'href="/(venues|artists)/(\d+)"')
+NEXT = re.compile(r'href="(/shows\?[^"]*cursor=[^"]*)"')
+
+
+def feed(client, when):
+  # the venue and artist links on every page of the feed
+  links, url = [], '/shows' + ('?when=' + when if when else '')
+  while url:
+    page = client.get(url).get_data(as_text=True)
+    links.extend((kind, int(entity_id)) for kind, entity_id in LINK.findall(page))
+    found = NEXT.search(page)
+    url = html.unescape(found.group(1)) if found else None
+  return links
+
+
+def exported(client, kind):
+  rows = client.get('/api/v1/export/%s' % kind).get_data(as_text=True).splitlines()
+  return [json.loads(row) for row in rows]
+
+
+def main():
+  with app.app_context():
+    datagen.seed(venues=50, artists=50, shows=5000)
+    client = app.test_client()
+    for kind, ids in ARCHIVED.items():
+      for entity_id in ids:
+        client.get('/%s/%d/delete' % (kind, entity_id))
+    archived = set((kind, entity_id) for kind, ids in ARCHIVED.items() for entity_id in ids)
+
+    failures = []
+    for when in (None, 'upcoming', 'past'):
+      found = archived & set(feed(client, when))
+      if found:
+        failures.append('/shows%s links to %s' % ('?when=' + when if when else '', sorted(found)))
+    for kind in ('venues', 'artists'):
+      found = set(ARCHIVED[kind]) & set(row['id'] for row in exported(client, kind))
+      if found:
+        failures.append('/api/v1/export/%s lists %s' % (kind, sorted(found)))
+    shows = [row for row in exported(client, 'shows')
+             if row['venue_id'] in ARCHIVED['venues'] or row['artist_id'] in ARCHIVED['artists']]
+    if shows:
+      failures.append('/api/v1/export/shows lists %d shows of archived rows' % len(shows))
+
+    for failure in failures:
+      print('FAIL: ' + failure)
+    if failures:
+      sys.exit(1)
+    print('OK: no archived venues, artists or shows in the feed or exports')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,164 @@
+#----------------------------------------------------------------------------#
+# Synthetic data generator.
+#
+# Seeds N venues, artists and shows into the database named by DATABASE_URL
+# (a throwaway SQLite file when unset). Cities and genres follow a Zipf-like
+# skew, so a few big markets and popular genres dominate as they do in real
+# catalogs; shows are spread two years back and one year ahead. Show
+# counters and the counter watermark are written consistently. Venues are
+# scattered around their city's point in the Geocode table (geocodes.csv).
+#
+# The target database is dropped and recreated: never point this at data you
+# want to keep.
+#
+#   python benchmarks/datagen.py --venues 10000 --artists 10000 --shows 100000
+#----------------------------------------------------------------------------#
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from sqlalchemy import text
+
+import geo
+import search
+from forms import Genres
+from models import db, Venue, Artist, Show, CounterWatermark
+
+CITIES = [
+  ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Houston', 'TX'),
+  ('San Francisco', 'CA'), ('Austin', 'TX'), ('Seattle', 'WA'), ('Nashville', 'TN'),
+  ('New Orleans', 'LA'), ('Atlanta', 'GA'), ('Boston', 'MA'), ('Denver', 'CO'),
+  ('Portland', 'OR'), ('Philadelphia', 'PA'), ('Miami', 'FL'), ('Detroit', 'MI'),
+  ('Minneapolis', 'MN'), ('Phoenix', 'AZ'), ('Las Vegas', 'NV'), ('San Diego', 'CA'),
+  ('Oakland', 'CA'), ('Memphis', 'TN'), ('Kansas City', 'MO'), ('Baltimore', 'MD'),
+  ('Salt Lake City', 'UT'), ('Raleigh', 'NC'), ('Columbus', 'OH'), ('Richmond', 'VA'),
+]
+GENRES = Genres.fetch_genres()
+NAME_WORDS = ['Blue', 'Velvet', 'Echo', 'Neon', 'Golden', 'Midnight', 'Electric', 'Silver',
+              'Wild', 'Crimson', 'Hollow', 'Lucky', 'Paper', 'Iron', 'Little', 'Royal']
+VENUE_WORDS = ['Hall', 'Room', 'Lounge', 'Club', 'Theatre', 'Bar', 'Garden', 'Stage']
+ARTIST_WORDS = ['Band', 'Quartet', 'Collective', 'Trio', 'Orchestra', 'Sound', 'Project']
+
+BATCH = 10000
+
+
+def zipf_weights(n, s=1.1):
+  return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+CITY_WEIGHTS = zipf_weights(len(CITIES))
+GENRE_WEIGHTS = zipf_weights(len(GENRES))
+
+
+def _genres(rng):
+  return sorted(set(rng.choices(GENRES, GENRE_WEIGHTS, k=rng.randint(1, 3))))
+
+
+def _entity(rng, i, words):
+  city, state = rng.choices(CITIES, CITY_WEIGHTS)[0]
+  name = '%s %s %s %d' % (rng.choice(NAME_WORDS), rng.choice(NAME_WORDS), rng.choice(words), i)
+  return {
+    "id": i, "name": name, "city": city, "state": state,
+    "phone": '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+    "genres": _genres(rng),
+    "image_link": 'https://example.com/img/%d.jpg' % i,
+    "facebook_link": 'https://www.facebook.com/%d' % i,
+    "website_link": 'https://example.com/%d' % i,
+    "seeking_description": 'Looking for great shows.',
+    "upcoming_shows_count": 0, "past_shows_count": 0,
+  }
+
+
+def position(rng, city, state, spread=0.08):
+  # a point around the city's geocode; spread is the standard deviation in
+  # degrees (0.08 is about 9km)
+  latitude, longitude = geo.locate(city, state)
+  latitude = max(-90.0, min(90.0, rng.gauss(latitude, spread)))
+  longitude = max(-180.0, min(180.0, rng.gauss(longitude, spread)))
+  return geo.position((latitude, longitude))
+
+
+def _insert(table, rows):
+  for start in range(0, len(rows), BATCH):
+    db.session.execute(table.insert(), rows[start:start + BATCH])
+
+
+def seed(venues=1000, artists=1000, shows=10000, rng_seed=42, now=None):
+  # returns the wall-clock seconds spent seeding
+  started = time.perf_counter()
+  rng = random.Random(rng_seed)
+  if now is None:
+    now = datetime.now()
+
+  db.session.remove()
+  db.drop_all()
+  db.create_all()
+  search.reset_sqlite_index()
+  geo.load_geocodes()
+
+  # positions draw from their own stream, so the rest of the data doesn't
+  # depend on them
+  places = random.Random(rng_seed + 1)
+  venue_rows = []
+  for i in range(1, venues + 1):
+    row = _entity(rng, i, VENUE_WORDS)
+    row["address"] = '%d Main Street' % rng.randint(1, 9999)
+    row["seeking_talent"] = rng.random() < 0.4
+    row.update(position(places, row["city"], row["state"]))
+    venue_rows.append(row)
+  artist_rows = []
+  for i in range(1, artists + 1):
+    row = _entity(rng, i, ARTIST_WORDS)
+    row["seeking_venue"] = rng.random() < 0.5
+    artist_rows.append(row)
+
+  # popular venues and artists host most of the shows
+  venue_weights = zipf_weights(venues, 0.8)
+  artist_weights = zipf_weights(artists, 0.8)
+  show_venues = rng.choices(range(1, venues + 1), venue_weights, k=shows) if venues else []
+  show_artists = rng.choices(range(1, artists + 1), artist_weights, k=shows) if artists else []
+  show_rows = []
+  for venue_id, artist_id in zip(show_venues, show_artists):
+    start_time = (now + timedelta(minutes=rng.randint(-2 * 365 * 24 * 60, 365 * 24 * 60))) \
+      .replace(second=0, microsecond=0)
+    show_rows.append({"venue_id": venue_id, "artist_id": artist_id, "start_time": start_time,
+                      "end_time": start_time + timedelta(minutes=rng.choice((60, 90, 120, 180)))})
+    counter = "upcoming_shows_count" if start_time > now else "past_shows_count"
+    venue_rows[venue_id - 1][counter] += 1
+    artist_rows[artist_id - 1][counter] += 1
+
+  _insert(Venue.__table__, venue_rows)
+  _insert(Artist.__table__, artist_rows)
+  _insert(Show.__table__, show_rows)
+  db.session.add(CounterWatermark(id=1, rolled_over_at=now))
+  db.session.commit()
+  db.session.execute(text('ANALYZE'))
+  db.session.commit()
+  return time.perf_counter() - started
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Seed synthetic venues, artists and shows.')
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--shows', type=int, default=10000)
+  parser.add_argument('--seed', type=int, default=42)
+  args = parser.parse_args()
+  from app import create_app
+  with create_app().app_context():
+    seconds = seed(args.venues, args.artists, args.shows, args.seed)
+  print('Seeded %d venues, %d artists, %d shows into %s in %.1fs'
+        % (args.venues, args.artists, args.shows, os.environ['DATABASE_URL'], seconds))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,97 @@
+#----------------------------------------------------------------------------#
+# Benchmark: deleting venues.
+#
+# Seeds N venues and artists (and --shows shows, zipf-distributed, so the
+# first venues carry long histories) with datagen.py, then deletes the
+# --deletes venues with the most shows three ways, reseeding in between:
+#
+#   per-row   the old ORM delete: the venue's shows loaded and deleted one
+#             by one, then the venue
+#   hard      GET /venues/<id>/delete with DELETE_MODE=hard: set-based
+#             DELETEs, the counters recounted by a queued job
+#   archive   the same with DELETE_MODE=archive: one UPDATE, the purge
+#             queued; then the time the purge job takes in a worker
+#
+#   python benchmarks/deletes.py
+#   python benchmarks/deletes.py --size 10000 --shows 1000000 --deletes 20
+#----------------------------------------------------------------------------#
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+import jobs
+from app import create_app
+from models import db, Show, Venue
+
+# the in-process pool stays off: the purge jobs are run by hand
+app = create_app(WTF_CSRF_ENABLED=False, JOBS_WORKERS=0)
+
+
+def report(label, timings):
+  timings = sorted(timings)
+  print('  %-30s %10.2f %10.2f' % (label, statistics.median(timings), timings[-1]))
+
+
+def largest(count):
+  # the ids and show counts of the `count` venues with the most shows
+  return db.session.query(Show.venue_id, db.func.count()).group_by(Show.venue_id) \
+    .order_by(db.func.count().desc()).limit(count).all()
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Time venue deletes: per-row ORM, set-based, and archived.')
+  parser.add_argument('--size', type=int, default=1000, help='Venues, and artists.')
+  parser.add_argument('--shows', type=int, default=100000)
+  parser.add_argument('--deletes', type=int, default=10)
+  args = parser.parse_args()
+
+  with app.app_context():
+    client = app.test_client()
+
+    seconds = datagen.seed(venues=args.size, artists=args.size, shows=args.shows)
+    print('Seeded %d venues, %d artists and %d shows in %.1fs' % (args.size, args.size, args.shows, seconds))
+    venues = largest(args.deletes)
+    print('Deleting %d venues with %d to %d shows each' % (len(venues), venues[-1][1], venues[0][1]))
+    print('  %-30s %10s %10s' % ('step', 'p50 ms', 'max ms'))
+
+    timings = []
+    for venue_id, _ in venues:
+      started = time.perf_counter()
+      venue = Venue.query.get(venue_id)
+      for show in Show.query.filter(Show.venue_id == venue_id):
+        db.session.delete(show)
+      db.session.delete(venue)
+      db.session.commit()
+      timings.append((time.perf_counter() - started) * 1000)
+    report('per-row', timings)
+
+    for mode in ('hard', 'archive'):
+      datagen.seed(venues=args.size, artists=args.size, shows=args.shows)
+      app.config['DELETE_MODE'] = mode
+      timings = []
+      for venue_id, _ in venues:
+        started = time.perf_counter()
+        client.get('/venues/%d/delete' % venue_id)
+        timings.append((time.perf_counter() - started) * 1000)
+      report(mode, timings)
+
+      timings = []
+      for job in jobs.claim('benchmark', timedelta(minutes=5), limit=len(venues) * 2):
+        started = time.perf_counter()
+        jobs.run(job)
+        timings.append((time.perf_counter() - started) * 1000)
+      report('  its %s jobs' % ('purge' if mode == 'archive' else 'recount'), timings)
+      left = db.session.query(Show).filter(Show.venue_id.in_([venue_id for venue_id, _ in venues])).count()
+      print('  %-30s %10d' % ('  shows left', left))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,100 @@
+#----------------------------------------------------------------------------#
+# Benchmark: the background job queue.
+#
+# Seeds N venues and artists (and 10N shows) with datagen.py, then
+#
+#   post      times POST /shows/create, which books the show and queues the
+#             cache warming of its venue, artist and calendar month
+#   inline    times the same warming run inside the request instead
+#   drain     queues --jobs warm_pages jobs and times how fast 1, 2 and 4
+#             worker threads empty the queue
+#
+#   python benchmarks/jobs.py
+#   python benchmarks/jobs.py --size 10000 --requests 200 --jobs 2000
+#----------------------------------------------------------------------------#
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+import jobs
+from app import create_app, warm_pages, page_cache
+from models import db, Job
+
+# the in-process pool stays off: this script runs the workers itself
+app = create_app(WTF_CSRF_ENABLED=False, JOBS_WORKERS=0)
+
+
+def report(label, timings):
+  timings = sorted(timings)
+  p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+  print('  %-30s %10.2f %10.2f' % (label, statistics.median(timings), p95))
+
+
+def booking(rng, size):
+  start_time = datetime.now() + timedelta(days=rng.randint(1, 365), hours=rng.randint(0, 23))
+  return {'venue_id': str(rng.randint(1, size)), 'artist_id': str(rng.randint(1, size)),
+          'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Time booking POSTs with queued side effects, and queue throughput.')
+  parser.add_argument('--size', type=int, default=1000, help='Venues, and artists.')
+  parser.add_argument('--requests', type=int, default=100)
+  parser.add_argument('--jobs', type=int, default=1000)
+  args = parser.parse_args()
+
+  with app.app_context():
+    seconds = datagen.seed(venues=args.size, artists=args.size, shows=args.size * 10)
+    print('Seeded %d venues and %d artists in %.1fs' % (args.size, args.size, seconds))
+    client = app.test_client()
+    rng = random.Random(7)
+    print('  %-30s %10s %10s' % ('step', 'p50 ms', 'p95 ms'))
+
+    timings = []
+    for _ in range(args.requests):
+      data = booking(rng, args.size)
+      started = time.perf_counter()
+      client.post('/shows/create', data=data)
+      timings.append((time.perf_counter() - started) * 1000)
+    report('post (warming queued)', timings)
+
+    queued = [job.payload for job in Job.query.filter(Job.kind == 'warm_pages')]
+    timings = []
+    for payload in queued:
+      page_cache().clear()
+      started = time.perf_counter()
+      warm_pages(payload)
+      timings.append((time.perf_counter() - started) * 1000)
+    db.session.remove()
+    report('  warming, were it inline', timings)
+
+    for workers in (1, 2, 4):
+      Job.query.delete()
+      for _ in range(args.jobs):
+        data = booking(rng, args.size)
+        jobs.enqueue('warm_pages', {"venues" : [int(data['venue_id'])], "artists" : [int(data['artist_id'])],
+                                    "calendars" : [[int(data['venue_id']), data['start_time'][:7]]]})
+      db.session.commit()
+      page_cache().clear()
+      pool = jobs.Pool(app, workers, 0.05, timedelta(minutes=5))
+      started = time.perf_counter()
+      pool.start()
+      while db.session.query(Job).filter(Job.status != 'done').count():
+        db.session.remove()
+        time.sleep(0.05)
+      elapsed = time.perf_counter() - started
+      pool.stop()
+      print('  drain %d jobs, %d worker(s): %6.0f jobs/s' % (args.jobs, workers, args.jobs / elapsed))
+
+
+if __name__ == '__main__':
+  main()
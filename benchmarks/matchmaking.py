@@ -0,0 +1,118 @@
+#----------------------------------------------------------------------------#
+# Benchmark: artist-venue matchmaking.
+#
+# Seeds N venues and artists (and 5N shows) with datagen.py and times
+#
+#   build     the first load of both sides into the NumPy arrays
+#   refresh   picking up --edits edited venues, and a refresh with no changes
+#   rank      recommendations for random artists and venues
+#   python    the same scoring as a plain Python loop over the loaded rows,
+#             which must agree with the NumPy ranking
+#
+#   python benchmarks/matchmaking.py
+#   python benchmarks/matchmaking.py --size 1000000 --queries 50
+#----------------------------------------------------------------------------#
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+from sqlalchemy import update
+
+import matchmaking
+from app import create_app
+from models import db, Venue, Artist
+
+app = create_app()
+
+
+def python_rank(matchmaker, for_artist, entity_id, limit):
+  # the matchmaking score, one candidate at a time
+  model, candidates = (Artist, matchmaker.venues) if for_artist else (Venue, matchmaker.artists)
+  entity = db.session.query(model.genres, model.city, model.state).filter(model.id == entity_id).one()
+  history = matchmaking.past_shows_together(for_artist, entity_id)
+  mask = matchmaking.genre_mask(entity.genres)
+  city, state = matchmaker.codes.place(entity.city, entity.state)
+  city, state = city or -1, state or -1
+  scored = []
+  for row in range(candidates.size):
+    if not candidates.seeking[row]:
+      continue
+    union = bin(int(candidates.masks[row]) | mask).count('1')
+    genre = bin(int(candidates.masks[row]) & mask).count('1') / union if union else 0.0
+    location = 1.0 if candidates.cities[row] == city else 0.5 if candidates.states[row] == state else 0.0
+    entity_id = int(candidates.ids[row])
+    history_score = matchmaking.history_score(history.get(entity_id, 0))
+    score = round(matchmaking.WEIGHTS["genre"] * genre + matchmaking.WEIGHTS["location"] * location
+                  + matchmaking.WEIGHTS["history"] * history_score, matchmaking.SCORE_DECIMALS)
+    scored.append((-score, entity_id))
+  scored.sort()
+  return [entity_id for _, entity_id in scored[:limit]]
+
+
+def timed(run):
+  started = time.perf_counter()
+  result = run()
+  return result, (time.perf_counter() - started) * 1000
+
+
+def report(label, timings):
+  timings = sorted(timings)
+  p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+  print('  %-26s %10.2f %10.2f' % (label, statistics.median(timings), p95))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Time matchmaking builds, refreshes and rankings.')
+  parser.add_argument('--size', type=int, default=100000, help='Venues, and artists.')
+  parser.add_argument('--queries', type=int, default=20)
+  parser.add_argument('--edits', type=int, default=100)
+  parser.add_argument('--limit', type=int, default=10)
+  args = parser.parse_args()
+
+  with app.app_context():
+    seconds = datagen.seed(venues=args.size, artists=args.size, shows=args.size * 5)
+    print('Seeded %d venues and %d artists in %.1fs' % (args.size, args.size, seconds))
+    # seeded long ago, so that refreshes only see the edits below
+    for model in (Venue, Artist):
+      db.session.execute(update(model).values(updated_at=datetime.now() - timedelta(days=1)))
+    db.session.commit()
+    matchmaker = matchmaking.Matchmaker()
+    rng = random.Random(7)
+    print('  %-26s %10s %10s' % ('step', 'p50 ms', 'p95 ms'))
+
+    loaded, ms = timed(matchmaker.refresh)
+    report('build (%d rows)' % loaded, [ms])
+    for venue_id in rng.sample(range(1, args.size + 1), args.edits):
+      venue = db.session.get(Venue, venue_id)
+      venue.genres = rng.sample(datagen.GENRES, 2)
+      venue.seeking_talent = True
+    db.session.commit()
+    loaded, ms = timed(matchmaker.refresh)
+    assert loaded == args.edits, loaded
+    report('refresh (%d edited)' % args.edits, [ms])
+    report('refresh (no changes)', [timed(matchmaker.refresh)[1] for _ in range(args.queries)])
+
+    for for_artist, label in ((True, 'venues for an artist'), (False, 'artists for a venue')):
+      numpy_timings, python_timings = [], []
+      for entity_id in rng.sample(range(1, args.size + 1), args.queries):
+        ranked, ms = timed(lambda: matchmaker.rank(for_artist, entity_id, args.limit))
+        numpy_timings.append(ms)
+        expected, ms = timed(lambda: python_rank(matchmaker, for_artist, entity_id, args.limit))
+        python_timings.append(ms)
+        assert [candidate["id"] for candidate in ranked] == expected, (for_artist, entity_id)
+        db.session.remove()
+      report('rank %s' % label, numpy_timings)
+      report('  python loop', python_timings)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,136 @@
+#----------------------------------------------------------------------------#
+# Benchmark: /venues/nearby.
+#
+# Seeds N venues (1M by default): most clustered around the cities of the
+# Geocode table, weighted Zipf-like, the rest scattered over the continental
+# US. It then times radius searches (geo.within) and k-nearest searches
+# (geo.nearest) from city centres and from random points. Each radius search
+# is also run as a plain bounding-box query, which no index can seek and so
+# reads every venue, and both must find the same venues.
+#
+#   python benchmarks/nearby.py
+#   python benchmarks/nearby.py --venues 100000 --queries 50
+#   DATABASE_URL=postgresql://... python benchmarks/nearby.py
+#
+# The database is dropped and recreated (see datagen.py).
+#----------------------------------------------------------------------------#
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+from sqlalchemy import select, text
+
+import geo
+from app import create_app
+from models import db, Venue, Geocode
+
+app = create_app()
+
+# continental US
+SOUTH, NORTH, WEST, EAST = 25.0, 49.0, -124.0, -67.0
+RADII_KM = (5, 30, 100)
+KS = (10, 50)
+# what /venues/nearby returns by default
+LIMIT = 100
+BATCH = 10000
+
+
+def seed(venues, rng_seed=42):
+  rng = random.Random(rng_seed)
+  datagen.seed(venues=0, artists=0, shows=0)
+  cities = db.session.query(Geocode.city, Geocode.state, Geocode.latitude, Geocode.longitude).all()
+  rng.shuffle(cities)
+  weights = datagen.zipf_weights(len(cities))
+  started = time.perf_counter()
+  for start in range(1, venues + 1, BATCH):
+    rows = []
+    for i in range(start, min(start + BATCH, venues + 1)):
+      if rng.random() < 0.8:
+        city, state, latitude, longitude = rng.choices(cities, weights)[0]
+        latitude, longitude = rng.gauss(latitude, 0.15), rng.gauss(longitude, 0.15)
+      else:
+        city, state = None, None
+        latitude, longitude = rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)
+      rows.append(dict(geo.position((latitude, longitude)), id=i, name='Venue %d' % i,
+                       city=city, state=state, upcoming_shows_count=0, past_shows_count=0))
+    db.session.execute(Venue.__table__.insert(), rows)
+  db.session.commit()
+  db.session.execute(text('ANALYZE'))
+  db.session.commit()
+  return cities, time.perf_counter() - started
+
+
+def box_scan(latitude, longitude, radius_km):
+  # the same search without the geohash index
+  south, west, north, east = geo.bounding_box(latitude, longitude, radius_km)
+  rows = db.session.execute(select(Venue.id, Venue.latitude, Venue.longitude)
+    .where(Venue.latitude.between(south, north), Venue.longitude.between(west, east))).all()
+  return set(venue_id for venue_id, venue_latitude, venue_longitude in rows
+             if geo.distance_km(latitude, longitude, venue_latitude, venue_longitude) <= radius_km)
+
+
+def timed(run):
+  started = time.perf_counter()
+  result = run()
+  return result, (time.perf_counter() - started) * 1000
+
+
+def report(label, timings, scanned, found):
+  timings = sorted(timings)
+  p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+  print('  %-22s %9.2f %9.2f %10.0f %10.0f' % (label, statistics.median(timings), p95,
+                                              statistics.mean(scanned), statistics.mean(found)))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Time radius and k-nearest venue searches.')
+  parser.add_argument('--venues', type=int, default=1000000)
+  parser.add_argument('--queries', type=int, default=20, help='Search points per case.')
+  parser.add_argument('--no-baseline', action='store_true', help='Skip the bounding-box scans.')
+  args = parser.parse_args()
+
+  with app.app_context():
+    cities, seconds = seed(args.venues)
+    print('Seeded %d venues in %.1fs into %s' % (args.venues, seconds, os.environ['DATABASE_URL']))
+    rng = random.Random(7)
+    points = [(latitude, longitude) for _, _, latitude, longitude in rng.sample(cities, args.queries // 2)]
+    points += [(rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)) for _ in range(args.queries - len(points))]
+
+    print('  %-22s %9s %9s %10s %10s' % ('search', 'p50 ms', 'p95 ms', 'rows read', 'found'))
+    for radius in RADII_KM:
+      timings, baseline, scanned, found = [], [], [], []
+      for latitude, longitude in points:
+        (venues, count, read), ms = timed(lambda: geo.within(latitude, longitude, radius, LIMIT))
+        timings.append(ms)
+        scanned.append(read)
+        found.append(count)
+        if not args.no_baseline:
+          expected, ms = timed(lambda: box_scan(latitude, longitude, radius))
+          baseline.append(ms)
+          assert len(expected) == count, (latitude, longitude, radius)
+          assert expected.issuperset(venue["id"] for venue in venues), (latitude, longitude, radius)
+        db.session.remove()
+      report('within %d km' % radius, timings, scanned, found)
+      if baseline:
+        report('  bounding-box scan', baseline, [args.venues], found)
+    for k in KS:
+      timings, scanned, found = [], [], []
+      for latitude, longitude in points:
+        (venues, read), ms = timed(lambda: geo.nearest(latitude, longitude, k))
+        timings.append(ms)
+        scanned.append(read)
+        found.append(len(venues))
+        db.session.remove()
+      report('nearest %d' % k, timings, scanned, found)
+
+
+if __name__ == '__main__':
+  main()
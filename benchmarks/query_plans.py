@@ -0,0 +1,122 @@
+#----------------------------------------------------------------------------#
+# Query-plan regression check.
+#
+# Seeds a database, drives each read route through the Flask test client,
+# captures every SELECT it issues and runs EXPLAIN on it. Exits non-zero if
+# any statement reads the Show table with a sequential scan (or, on SQLite,
+# a throwaway automatic index) instead of one of its indexes.
+#
+#   python benchmarks/query_plans.py                      # throwaway SQLite
+#   DATABASE_URL=postgresql://... python benchmarks/query_plans.py
+#
+# The Postgres database must be disposable: the script drops and recreates
+# the schema. On Postgres, sequential scans are disabled while explaining so
+# the planner reports whether an index *can* serve the query, independent of
+# how small the seeded tables are.
+#----------------------------------------------------------------------------#
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['CACHE_BACKEND'] = 'null'
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db
+
+app = create_app()
+
+TABLE = 'Show'
+
+ROUTES = [
+  ('GET', '/', None),
+  ('GET', '/venues', None),
+  ('GET', '/venues?genre=Jazz&state=CA&seeking=yes', None),
+  ('GET', '/artists?genre=Rock_n_Roll&city=San+Francisco', None),
+  ('GET', '/shows', None),
+  ('GET', '/shows?when=upcoming', None),
+  ('GET', '/shows?when=past', None),
+  ('GET', '/venues/1', None),
+  ('GET', '/artists/1', None),
+  ('GET', '/venues/1/calendar?month=2026-10', None),
+  ('POST', '/venues/search', {'search_term': 'Hall'}),
+  ('POST', '/artists/search', {'search_term': 'Band'}),
+  ('GET', '/api/v1/artists/available?genre=Jazz&date=2026-12-01', None),
+]
+
+
+def capture(client, method, url, data):
+  statements = []
+
+  def record(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+      statements.append((statement, parameters))
+
+  event.listen(db.engine, 'before_cursor_execute', record)
+  try:
+    response = client.open(url, method=method, data=data)
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', record)
+  assert response.status_code == 200, (url, response.status_code)
+  return statements
+
+
+def postgres_seq_scans(plan):
+  found = []
+  if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') == TABLE:
+    found.append(plan['Node Type'] + ' on ' + TABLE)
+  for child in plan.get('Plans', []):
+    found.extend(postgres_seq_scans(child))
+  return found
+
+
+def explain(conn, statement, parameters):
+  if conn.dialect.name == 'postgresql':
+    conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).fetchall()
+    plan = rows[0][0]
+    if isinstance(plan, str):
+      plan = json.loads(plan)
+    return postgres_seq_scans(plan[0]['Plan'])
+  rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+  details = [row[-1] for row in rows]
+  # an AUTOMATIC index is built from a full scan on every execution
+  scans = []
+  for detail in details:
+    words = detail.split(' ')
+    if words[0] in ('SCAN', 'SEARCH') and words[1].strip('"') == TABLE \
+       and ('INDEX' not in detail or 'AUTOMATIC' in detail):
+      scans.append(detail)
+  return scans
+
+
+def main():
+  failures = 0
+  with app.app_context():
+    datagen.seed(venues=200, artists=200, shows=5000)
+    client = app.test_client()
+    for method, url, data in ROUTES:
+      statements = capture(client, method, url, data)
+      with db.engine.connect() as conn:
+        for statement, parameters in statements:
+          with conn.begin():
+            scans = explain(conn, statement, parameters)
+          if scans:
+            failures += 1
+            print('FAIL %s %s: %s\n  %s' % (method, url, '; '.join(scans), ' '.join(statement.split())))
+      print('%-4s %-24s %2d statements checked' % (method, url, len(statements)))
+  if failures:
+    print('%d statement(s) scan the %s table sequentially' % (failures, TABLE))
+    return 1
+  print('OK: no sequential scans on %s' % TABLE)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,94 @@
+#----------------------------------------------------------------------------#
+# Benchmark: show list rendering.
+#
+# Renders pages/shows.html for N shows twice: once the old way (start times
+# passed as strings and parsed back with dateutil, babel pattern and locale
+# resolved on every call) and once with the current filter and native
+# datetimes. Checks that both produce the same HTML.
+#
+#   python benchmarks/render_datetimes.py
+#   python benchmarks/render_datetimes.py 10000 --repeat 5
+#----------------------------------------------------------------------------#
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'render.db'))
+
+import babel.dates
+import dateutil.parser
+from flask import render_template
+
+from app import create_app, datetime_formatter, format_datetime
+
+app = create_app()
+
+
+def legacy_format_datetime(value, format='medium'):
+  # the filter as it was: string in, dateutil parse, pattern resolved per call
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def make_shows(count):
+  rng = random.Random(count)
+  now = datetime.now().replace(second=0, microsecond=0)
+  return [{
+    "venue_id": rng.randint(1, 1000),
+    "venue_name": 'Venue %d' % i,
+    "artist_id": rng.randint(1, 1000),
+    "artist_name": 'Artist %d' % i,
+    "artist_image_link": 'https://example.com/img/%d.jpg' % i,
+    "start_time": now + timedelta(minutes=rng.randint(-365 * 24 * 60, 365 * 24 * 60)),
+  } for i in range(count)]
+
+
+def render(shows, datetime_filter, repeat):
+  app.jinja_env.filters['datetime'] = datetime_filter
+  best = None
+  with app.test_request_context('/shows'):
+    for _ in range(repeat):
+      datetime_formatter.cache_clear()  # every render starts cold
+      started = time.perf_counter()
+      html = render_template('pages/shows.html', shows=shows, when=None, next_cursor=None)
+      elapsed = time.perf_counter() - started
+      best = elapsed if best is None else min(best, elapsed)
+  return best, html
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare shows.html render time with the old and new datetime filter.')
+  parser.add_argument('shows', nargs='?', type=int, default=10000)
+  parser.add_argument('--repeat', type=int, default=3, help='renders per variant; the best one counts')
+  args = parser.parse_args()
+
+  native = make_shows(args.shows)
+  stringified = [dict(show, start_time=str(show["start_time"])) for show in native]
+  try:
+    before, old_html = render(stringified, legacy_format_datetime, args.repeat)
+    after, new_html = render(native, format_datetime, args.repeat)
+  finally:
+    app.jinja_env.filters['datetime'] = format_datetime
+
+  print('%d shows' % args.shows)
+  print('  before  %8.1f ms' % (before * 1000))
+  print('  after   %8.1f ms  (%.1fx)' % (after * 1000, before / after))
+  if old_html != new_html:
+    print('FAIL: rendered HTML differs')
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,175 @@
+#----------------------------------------------------------------------------#
+# Route benchmark.
+#
+# For each data size, seeds the database with benchmarks/datagen.py, then
+# drives every route in app.py through the Flask test client and records
+# p50/p95 latency and the number of SQL statements per request. The report
+# is written as JSON so runs from different commits can be compared.
+#
+#   python benchmarks/routes.py --sizes 1000,10000 --out bench.json
+#   python benchmarks/routes.py --sizes 1000,10000 --compare bench.json
+#
+# Sizes are venue counts; artists match venues and there are ten shows per
+# venue. The page and fragment caches are off (CACHE_BACKEND=null,
+# FRAGMENT_CACHE_BACKEND=null) unless set explicitly.
+#----------------------------------------------------------------------------#
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('CACHE_BACKEND', 'null')
+os.environ.setdefault('FRAGMENT_CACHE_BACKEND', 'null')
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db
+
+app = create_app()
+
+SHOWS_PER_VENUE = 10
+
+
+def routes(size, rng):
+  # (name, method, url, form data); ids are drawn fresh for every request
+  def venue_id():
+    return rng.randint(1, size)
+
+  def artist_id():
+    return rng.randint(1, size)
+
+  def month():
+    return (datetime.now() + timedelta(days=rng.randint(-730, 365))).strftime('%Y-%m')
+
+  def booking(**ids):
+    start_time = datetime.now() + timedelta(days=rng.randint(1, 365))
+    return {'venue_id': str(ids.get('venue_id', venue_id())),
+            'artist_id': str(ids.get('artist_id', artist_id())),
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+  return [
+    ('index', lambda: ('GET', '/', None)),
+    ('venues', lambda: ('GET', '/venues', None)),
+    ('artists', lambda: ('GET', '/artists', None)),
+    ('shows', lambda: ('GET', '/shows', None)),
+    ('show_venue', lambda: ('GET', '/venues/%d' % venue_id(), None)),
+    ('show_artist', lambda: ('GET', '/artists/%d' % artist_id(), None)),
+    ('venue_calendar', lambda: ('GET', '/venues/%d/calendar?month=%s' % (venue_id(), month()), None)),
+    ('search_venues', lambda: ('POST', '/venues/search', {'search_term': rng.choice(datagen.VENUE_WORDS)})),
+    ('search_artists', lambda: ('POST', '/artists/search', {'search_term': rng.choice(datagen.ARTIST_WORDS)})),
+    ('create_show_submission', lambda: ('POST', '/shows/create', booking())),
+    ('book_venue_submission', lambda: (lambda v: ('POST', '/venues/%d/book' % v, booking(venue_id=v)))(venue_id())),
+    ('book_artist_submission', lambda: (lambda a: ('POST', '/artists/%d/book' % a, booking(artist_id=a)))(artist_id())),
+  ]
+
+
+def percentile(samples, fraction):
+  ordered = sorted(samples)
+  index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+  return ordered[index]
+
+
+def run_size(size, requests):
+  seed_seconds = datagen.seed(venues=size, artists=size, shows=size * SHOWS_PER_VENUE)
+  client = app.test_client()
+  rng = random.Random(size)
+  statements = []
+
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  results = {}
+  event.listen(db.engine, 'before_cursor_execute', count)
+  try:
+    for name, make_request in routes(size, rng):
+      method, url, data = make_request()
+      client.open(url, method=method, data=data)  # warm-up: first-use setup is not measured
+      db.session.remove()
+      latencies, queries = [], []
+      for _ in range(requests):
+        method, url, data = make_request()
+        del statements[:]
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        latencies.append((time.perf_counter() - started) * 1000)
+        # requests share main()'s app context, so end the session as the
+        # request's own teardown would
+        db.session.remove()
+        queries.append(len(statements))
+        if response.status_code >= 400:
+          raise RuntimeError('%s %s returned %d' % (method, url, response.status_code))
+      results[name] = {
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'queries': max(queries),
+      }
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', count)
+  return {'seed_seconds': round(seed_seconds, 2), 'routes': results}
+
+
+def git_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def print_report(report, baseline=None):
+  for size, result in report['sizes'].items():
+    print('\n%s venues (seeded in %.1fs)' % (size, result['seed_seconds']))
+    print('  %-24s %10s %10s %8s' % ('route', 'p50 ms', 'p95 ms', 'queries'))
+    old = ((baseline or {}).get('sizes', {}).get(size) or {}).get('routes', {})
+    for name, row in result['routes'].items():
+      line = '  %-24s %10.2f %10.2f %8d' % (name, row['p50_ms'], row['p95_ms'], row['queries'])
+      if name in old:
+        line += '   p95 %+7.1f%%  queries %+d' % (
+          (row['p95_ms'] / old[name]['p95_ms'] - 1) * 100 if old[name]['p95_ms'] else 0,
+          row['queries'] - old[name]['queries'])
+      print(line)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark every route at several data sizes.')
+  parser.add_argument('--sizes', default='100,1000,10000', help='comma-separated venue counts')
+  parser.add_argument('--requests', type=int, default=50, help='requests per route per size')
+  parser.add_argument('--out', help='write the JSON report here')
+  parser.add_argument('--compare', help='a previous JSON report to diff against')
+  args = parser.parse_args()
+
+  app.config['WTF_CSRF_ENABLED'] = False
+  report = {
+    'commit': git_commit(),
+    'created': datetime.now().isoformat(timespec='seconds'),
+    'database': None,
+    'requests_per_route': args.requests,
+    'sizes': {},
+  }
+  with app.app_context():
+    report['database'] = db.engine.dialect.name
+    for size in [int(size) for size in args.sizes.split(',')]:
+      report['sizes'][str(size)] = run_size(size, args.requests)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  print_report(report, baseline)
+  if args.out:
+    with open(args.out, 'w') as f:
+      json.dump(report, f, indent=2)
+    print('\nReport written to %s' % args.out)
+
+
+if __name__ == '__main__':
+  main()
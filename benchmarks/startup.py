@@ -0,0 +1,111 @@
+#----------------------------------------------------------------------------#
+# Benchmark: worker startup.
+#
+# Measures time-to-first-request for N workers started three ways:
+#
+#   cold+ddl  a fresh interpreter per worker that also runs db.create_all()
+#             twice, as importing models.py and app.py used to
+#   cold      a fresh interpreter per worker (gunicorn without preload_app)
+#   preload   the app imported once and forked per worker (gunicorn.conf.py)
+#
+# Every worker serves GET /venues from a seeded SQLite database.
+#
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --workers 8 --venues 10000
+#----------------------------------------------------------------------------#
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+URL = '/venues'
+
+
+def child(ddl):
+  # runs in the fresh interpreter; reports its own breakdown on stdout
+  started = time.perf_counter()
+  from app import create_app
+  from models import db
+  app = create_app()
+  if ddl:
+    with app.app_context():
+      db.create_all()
+      db.create_all()
+  created = time.perf_counter()
+  response = app.test_client().get(URL)
+  assert response.status_code == 200, response.status_code
+  print(json.dumps({'import_ms': (created - started) * 1000,
+                    'request_ms': (time.perf_counter() - created) * 1000}))
+
+
+def cold_worker(ddl):
+  started = time.perf_counter()
+  output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child'] + (['--ddl'] if ddl else []))
+  total = (time.perf_counter() - started) * 1000
+  return dict(json.loads(output.decode().strip().splitlines()[-1]), total_ms=total)
+
+
+def preloaded_worker(app):
+  from models import db
+  read_end, write_end = os.pipe()
+  started = time.perf_counter()
+  pid = os.fork()
+  if pid == 0:
+    os.close(read_end)
+    # what gunicorn.conf.py's post_fork does
+    with app.app_context():
+      db.engine.dispose()
+    app.extensions['page_cache'].after_fork()
+    forked = time.perf_counter()
+    response = app.test_client().get(URL)
+    os.write(write_end, json.dumps({'import_ms': 0.0, 'request_ms': (time.perf_counter() - forked) * 1000,
+                                    'ok': response.status_code == 200}).encode())
+    os._exit(0)
+  os.close(write_end)
+  with os.fdopen(read_end) as f:
+    result = json.loads(f.read())
+  os.waitpid(pid, 0)
+  assert result.pop('ok')
+  return dict(result, total_ms=(time.perf_counter() - started) * 1000)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Measure time-to-first-request per worker.')
+  parser.add_argument('--workers', type=int, default=4)
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+  parser.add_argument('--ddl', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    return child(args.ddl)
+
+  import datagen  # sets DATABASE_URL, inherited by the child interpreters
+  from app import create_app
+  app = create_app()
+  with app.app_context():
+    datagen.seed(venues=args.venues, artists=args.venues, shows=args.venues * 5)
+
+  runs = [
+    ('cold+ddl', lambda: cold_worker(ddl=True)),
+    ('cold', lambda: cold_worker(ddl=False)),
+    ('preload', lambda: preloaded_worker(app)),
+  ]
+  print('%d workers, %d venues, first request GET %s' % (args.workers, args.venues, URL))
+  print('  %-10s %10s %12s %12s %12s' % ('mode', 'worker', 'import ms', 'request ms', 'total ms'))
+  for name, start_worker in runs:
+    totals = []
+    for worker in range(args.workers):
+      result = start_worker()
+      totals.append(result['total_ms'])
+      print('  %-10s %10d %12.1f %12.1f %12.1f' % (name, worker, result['import_ms'], result['request_ms'], result['total_ms']))
+    print('  %-10s %10s %12s %12s %12.1f' % (name, 'mean', '', '', sum(totals) / len(totals)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,67 @@
+#----------------------------------------------------------------------------#
+# Benchmark: /venues area listing.
+#
+# Seeds a throwaway SQLite database with N venues (and a few shows per venue)
+# using benchmarks/datagen.py and checks that listings.venue_areas() runs a
+# flat number of SQL queries however large the catalog gets.
+#
+#   python benchmarks/venue_listing.py
+#   python benchmarks/venue_listing.py 100 1000 10000 100000
+#----------------------------------------------------------------------------#
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen  # sets DATABASE_URL before the app is imported
+
+from sqlalchemy import event
+
+import listings
+from app import create_app
+from models import db
+
+app = create_app()
+
+
+def measure():
+  statements = []
+
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  event.listen(db.engine, 'before_cursor_execute', count)
+  try:
+    started = time.perf_counter()
+    areas = listings.venue_areas()
+    elapsed = time.perf_counter() - started
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', count)
+    db.session.remove()
+  return len(statements), elapsed, areas
+
+
+def main(sizes):
+  results = []
+  with app.app_context():
+    for size in sizes:
+      datagen.seed(venues=size, artists=100, shows=size * 2)
+      queries, elapsed, areas = measure()
+      venues = sum(len(area["venues"]) for area in areas)
+      assert venues == size, (venues, size)
+      results.append((size, queries, elapsed))
+      print('%8d venues  %3d queries  %8.1f ms' % (size, queries, elapsed * 1000))
+
+  counts = set(queries for _, queries, _ in results)
+  if len(counts) != 1:
+    print('FAIL: query count grows with the catalog: %s' % sorted(counts))
+    return 1
+  print('OK: query count stays at %d' % counts.pop())
+  return 0
+
+
+if __name__ == '__main__':
+  sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 100000]
+  sys.exit(main(sizes))
@@ -0,0 +1,207 @@
+from bisect import bisect_right, insort
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, literal, or_, select
+
+import counters
+import importer
+import listings
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+
+#----------------------------------------------------------------------------#
+# Bookings.
+#
+# A venue cannot host, and an artist cannot play, two shows that overlap in
+# time. Overlaps are found with a range scan on the (venue_id, start_time)
+# and (artist_id, start_time) indexes: a show that overlaps [start, end)
+# started before `end` and, since no show runs longer than
+# MAX_SHOW_DURATION, after `start - MAX_SHOW_DURATION`. Only the rows in that
+# window are checked against end_time.
+#
+# Batches (a venue's season, say) are checked with two IN queries for the
+# referenced rows, one windowed query for the shows they could clash with,
+# and are written with a single multi-row INSERT. `flask import shows`
+# checks its batches the same way (existing_calendar, claim_slot).
+#----------------------------------------------------------------------------#
+
+MAX_BATCH = 1000
+
+class BookingError(ValueError):
+  pass
+
+
+def overlapping(show_fk, entity_id, start_time, end_time):
+  # condition for the shows of one venue or artist that overlap [start_time, end_time)
+  return and_(
+    show_fk == entity_id,
+    Show.start_time > start_time - MAX_SHOW_DURATION,
+    Show.start_time < end_time,
+    Show.end_time > start_time,
+  )
+
+
+def conflicts(venue_id, artist_id, start_time, end_time):
+  # existing shows that would clash with the booking, at the venue or for the artist
+  return Show.query.filter(or_(
+    overlapping(Show.venue_id, venue_id, start_time, end_time),
+    overlapping(Show.artist_id, artist_id, start_time, end_time),
+  )).order_by(Show.start_time).all()
+
+
+def describe(show, venue_id):
+  if show.venue_id == venue_id:
+    return 'the venue already has a show from %s to %s' % (show.start_time, show.end_time)
+  return 'the artist is already playing venue %d from %s to %s' % (show.venue_id, show.start_time, show.end_time)
+
+
+def book(venue_id, artist_id, start_time, duration=DEFAULT_SHOW_DURATION):
+  # adds the show to the session and counts it; the caller commits.
+  # Raises BookingError for an unknown venue or artist or a double booking.
+  end_time = start_time + duration
+  if not timedelta(0) < duration <= MAX_SHOW_DURATION:
+    raise BookingError('A show must last at most %d hours.' % (MAX_SHOW_DURATION.total_seconds() // 3600))
+  # lock both rows so two concurrent bookings of either one are checked in turn
+  venue = Venue.query.filter(Venue.id == venue_id).with_for_update().first()
+  artist = Artist.query.filter(Artist.id == artist_id).with_for_update().first()
+  if venue is None or artist is None:
+    raise BookingError('Venue %s or artist %s does not exist.' % (venue_id, artist_id))
+  clashes = conflicts(venue_id, artist_id, start_time, end_time)
+  if clashes:
+    raise BookingError('Show could not be listed: %s.' % describe(clashes[0], venue_id))
+  show = Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time, end_time=end_time)
+  db.session.add(show)
+  counters.record_show(venue_id, artist_id, start_time)
+  return show
+
+
+def free_artists(genre, day):
+  # artists of `genre` with no show overlapping the given date, in one query;
+  # the NOT EXISTS probe is a range scan on (artist_id, start_time)
+  start_time = datetime.combine(day, time())
+  end_time = start_time + timedelta(days=1)
+  busy = select(literal(1)).where(overlapping(Show.artist_id, Artist.id, start_time, end_time)).exists()
+  return db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.seeking_venue) \
+    .filter(listings.has_genre(Artist, genre), Artist.archived_at.is_(None)) \
+    .filter(~busy) \
+    .order_by(Artist.name, Artist.id).all()
+
+
+class Calendar(object):
+  # the intervals booked per venue and per artist, kept sorted by start
+  def __init__(self):
+    self.booked = {}
+
+  def add(self, key, start_time, end_time, label):
+    insort(self.booked.setdefault(key, []), (start_time, end_time, label))
+
+  def clash(self, key, start_time, end_time):
+    # the first interval of `key` overlapping [start_time, end_time), or None
+    intervals = self.booked.get(key, [])
+    i = bisect_right(intervals, (start_time - MAX_SHOW_DURATION,))
+    for booked_start, booked_end, label in intervals[i:]:
+      if booked_start >= end_time:
+        break
+      if booked_end > start_time:
+        return label
+    return None
+
+
+def existing_calendar(rows):
+  # one query for every show that could clash with a row of the batch
+  venue_ids = set(row['venue_id'] for row in rows)
+  artist_ids = set(row['artist_id'] for row in rows)
+  calendar = Calendar()
+  existing = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time).filter(
+    or_(Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids)),
+    Show.start_time > min(row['start_time'] for row in rows) - MAX_SHOW_DURATION,
+    Show.start_time < max(row['end_time'] for row in rows),
+  )
+  for show in existing:
+    label = 'show %d' % show.id
+    calendar.add(('venue', show.venue_id), show.start_time, show.end_time, label)
+    calendar.add(('artist', show.artist_id), show.start_time, show.end_time, label)
+  return calendar
+
+
+def claim_slot(calendar, values, label):
+  # errors for a {venue_id, artist_id, start_time, end_time} row that
+  # overlaps the calendar; without any, the row is added to it as `label`
+  keys = ((('venue', values['venue_id']), 'venue_id', 'The venue'),
+          (('artist', values['artist_id']), 'artist_id', 'The artist'))
+  errors = {}
+  for key, field, what in keys:
+    clash = calendar.clash(key, values['start_time'], values['end_time'])
+    if clash:
+      errors[field] = ['%s is already booked then (%s)' % (what, clash)]
+  if not errors:
+    for key, _, _ in keys:
+      calendar.add(key, values['start_time'], values['end_time'], label)
+  return errors
+
+
+def _insert_shows(rows):
+  # a single multi-row INSERT; returns the new ids in row order
+  statement = Show.__table__.insert().values(rows)
+  if db.engine.dialect.name == 'postgresql':
+    return [row.id for row in db.session.execute(statement.returning(Show.__table__.c.id))]
+  # SQLite hands out consecutive rowids within one statement, and the
+  # transaction holds the write lock
+  last = db.session.execute(statement).lastrowid
+  return list(range(last - len(rows) + 1, last + 1))
+
+
+def book_many(rows, atomic=False):
+  # Books a list of raw {artist_id, venue_id, start_time[, duration]} rows.
+  # Returns (results, booked): one result dict per row, in order, and the
+  # (venue_id, artist_id, start_time, end_time) of the shows written. Invalid rows are rejected with their
+  # errors; with atomic=True any rejection means nothing is written.
+  # The caller commits.
+  if len(rows) > MAX_BATCH:
+    raise BookingError('At most %d shows can be booked at once.' % MAX_BATCH)
+  results = [None] * len(rows)
+  valid = []
+  for index, raw in enumerate(rows):
+    if not isinstance(raw, dict):
+      results[index] = {"index": index, "status": "rejected", "errors": {"row": ["must be an object"]}}
+      continue
+    values, errors = importer.validate('shows', dict((k, v) for k, v in raw.items() if k != 'id'))
+    if errors:
+      results[index] = {"index": index, "status": "rejected", "errors": errors}
+    else:
+      valid.append((index, values))
+
+  if valid:
+    # lock the referenced rows so concurrent bookings are checked in turn
+    venue_ids = set(values['venue_id'] for _, values in valid)
+    artist_ids = set(values['artist_id'] for _, values in valid)
+    found_venues = set(id for (id,) in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids)).with_for_update())
+    found_artists = set(id for (id,) in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids)).with_for_update())
+    calendar = existing_calendar([values for _, values in valid])
+
+  accepted = []
+  for index, values in valid:
+    errors = {}
+    if values['venue_id'] not in found_venues:
+      errors['venue_id'] = ['Venue %d does not exist' % values['venue_id']]
+    if values['artist_id'] not in found_artists:
+      errors['artist_id'] = ['Artist %d does not exist' % values['artist_id']]
+    if values['end_time'] - values['start_time'] > MAX_SHOW_DURATION:
+      errors['duration'] = ['A show must last at most %d hours' % (MAX_SHOW_DURATION.total_seconds() // 3600)]
+    if not errors:
+      errors = claim_slot(calendar, values, 'row %d' % index)
+    if errors:
+      results[index] = {"index": index, "status": "rejected", "errors": errors}
+      continue
+    accepted.append((index, values))
+
+  if not accepted or (atomic and len(accepted) < len(rows)):
+    for index, _ in accepted:
+      results[index] = {"index": index, "status": "skipped"}
+    return results, []
+
+  ids = _insert_shows([values for _, values in accepted])
+  for (index, _), show_id in zip(accepted, ids):
+    results[index] = {"index": index, "status": "created", "id": show_id}
+  counters.record_shows([(values['venue_id'], values['artist_id'], values['start_time']) for _, values in accepted])
+  return results, [(values['venue_id'], values['artist_id'], values['start_time'], values['end_time'])
+                   for _, values in accepted]
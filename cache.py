@@ -0,0 +1,212 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+#----------------------------------------------------------------------------#
+# Page data cache.
+#
+# Read-through cache for the data behind the venue and artist detail pages,
+# keyed by entity ("venue:1", "artist:4"). Entries expire after a TTL and the
+# least recently used entry is evicted once the cache is full. Write paths
+# call invalidate() for every entity they touch.
+#
+# Backends:
+# - 'memory': per-process OrderedDict. Fastest, but each worker has its own.
+# - 'sqlite': a SQLite file shared by every worker process on the host.
+# - 'null':   caches nothing; useful to compare against.
+#----------------------------------------------------------------------------#
+
+MISSING = object()
+
+
+class Cache(object):
+
+  def __init__(self, ttl=300, max_entries=1024):
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+  def get_or_set(self, key, build, ttl=None):
+    value = self.get(key)
+    if value is not MISSING:
+      self.hits += 1
+      return value
+    self.misses += 1
+    value = build()
+    # None means "not found"; let the caller 404 without pinning that
+    if value is not None:
+      self.set(key, value, ttl)
+    return value
+
+  def invalidate(self, *keys):
+    keys = [key for key in keys if key]
+    if keys:
+      self.invalidations += len(keys)
+      self.delete(*keys)
+
+  def after_fork(self):
+    # called in each new worker process (see gunicorn.conf.py)
+    pass
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      "backend" : self.name,
+      "hits" : self.hits,
+      "misses" : self.misses,
+      "hit_ratio" : (self.hits / lookups) if lookups else 0.0,
+      "invalidations" : self.invalidations,
+      "entries" : len(self),
+      "max_entries" : self.max_entries,
+      "ttl" : self.ttl,
+    }
+
+
+class NullCache(Cache):
+  name = 'null'
+
+  def get(self, key):
+    return MISSING
+
+  def set(self, key, value, ttl=None):
+    pass
+
+  def delete(self, *keys):
+    pass
+
+  def clear(self):
+    pass
+
+  def __len__(self):
+    return 0
+
+
+class MemoryCache(Cache):
+  name = 'memory'
+
+  def __init__(self, ttl=300, max_entries=1024):
+    super().__init__(ttl, max_entries)
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return MISSING
+      expires, value = entry
+      if expires < time.monotonic():
+        del self._entries[key]
+        return MISSING
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl=None):
+    expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+    with self._lock:
+      self._entries[key] = (expires, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def delete(self, *keys):
+    with self._lock:
+      for key in keys:
+        self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+class SqliteCache(Cache):
+  # Values are stored as JSON, so only JSON-serialisable page data belongs here.
+  name = 'sqlite'
+
+  def __init__(self, path, ttl=300, max_entries=1024):
+    super().__init__(ttl, max_entries)
+    self.path = path
+    self._local = threading.local()
+    with self._connect() as conn:
+      conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                   'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                   'expires REAL NOT NULL, used REAL NOT NULL)')
+      conn.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+
+  def after_fork(self):
+    # sqlite3 connections must not cross a fork
+    self._local = threading.local()
+
+  def _connect(self):
+    conn = getattr(self._local, 'conn', None)
+    if conn is None:
+      conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('PRAGMA synchronous=OFF')
+      self._local.conn = conn
+    return conn
+
+  def get(self, key):
+    conn = self._connect()
+    now = time.time()
+    row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      return MISSING
+    if row[1] < now:
+      conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+      return MISSING
+    conn.execute('UPDATE cache SET used = ? WHERE key = ?', (now, key))
+    return json.loads(row[0])
+
+  def set(self, key, value, ttl=None):
+    conn = self._connect()
+    now = time.time()
+    expires = now + (self.ttl if ttl is None else ttl)
+    conn.execute('INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)',
+                 (key, json.dumps(value), expires, now))
+    conn.execute('DELETE FROM cache WHERE key IN ('
+                 'SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+  def delete(self, *keys):
+    self._connect().executemany('DELETE FROM cache WHERE key = ?', [(key,) for key in keys])
+
+  def clear(self):
+    self._connect().execute('DELETE FROM cache')
+
+  def __len__(self):
+    return self._connect().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+def from_config(config, prefix='CACHE_'):
+  # the cache described by <prefix>BACKEND, <prefix>TTL, <prefix>MAX_ENTRIES
+  # and <prefix>PATH
+  backend = config.get(prefix + 'BACKEND', 'memory')
+  ttl = config.get(prefix + 'TTL', 300)
+  max_entries = config.get(prefix + 'MAX_ENTRIES', 1024)
+  if backend == 'memory':
+    return MemoryCache(ttl, max_entries)
+  if backend == 'sqlite':
+    return SqliteCache(config.get(prefix + 'PATH', 'fyyur-cache.db'), ttl, max_entries)
+  if backend == 'null':
+    return NullCache(ttl, max_entries)
+  raise ValueError('Unknown %sBACKEND %r' % (prefix, backend))
+
+
+def venue_key(venue_id):
+  return 'venue:%s' % venue_id
+
+
+def artist_key(artist_id):
+  return 'artist:%s' % artist_id
+
+
+def calendar_key(venue_id, month):
+  # month as 'YYYY-MM'
+  return 'calendar:%s:%s' % (venue_id, month)
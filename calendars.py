@@ -0,0 +1,130 @@
+import calendar
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+import cache
+from models import db, Artist, Show, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+
+#----------------------------------------------------------------------------#
+# Venue calendars.
+#
+# A month of a venue's bookings: per day, its shows and the free slots
+# between them. The month comes from one range query on the
+# (venue_id, start_time) index: a show that touches the month started before
+# its end and, since no show runs longer than MAX_SHOW_DURATION, after its
+# start minus MAX_SHOW_DURATION. Summaries are cached in the page cache under
+# cache.calendar_key(venue_id, month) and invalidated, month by month, by
+# the bookings that touch them (see invalidate_show_pages in app.py).
+#----------------------------------------------------------------------------#
+
+MONTH_FORMAT = '%Y-%m'
+# strftime writes years before 1000 with fewer digits, and the month after
+# 9999-12 (or the MAX_SHOW_DURATION before 0001-01) overflows datetime
+MIN_YEAR, MAX_YEAR = 1000, 9998
+# the shortest gap listed as free: room for a show of the default length
+MIN_FREE_SLOT = DEFAULT_SHOW_DURATION
+
+
+def parse_month(value):
+  # the first of the month for 'YYYY-MM'; ValueError otherwise, and for a
+  # year outside MIN_YEAR..MAX_YEAR
+  month = datetime.strptime(value, MONTH_FORMAT)
+  if not MIN_YEAR <= month.year <= MAX_YEAR:
+    raise ValueError('month out of range: %s' % value)
+  return month
+
+
+def next_month(month):
+  return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def previous_month(month):
+  return (month - timedelta(days=1)).replace(day=1)
+
+
+def months(start_time, end_time):
+  # the 'YYYY-MM' of every month [start_time, end_time) touches
+  month = start_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+  touched = []
+  while month < end_time or not touched:
+    touched.append(month.strftime(MONTH_FORMAT))
+    month = next_month(month)
+  return touched
+
+
+def keys(rows):
+  # the calendar cache keys of (venue_id, start_time, end_time) rows
+  return set(cache.calendar_key(venue_id, month)
+             for venue_id, start_time, end_time in rows
+             for month in months(start_time, end_time))
+
+
+def free_slots(day, shows):
+  # the gaps of at least MIN_FREE_SLOT in the day between `shows`, sorted by start
+  start, end = day, day + timedelta(days=1)
+  free = []
+  for show_start, show_end in shows:
+    if show_start - start >= MIN_FREE_SLOT:
+      free.append((start, show_start))
+    start = max(start, show_end)
+  if end - start >= MIN_FREE_SLOT:
+    free.append((start, end))
+  return free
+
+
+def month_summary(venue_id, month):
+  # the JSON-ready summary of a venue's month, `month` being its first day
+  end = next_month(month)
+  rows = db.session.execute(
+    select(Show.id, Show.artist_id, Artist.name, Show.start_time, Show.end_time)
+    .join(Artist, Artist.id == Show.artist_id)
+    .where(Show.venue_id == venue_id,
+           Artist.archived_at.is_(None),
+           Show.start_time > month - MAX_SHOW_DURATION,
+           Show.start_time < end,
+           Show.end_time > month)
+    .order_by(Show.start_time)).all()
+
+  days = []
+  booked_minutes = 0
+  for number in range(1, calendar.monthrange(month.year, month.month)[1] + 1):
+    day = month.replace(day=number)
+    day_end = day + timedelta(days=1)
+    # the shows that overlap the day, clipped to it
+    overlapping = [(max(row.start_time, day), min(row.end_time, day_end), row) for row in rows
+                   if row.start_time < day_end and row.end_time > day]
+    minutes = sum((end_time - start_time).total_seconds() for start_time, end_time, _ in overlapping) // 60
+    booked_minutes += minutes
+    days.append({
+      "date" : str(day.date()),
+      "shows" : [{
+        "id" : row.id,
+        "artist_id" : row.artist_id,
+        "artist_name" : row.name,
+        "start_time" : str(row.start_time),
+        "end_time" : str(row.end_time),
+      } for _, _, row in overlapping],
+      "free" : [{
+        "start_time" : str(start_time),
+        "end_time" : str(end_time),
+      } for start_time, end_time in free_slots(day, [(start_time, end_time) for start_time, end_time, _ in overlapping])],
+      "booked_minutes" : int(minutes),
+    })
+
+  return {
+    "venue_id" : venue_id,
+    "month" : month.strftime(MONTH_FORMAT),
+    "shows_count" : len(rows),
+    "booked_days" : sum(1 for day in days if day["shows"]),
+    "booked_minutes" : int(booked_minutes),
+    "days" : days,
+  }
+
+
+def weeks(summary):
+  # the summary's days as Monday-first weeks, None outside the month
+  month = parse_month(summary["month"])
+  days = dict((day["date"], day) for day in summary["days"])
+  return [[days.get(str(date)) if date.month == month.month else None for date in week]
+          for week in calendar.Calendar().monthdatescalendar(month.year, month.month)]
@@ -0,0 +1,171 @@
+import functools
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import current_app, make_response, request, session
+from sqlalchemy import func, select
+
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#
+# The venue, artist and show pages answer If-None-Match / If-Modified-Since
+# with 304 Not Modified before their view runs. Each page has a validator:
+# the last time anything on it changed, read from indexes rather than from
+# the rows the page lists:
+#
+# - the updated_at of the venues, artists and shows on it. Edits, bookings
+#   and the show counters bump it; editing an artist also touches the venues
+#   they play (touch_venues_of), and editing a venue its artists
+#   (touch_artists_of), since each page shows the other's name and image.
+# - the start_time of the latest show that has begun, which is when a show
+#   last moved from upcoming to past.
+#
+# Listings add their row count to the ETag so deletes change it too, and
+# ETAG_SALT and the asset bundle names (assets.py) are mixed in so a deploy
+# with new templates or assets doesn't answer 304. Without ETAG_SALT set, a
+# digest of the templates stands in, the same in every worker.
+#
+# The venue and artist pages are rendered from the page cache, which can lag
+# behind the rows. Their validator is read when the cached data is built and
+# kept in it (from_page_data), so a body always goes out with the validator
+# it was built under, never with a newer one a client would then keep it by.
+#----------------------------------------------------------------------------#
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _latest(*moments):
+  return max([moment for moment in moments if moment is not None], default=EPOCH)
+
+
+def _latest_started(now, *conditions):
+  # a backwards seek on (venue_id | artist_id, start_time), or on start_time
+  return select(func.max(Show.start_time)).where(Show.start_time <= now, *conditions).scalar_subquery()
+
+
+def venue_page(now, venue_id):
+  row = db.session.query(Venue.updated_at, _latest_started(now, Show.venue_id == venue_id)) \
+    .filter(Venue.id == venue_id).first()
+  if row is None:
+    return None
+  return _latest(*row), ()
+
+
+def artist_page(now, artist_id):
+  row = db.session.query(Artist.updated_at, _latest_started(now, Show.artist_id == artist_id)) \
+    .filter(Artist.id == artist_id).first()
+  if row is None:
+    return None
+  return _latest(*row), ()
+
+
+def from_page_data(load):
+  # the validator of a page rendered from cached page data: load(**view_args)
+  # returns the data, or None, and its "last_modified" is the validator
+  def validator(now, **kwargs):
+    data = load(**kwargs)
+    if data is None:
+      return None
+    return datetime.fromisoformat(data['last_modified']), ()
+  return validator
+
+
+def venue_list(now):
+  # upcoming show counts come from the counters, which bump updated_at;
+  # archived venues count too, as archiving one bumps it (see deletes.py)
+  updated_at, count = db.session.query(func.max(Venue.updated_at), func.count(Venue.id)) \
+    .execution_options(include_archived=True).one()
+  return _latest(updated_at), (count,)
+
+
+def artist_list(now):
+  updated_at, count = db.session.query(func.max(Artist.updated_at), func.count(Artist.id)) \
+    .execution_options(include_archived=True).one()
+  return _latest(updated_at), (count,)
+
+
+def show_list(now):
+  # shows are only deleted with their venue or artist, which touches the
+  # other side (or, archived, still counts here), so no count is needed
+  row = db.session.query(
+    select(func.max(Show.updated_at)).scalar_subquery(),
+    select(func.max(Venue.updated_at)).scalar_subquery(),
+    select(func.max(Artist.updated_at)).scalar_subquery(),
+    _latest_started(now),
+  ).execution_options(include_archived=True).one()
+  return _latest(*row), ()
+
+
+def touch_venues_of(artist_id):
+  # call when editing or deleting an artist, before committing
+  db.session.query(Venue).filter(Venue.id.in_(select(Show.venue_id).where(Show.artist_id == artist_id))) \
+    .update({Venue.updated_at: datetime.now()}, synchronize_session=False)
+
+
+def touch_artists_of(venue_id):
+  # call when editing or deleting a venue, before committing
+  db.session.query(Artist).filter(Artist.id.in_(select(Show.artist_id).where(Show.venue_id == venue_id))) \
+    .update({Artist.updated_at: datetime.now()}, synchronize_session=False)
+
+
+def template_digest(app):
+  # the default ETAG_SALT
+  digest = hashlib.sha1()
+  folder = os.path.join(app.root_path, app.template_folder)
+  for root, dirs, files in os.walk(folder):
+    dirs.sort()
+    for name in sorted(files):
+      path = os.path.join(root, name)
+      digest.update(os.path.relpath(path, folder).encode())
+      with open(path, 'rb') as f:
+        digest.update(f.read())
+  return digest.hexdigest()
+
+
+def _etag(last_modified, extra):
+  # the asset bundles' file names change with their content, and so the page
+  bundles = sorted((current_app.extensions['assets'] or {}).values())
+  key = '%s|%s|%s|%s|%r' % (current_app.config['ETAG_SALT'], bundles, request.endpoint, last_modified.isoformat(), extra)
+  return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def _not_modified(etag, last_modified):
+  # If-None-Match wins over If-Modified-Since when both are sent (RFC 7232)
+  if request.if_none_match:
+    return request.if_none_match.contains_weak(etag)
+  if request.if_modified_since:
+    return last_modified <= request.if_modified_since
+  return False
+
+
+def validated_by(validator):
+  # Decorates a view: validator(now, **view_args) gives (last_modified,
+  # extra) for its page, or None to leave everything to the view (a 404).
+  def decorate(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      if '_flashes' in session:
+        # the page carries one-off messages, so it must be rendered
+        return view(**kwargs)
+      found = validator(datetime.now(), **kwargs)
+      if found is None:
+        return view(**kwargs)
+      last_modified, extra = found
+      etag = _etag(last_modified, extra)
+      # naive local time; HTTP dates are whole seconds in UTC
+      last_modified = last_modified.replace(microsecond=0).astimezone(timezone.utc)
+      if _not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+      else:
+        response = make_response(view(**kwargs))
+        if response.status_code != 200:
+          return response
+      response.set_etag(etag)
+      response.last_modified = last_modified
+      response.cache_control.no_cache = True  # store it, but revalidate every time
+      return response
+    return wrapper
+  return decorate
@@ -0,0 +1,227 @@
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, case, func, select, update
+
+from models import db, Venue, Artist, Show, CounterWatermark
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#
+# Venue and Artist carry upcoming_shows_count / past_shows_count so listings
+# and searches never count Show rows. A show is "upcoming" while it starts
+# after the watermark in CounterWatermark and "past" once the roll-over job
+# has moved the watermark beyond it.
+#
+# - booking a show:     record_show() (or record_shows() for a batch) in the
+#                       same transaction
+# - deleting an entity: forget_venue_shows() / forget_artist_shows() in the
+#                       delete's transaction, while the shows still exist;
+#                       the delete handlers also queue a recount() of the
+#                       other side as a safety net. An archived entity's
+#                       shows stay counted until its purge job deletes them
+#                       and recounts.
+# - time passing:       roll_over(), an hourly background job (jobs.py), or
+#                       `flask counters roll-over` from cron where no job
+#                       workers run
+# - drift:              `flask counters rebuild`
+#
+# The watermark row is created by the migration (d34d2f6aa393). Whatever
+# moves it locks it first (FOR UPDATE) and moves it with a compare-and-set,
+# so overlapping runs, the hourly job and the command say, never move the
+# same shows twice: on SQLite, which has no row locks, the compare-and-set
+# alone lets one of them through. None of these functions commit.
+#----------------------------------------------------------------------------#
+
+COUNTED = (
+  (Venue, Show.venue_id),
+  (Artist, Show.artist_id),
+)
+
+
+def watermark(lock=False):
+  # lock=True holds the row until the transaction ends (PostgreSQL)
+  query = db.session.query(CounterWatermark.rolled_over_at).filter(CounterWatermark.id == 1)
+  if lock:
+    query = query.with_for_update()
+  since = query.scalar()
+  if since is None:
+    raise LookupError('The CounterWatermark row is missing; run `flask db upgrade`')
+  return since
+
+
+def _move_watermark(since, now):
+  # True if the watermark was still at `since`, and is now at `now`
+  return db.session.execute(update(CounterWatermark)
+    .where(CounterWatermark.id == 1, CounterWatermark.rolled_over_at == since)
+    .values(rolled_over_at=now)
+    .execution_options(synchronize_session=False)).rowcount == 1
+
+
+def record_show(venue_id, artist_id, start_time, delta=1):
+  # count one new show (or, with delta=-1, one removed show) for both sides
+  upcoming = start_time > watermark()
+  for model, entity_id in ((Venue, venue_id), (Artist, artist_id)):
+    column = model.upcoming_shows_count if upcoming else model.past_shows_count
+    db.session.query(model).filter(model.id == entity_id) \
+      .update({column: column + delta}, synchronize_session=False)
+
+
+def record_shows(shows):
+  # count a batch of new (venue_id, artist_id, start_time) shows with one
+  # executemany UPDATE per table
+  since = watermark()
+  for model, position in ((Venue, 0), (Artist, 1)):
+    totals = {}
+    for show in shows:
+      upcoming, past = totals.get(show[position], (0, 0))
+      if show[2] > since:
+        upcoming += 1
+      else:
+        past += 1
+      totals[show[position]] = (upcoming, past)
+    if not totals:
+      continue
+    statement = update(model) \
+      .where(model.id == bindparam('entity_id')) \
+      .values(upcoming_shows_count=model.upcoming_shows_count + bindparam('upcoming'),
+              past_shows_count=model.past_shows_count + bindparam('past'))
+    db.session.execute(statement, [
+      {'entity_id': entity_id, 'upcoming': upcoming, 'past': past}
+      for entity_id, (upcoming, past) in totals.items()])
+
+
+def _show_count(model, show_fk, *conditions):
+  return select(func.count(Show.id)) \
+    .where(show_fk == model.id, *conditions) \
+    .scalar_subquery()
+
+
+def _subtract_shows(condition):
+  # takes the shows matching `condition` off every venue and artist they
+  # count for: one grouped read of the shows and one executemany UPDATE per
+  # table, as in record_shows()
+  since = watermark()
+  for model, show_fk in COUNTED:
+    totals = db.session.query(
+      show_fk,
+      func.sum(case((Show.start_time > since, 1), else_=0)),
+      func.sum(case((Show.start_time <= since, 1), else_=0))
+    ).filter(condition).group_by(show_fk).all()
+    if not totals:
+      continue
+    statement = update(model) \
+      .where(model.id == bindparam('entity_id')) \
+      .values(upcoming_shows_count=model.upcoming_shows_count - bindparam('upcoming'),
+              past_shows_count=model.past_shows_count - bindparam('past'))
+    db.session.execute(statement, [
+      {'entity_id': entity_id, 'upcoming': upcoming, 'past': past}
+      for entity_id, upcoming, past in totals])
+
+
+def forget_venue_shows(venue_id):
+  # call before deleting the venue, while its shows still exist
+  _subtract_shows(Show.venue_id == venue_id)
+
+
+def forget_artist_shows(artist_id):
+  # call before deleting the artist, while their shows still exist
+  _subtract_shows(Show.artist_id == artist_id)
+
+
+def recount(venue_ids=(), artist_ids=()):
+  # sets the counters of the given venues and artists from their shows;
+  # it only reads Show, so it can run any number of times
+  since = watermark()
+  for (model, show_fk), ids in zip(COUNTED, (venue_ids, artist_ids)):
+    if ids:
+      db.session.query(model).filter(model.id.in_(ids)).update({
+        model.upcoming_shows_count: _show_count(model, show_fk, Show.start_time > since),
+        model.past_shows_count: _show_count(model, show_fk, Show.start_time <= since),
+      }, synchronize_session=False)
+
+
+def roll_over(now=None):
+  # moves shows that started since the last run from upcoming to past and
+  # returns how many; 0 if another run got there first
+  if now is None:
+    now = datetime.now()
+  since = watermark(lock=True)
+  if now <= since or not _move_watermark(since, now):
+    return 0
+  started = and_(Show.start_time > since, Show.start_time <= now)
+  moved = db.session.query(func.count(Show.id)).filter(started).scalar()
+  if moved:
+    for model, show_fk in COUNTED:
+      count = _show_count(model, show_fk, started)
+      touched = select(show_fk).where(started)
+      db.session.query(model).filter(model.id.in_(touched)).update({
+        model.upcoming_shows_count: model.upcoming_shows_count - count,
+        model.past_shows_count: model.past_shows_count + count,
+      }, synchronize_session=False)
+  return moved
+
+
+def rebuild(now=None, dry_run=False):
+  # recounts every venue and artist from Show and returns the rows that
+  # drifted; with dry_run, changes nothing
+  if now is None:
+    now = datetime.now()
+  since = watermark(lock=not dry_run)
+  if dry_run:
+    # the stored counters are relative to the watermark, which stays put
+    boundary = since
+  elif _move_watermark(since, now):
+    boundary = now
+  else:
+    raise RuntimeError('The counters were rolled over meanwhile; run the rebuild again')
+  drift = []
+  for model, show_fk in COUNTED:
+    actual = dict(
+      (row[0], (row[1], row[2])) for row in db.session.query(
+        show_fk,
+        func.sum(case((Show.start_time > boundary, 1), else_=0)),
+        func.sum(case((Show.start_time <= boundary, 1), else_=0))
+      ).group_by(show_fk)
+    )
+    stored = db.session.query(model.id, model.upcoming_shows_count, model.past_shows_count)
+    for entity_id, upcoming, past in stored:
+      expected = actual.get(entity_id, (0, 0))
+      if (upcoming, past) != expected:
+        drift.append((model.__tablename__, entity_id, (upcoming, past), expected))
+        if not dry_run:
+          db.session.query(model).filter(model.id == entity_id).update({
+            model.upcoming_shows_count: expected[0],
+            model.past_shows_count: expected[1],
+          }, synchronize_session=False)
+  return drift
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+counters_cli = AppGroup('counters', help='Maintain the denormalized show counters on Venue and Artist.')
+
+
+@counters_cli.command('roll-over')
+def roll_over_command():
+  """Move shows that have started from upcoming to past."""
+  moved = roll_over()
+  db.session.commit()
+  click.echo('Rolled %d show(s) over to past.' % moved)
+
+
+@counters_cli.command('rebuild')
+@click.option('--dry-run', is_flag=True, help='Report drift without fixing it.')
+def rebuild_command(dry_run):
+  """Recount every venue and artist from the Show table."""
+  drift = rebuild(dry_run=dry_run)
+  if dry_run:
+    db.session.rollback()
+  else:
+    db.session.commit()
+  for table, entity_id, stored, expected in drift:
+    click.echo('%s %s: stored upcoming=%d past=%d, actual upcoming=%d past=%d'
+               % ((table, entity_id) + stored + expected))
+  click.echo('%d counter row(s) drifted%s.' % (len(drift), '' if dry_run else ' and were fixed'))
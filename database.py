@@ -0,0 +1,275 @@
+import itertools
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import DateTime, event, orm, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.elements import TextClause
+
+from metrics import Histogram
+
+#----------------------------------------------------------------------------#
+# Engine configuration.
+#
+# Pool sizing and statement timeouts come from config.py (and so from the
+# environment). Behind PgBouncer in transaction pooling mode (DB_PGBOUNCER)
+# the app keeps no pool of its own and sets nothing at the session level:
+# every timeout is a SET LOCAL inside the transaction.
+#
+# Statement timeouts are per route: DB_STATEMENT_TIMEOUT_MS is the default
+# and DB_ROUTE_TIMEOUTS_MS overrides it by endpoint name (0 = no timeout).
+# On SQLite they are enforced with a progress handler instead.
+#----------------------------------------------------------------------------#
+
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+SQLITE_PROGRESS_STEPS = 10000
+
+
+class TimedQueuePool(QueuePool):
+  # a QueuePool that records how long each checkout waited for a connection
+  def __init__(self, *args, **kwargs):
+    super(TimedQueuePool, self).__init__(*args, **kwargs)
+    self.wait_histogram = Histogram(POOL_WAIT_BUCKETS)
+
+  def recreate(self):
+    pool = super(TimedQueuePool, self).recreate()
+    pool.wait_histogram = self.wait_histogram
+    return pool
+
+  def _do_get(self):
+    started = time.perf_counter()
+    try:
+      return super(TimedQueuePool, self)._do_get()
+    finally:
+      self.wait_histogram.observe(time.perf_counter() - started)
+
+
+def engine_options(config):
+  # SQLALCHEMY_ENGINE_OPTIONS for the configured database
+  url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+  if url.get_backend_name() == 'sqlite':
+    # Flask-SQLAlchemy picks NullPool (files) or StaticPool (memory)
+    return {}
+  if config['DB_PGBOUNCER']:
+    return {'poolclass': NullPool}
+  options = {
+    'poolclass': TimedQueuePool,
+    'pool_size': config['DB_POOL_SIZE'],
+    'max_overflow': config['DB_MAX_OVERFLOW'],
+    'pool_timeout': config['DB_POOL_TIMEOUT'],
+    'pool_recycle': config['DB_POOL_RECYCLE'],
+    'pool_pre_ping': config['DB_POOL_PRE_PING'],
+  }
+  if url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+    # the default, for every connection; routes that differ use SET LOCAL
+    options['connect_args'] = {'options': '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']}
+  return options
+
+
+def statement_timeout(config, endpoint):
+  # milliseconds allowed per statement on this endpoint; 0 means no limit
+  return config['DB_ROUTE_TIMEOUTS_MS'].get(endpoint, config['DB_STATEMENT_TIMEOUT_MS'])
+
+
+def _sqlite_deadline(dbapi_connection, milliseconds):
+  if not milliseconds:
+    dbapi_connection.set_progress_handler(None, 0)
+    return
+  deadline = time.monotonic() + milliseconds / 1000.0
+  # a non-zero return aborts the running statement with "interrupted"
+  dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+
+
+def apply_statement_timeout(session, transaction, connection):
+  if not has_request_context():
+    return
+  config = current_app.config
+  milliseconds = statement_timeout(config, request.endpoint)
+  dbapi_connection = connection.connection.dbapi_connection
+  if isinstance(dbapi_connection, sqlite3.Connection):
+    _sqlite_deadline(dbapi_connection, milliseconds)
+    session.info['sqlite_deadline'] = dbapi_connection
+  elif connection.dialect.name == 'postgresql':
+    if config['DB_PGBOUNCER'] or milliseconds != config['DB_STATEMENT_TIMEOUT_MS']:
+      connection.execute(text('SET LOCAL statement_timeout = %d' % milliseconds))
+
+
+def clear_sqlite_deadline(session, transaction):
+  if transaction.parent is not None:
+    return
+  dbapi_connection = session.info.pop('sqlite_deadline', None)
+  if dbapi_connection is not None:
+    try:
+      _sqlite_deadline(dbapi_connection, 0)
+    except sqlite3.ProgrammingError:
+      pass  # already closed (NullPool): nothing left to clear
+
+
+def init_app(app, db):
+  # the session is shared by every app, so its listeners go on once
+  if not event.contains(db.session, 'after_begin', apply_statement_timeout):
+    event.listen(db.session, 'after_begin', apply_statement_timeout)
+    event.listen(db.session, 'after_transaction_end', clear_sqlite_deadline)
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#
+# DATABASE_REPLICA_URLS become the binds replica_0, replica_1, ... and the
+# endpoints in READ_ONLY_ENDPOINTS read from one of them, round-robin.
+# Everything else, any flush or DML, and every request within
+# REPLICA_STICKY_SECONDS of the same browser's last write go to the primary,
+# so people see their own changes (including on the redirect after a POST).
+# A write is any flush or DML statement the request ran, whatever its HTTP
+# method: the delete links are GETs. Page cache entries are built from the
+# primary (from_primary), so a lagging replica never puts rows from before
+# a write in the cache everyone reads.
+#
+# Lag is measured with the ReplicaHeartbeat row: every REPLICA_CHECK_SECONDS
+# the primary's heartbeat is compared with each replica's copy of it, then
+# bumped. A replica more than REPLICA_MAX_LAG_SECONDS behind, or failing,
+# is skipped until a later check finds it caught up; with none left, reads
+# fall back to the primary.
+#----------------------------------------------------------------------------#
+
+STICKY_COOKIE = 'fyyur_primary'
+HEARTBEAT = text('SELECT beat_at FROM "ReplicaHeartbeat" WHERE id = 1').columns(beat_at=DateTime)
+
+
+def replica_binds(config):
+  # SQLALCHEMY_BINDS entries for the configured replicas
+  return dict(('replica_%d' % i, url) for i, url in enumerate(config['DATABASE_REPLICA_URLS']))
+
+
+def _is_read(clause):
+  if clause is None:
+    return True
+  if isinstance(clause, TextClause):
+    return clause.text.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'EXPLAIN')
+  return not getattr(clause, 'is_dml', False)
+
+
+def mark_write(*args):
+  # after_flush, and do_orm_execute for DML: the browser reads from the
+  # primary for REPLICA_STICKY_SECONDS
+  if has_request_context():
+    g.db_wrote = True
+
+
+def mark_dml(state):
+  if not _is_read(state.statement):
+    mark_write()
+
+
+def from_primary(build):
+  # build(), with this request's reads on the primary
+  replica = g.pop('db_replica', None) if has_request_context() else None
+  try:
+    return build()
+  finally:
+    if replica is not None:
+      g.db_replica = replica
+
+
+class RoutingSession(SignallingSession):
+  def get_bind(self, mapper=None, clause=None, **kw):
+    replica = g.get('db_replica') if has_request_context() else None
+    if replica is not None and not self._flushing and _is_read(clause):
+      return self.app.extensions['sqlalchemy'].db.get_engine(self.app, bind=replica)
+    return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter(object):
+  def __init__(self, app, db):
+    self.app = app
+    self.db = db
+    self.binds = sorted(replica_binds(app.config))
+    self.max_lag = app.config['REPLICA_MAX_LAG_SECONDS']
+    self.check_interval = app.config['REPLICA_CHECK_SECONDS']
+    self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+    self.read_only = set(app.config['READ_ONLY_ENDPOINTS'])
+    self.lag = dict((bind, None) for bind in self.binds)  # seconds; None = unreachable
+    self.healthy = []
+    self.checked_at = 0.0
+    self.lock = threading.Lock()
+    self.turn = itertools.count()
+
+  def _heartbeat(self, engine):
+    with engine.connect() as conn:
+      return conn.execute(HEARTBEAT).scalar()
+
+  def check(self):
+    # measures every replica's lag, then bumps the primary's heartbeat
+    primary = self.db.get_engine(self.app)
+    beat = self._heartbeat(primary)
+    for bind in self.binds:
+      try:
+        seen = self._heartbeat(self.db.get_engine(self.app, bind=bind))
+      except Exception as e:
+        self.app.logger.warning('Replica %s is unreachable: %s', bind, e)
+        self.lag[bind] = None
+        continue
+      if beat is None or seen == beat:
+        self.lag[bind] = 0.0
+      elif seen is None:
+        self.lag[bind] = float('inf')  # has never seen a heartbeat
+      else:
+        self.lag[bind] = max(0.0, (beat - seen).total_seconds())
+    self.healthy = [bind for bind in self.binds if self.lag[bind] is not None and self.lag[bind] <= self.max_lag]
+    with primary.begin() as conn:
+      if not conn.execute(text('UPDATE "ReplicaHeartbeat" SET beat_at = :now WHERE id = 1'), {'now': datetime.now()}).rowcount:
+        conn.execute(text('INSERT INTO "ReplicaHeartbeat" (id, beat_at) VALUES (1, :now)'), {'now': datetime.now()})
+    self.checked_at = time.monotonic()
+
+  def pick(self):
+    # the replica bind for this request, or None for the primary
+    if time.monotonic() - self.checked_at > self.check_interval and self.lock.acquire(False):
+      try:
+        self.check()
+      except Exception as e:
+        self.app.logger.warning('Replica lag check failed: %s', e)
+        self.healthy = []
+        self.checked_at = time.monotonic()
+      finally:
+        self.lock.release()
+    healthy = self.healthy
+    if not healthy:
+      return None
+    return healthy[next(self.turn) % len(healthy)]
+
+  def before_request(self):
+    if request.endpoint in self.read_only and STICKY_COOKIE not in request.cookies:
+      g.db_replica = self.pick()
+
+  def after_request(self, response):
+    if g.get('db_wrote'):
+      response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+    return response
+
+  def lag_gauges(self):
+    # for /metrics: seconds behind the primary, by replica (-1 = unreachable)
+    return dict((bind, -1 if lag is None else lag) for bind, lag in self.lag.items())
+
+
+def init_replicas(app, db):
+  # returns the ReplicaRouter, or None when no replicas are configured
+  if not app.config['DATABASE_REPLICA_URLS']:
+    return None
+  router = ReplicaRouter(app, db)
+  # the session is shared by every app, so its listeners go on once
+  if not event.contains(db.session, 'after_flush', mark_write):
+    event.listen(db.session, 'after_flush', mark_write)
+    event.listen(db.session, 'do_orm_execute', mark_dml)
+  app.before_request(router.before_request)
+  app.after_request(router.after_request)
+  app.extensions['replica_router'] = router
+  return router
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, update
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Venue and artist deletes.
+#
+# Shows reference their venue and artist through ON DELETE CASCADE foreign
+# keys, so a delete is one DELETE statement and the database takes the shows
+# with it, without loading them. SQLite only enforces foreign keys under
+# PRAGMA foreign_keys, which the app leaves off, so there the shows go first,
+# in one DELETE of their own.
+#
+# With DELETE_MODE=archive a delete only sets archived_at: from then on the
+# row is left out of every ORM query (hide_archived below), and a background
+# job purges it, shows and all. Raw SQL, compound statements (UNION) and
+# column queries that join Venue or Artist (the show feed, the exports) are
+# not reached by it and filter archived_at themselves;
+# benchmarks/archived.py checks the feed and the exports.
+# The listing validators (conditional.py) still see archived rows, so that
+# archiving one changes their ETags.
+#----------------------------------------------------------------------------#
+
+# kind: (model, the show column pointing at it, the show column pointing at the other side)
+SIDES = {
+  'venue': (Venue, Show.venue_id, Show.artist_id),
+  'artist': (Artist, Show.artist_id, Show.venue_id),
+}
+
+
+def archiving():
+  return current_app.config['DELETE_MODE'] == 'archive'
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def hide_archived(state):
+  # queries that must see archived rows run with execution_options(include_archived=True)
+  if (has_app_context() and archiving() and isinstance(state.statement, Select)
+      and not state.execution_options.get('include_archived', False)
+      and not state.is_column_load and not state.is_relationship_load):
+    state.statement = state.statement.options(
+      with_loader_criteria(Venue, Venue.archived_at.is_(None), include_aliases=True),
+      with_loader_criteria(Artist, Artist.archived_at.is_(None), include_aliases=True),
+    )
+
+
+def counterparts(kind, entity_id):
+  # the ids on the other side of the entity's shows
+  _, own, other = SIDES[kind]
+  return [other_id for (other_id,) in db.session.query(other).filter(own == entity_id).distinct()]
+
+
+def purge(kind, entity_id):
+  # deletes a venue or artist and its shows with set-based statements and
+  # returns the ids on the other side, whose counters are now off; the
+  # caller recounts them and commits
+  model, own, _ = SIDES[kind]
+  others = counterparts(kind, entity_id)
+  if db.engine.dialect.name == 'sqlite':
+    db.session.execute(delete(Show).where(own == entity_id).execution_options(synchronize_session=False))
+  db.session.execute(delete(model).where(model.id == entity_id).execution_options(synchronize_session=False))
+  return others
+
+
+def archive(kind, entity_id):
+  # hides a venue or artist until its purge job runs; the caller queues that
+  # job and commits
+  model = SIDES[kind][0]
+  db.session.execute(update(model).where(model.id == entity_id, model.archived_at.is_(None))
+    .values(archived_at=datetime.now()).execution_options(synchronize_session=False))
@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Export.
+#
+# Streams whole tables as NDJSON or CSV. Rows are read through a server-side
+# cursor in batches of BATCH_SIZE and written out one at a time, so memory
+# stays flat however many rows are exported. Archived venues and artists
+# (deletes.py), and their shows, are left out. `since` makes an export
+# incremental: only the rows whose updated_at is at or after it.
+#----------------------------------------------------------------------------#
+
+BATCH_SIZE = 1000
+
+FORMATS = {
+  'ndjson': 'application/x-ndjson',
+  'csv': 'text/csv',
+}
+
+FIELDS = {
+  'venues': {
+    'id': Venue.id,
+    'name': Venue.name,
+    'city': Venue.city,
+    'state': Venue.state,
+    'address': Venue.address,
+    'phone': Venue.phone,
+    'genres': Venue.genres,
+    'website_link': Venue.website_link,
+    'facebook_link': Venue.facebook_link,
+    'image_link': Venue.image_link,
+    'seeking_talent': Venue.seeking_talent,
+    'seeking_description': Venue.seeking_description,
+    'upcoming_shows_count': Venue.upcoming_shows_count,
+    'past_shows_count': Venue.past_shows_count,
+  },
+  'artists': {
+    'id': Artist.id,
+    'name': Artist.name,
+    'city': Artist.city,
+    'state': Artist.state,
+    'phone': Artist.phone,
+    'genres': Artist.genres,
+    'website_link': Artist.website_link,
+    'facebook_link': Artist.facebook_link,
+    'image_link': Artist.image_link,
+    'seeking_venue': Artist.seeking_venue,
+    'seeking_description': Artist.seeking_description,
+    'upcoming_shows_count': Artist.upcoming_shows_count,
+    'past_shows_count': Artist.past_shows_count,
+  },
+  'shows': {
+    'id': Show.id,
+    'start_time': Show.start_time,
+    'end_time': Show.end_time,
+    'venue_id': Show.venue_id,
+    'venue_name': Venue.name,
+    'artist_id': Show.artist_id,
+    'artist_name': Artist.name,
+  },
+}
+
+MODELS = {
+  'venues': Venue,
+  'artists': Artist,
+}
+
+# what `since` filters on, per export: rows changed since then. A show also
+# counts as changed when the venue or artist whose name it exports did.
+SINCE = {
+  'venues': {None: Venue.updated_at},
+  'artists': {None: Artist.updated_at},
+  'shows': {None: Show.updated_at, 'venue_name': Venue.updated_at, 'artist_name': Artist.updated_at},
+}
+
+
+class ExportError(ValueError):
+  pass
+
+
+def parse_fields(kind, fields):
+  available = FIELDS[kind]
+  if not fields:
+    return list(available)
+  names = [name.strip() for name in fields.split(',') if name.strip()]
+  unknown = [name for name in names if name not in available]
+  if unknown:
+    raise ExportError('Unknown field(s) for %s: %s' % (kind, ', '.join(unknown)))
+  return names
+
+
+def parse_since(since):
+  if not since:
+    return None
+  try:
+    return datetime.fromisoformat(since)
+  except ValueError:
+    raise ExportError('since must be an ISO 8601 date or datetime')
+
+
+def export_query(kind, names, since=None):
+  columns = [FIELDS[kind][name].label(name) for name in names]
+  query = db.session.query(*columns)
+  if kind == 'shows':
+    query = query.select_from(Show) \
+      .join(Venue, Venue.id == Show.venue_id) \
+      .join(Artist, Artist.id == Show.artist_id) \
+      .filter(Venue.archived_at.is_(None), Artist.archived_at.is_(None))
+    order = Show.id
+  else:
+    model = MODELS[kind]
+    query = query.select_from(model).filter(model.archived_at.is_(None))
+    order = model.id
+  if since is not None:
+    changed = [column >= since for name, column in SINCE[kind].items() if name is None or name in names]
+    query = query.filter(or_(*changed))
+  return query.order_by(order) \
+    .execution_options(stream_results=True) \
+    .yield_per(BATCH_SIZE)
+
+
+def _plain(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return value
+
+
+def ndjson_rows(rows, names):
+  for row in rows:
+    yield json.dumps(dict((name, _plain(value)) for name, value in zip(names, row))) + '\n'
+
+
+def csv_rows(rows, names):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+
+  def flush():
+    line = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return line
+
+  writer.writerow(names)
+  yield flush()
+  for row in rows:
+    writer.writerow([';'.join(value) if isinstance(value, list) else _plain(value) for value in row])
+    yield flush()
+
+
+def stream(kind, fmt='ndjson', fields=None, since=None):
+  # Validates the request up front (so errors surface before any output) and
+  # returns the row generator for the chosen format.
+  if kind not in FIELDS:
+    raise ExportError('Unknown export %r' % kind)
+  if fmt not in FORMATS:
+    raise ExportError('format must be one of: %s' % ', '.join(FORMATS))
+  names = parse_fields(kind, fields)
+  since = parse_since(since)
+  rows = export_query(kind, names, since)
+  if fmt == 'csv':
+    return csv_rows(rows, names)
+  return ndjson_rows(rows, names)
@@ -2,8 +2,8 @@
 from datetime import datetime
 import enum
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL, Regexp
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Regexp, NumberRange, Optional
 from wtforms_sqlalchemy.fields import QuerySelectMultipleField
 
 class Genres(enum.Enum):
@@ -44,6 +44,12 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        # minutes; 12 hours at most (models.MAX_SHOW_DURATION)
+        validators=[Optional(), NumberRange(min=15, max=720)],
+        default=120
+    )
 
 class VenueForm(Form):
     name = StringField(
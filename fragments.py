@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import MISSING
+
+#----------------------------------------------------------------------------#
+# Template fragment cache.
+#
+#   {% cache key, ttl, tags %} ... {% endcache %}
+#
+# renders the body once and then serves it from the store (any cache.py
+# backend, chosen with FRAGMENT_CACHE_BACKEND) until `ttl` seconds pass.
+# ttl and tags are optional; a key of None renders the body uncached.
+#
+# Keys are versioned by what they list: a venue, artist or show in the key
+# (a model, or a dict with "id" and "updated_at") stands for its id and
+# updated_at, so an edited row gets a new entry on its own. Tags cover the
+# rest: every tag has a token in the store that is part of the key of each
+# entry carrying it, and invalidate() replaces the token, orphaning those
+# entries until the store evicts them.
+#
+# Each entry remembers how long its body took to render, so hits add up the
+# render time they saved; stats() compares that with the time spent in
+# cache blocks (lookups, and rendering on misses).
+#----------------------------------------------------------------------------#
+
+# tag tokens outlive the entries that use them; losing one only costs misses
+TAG_TTL_FACTOR = 10
+
+
+def _part(value):
+  if isinstance(value, (list, tuple)):
+    return '[%s]' % ','.join(_part(item) for item in value)
+  if isinstance(value, dict) and 'id' in value and 'updated_at' in value:
+    return '%s@%s' % (value['id'], _part(value['updated_at']))
+  if hasattr(value, '__tablename__') and hasattr(value, 'updated_at'):
+    return '%s:%s@%s' % (value.__tablename__, value.id, _part(value.updated_at))
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return str(value)
+
+
+class FragmentCache(object):
+
+  def __init__(self, store):
+    self.store = store
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.bypassed = 0
+    self.invalidations = 0
+    self.uncached_seconds = 0.0  # what rendering every block would have cost
+    self.spent_seconds = 0.0     # what the blocks cost with the cache
+
+  def _token(self, tag):
+    token = self.store.get('tag:' + tag)
+    if token is MISSING:
+      token = uuid.uuid4().hex[:12]
+      self.store.set('tag:' + tag, token, self.store.ttl * TAG_TTL_FACTOR)
+    return token
+
+  def render(self, key, ttl, tags, render_body):
+    # the block's HTML, from the store or freshly rendered by render_body()
+    if key is None:
+      with self.lock:
+        self.bypassed += 1
+      return render_body()
+    started = time.perf_counter()
+    versioned = '%s|%s' % (_part(key), ','.join(self._token(tag) for tag in tags or ()))
+    store_key = 'fragment:' + hashlib.sha1(versioned.encode()).hexdigest()
+    entry = self.store.get(store_key)
+    if entry is not MISSING:
+      html, render_seconds = entry
+      with self.lock:
+        self.hits += 1
+        self.uncached_seconds += render_seconds
+        self.spent_seconds += time.perf_counter() - started
+      return Markup(html)
+
+    rendering = time.perf_counter()
+    html = render_body()
+    render_seconds = time.perf_counter() - rendering
+    self.store.set(store_key, [str(html), render_seconds], ttl)
+    with self.lock:
+      self.misses += 1
+      self.uncached_seconds += render_seconds
+      self.spent_seconds += time.perf_counter() - started
+    return html
+
+  def invalidate(self, *tags):
+    for tag in tags:
+      self.store.set('tag:' + tag, uuid.uuid4().hex[:12], self.store.ttl * TAG_TTL_FACTOR)
+    with self.lock:
+      self.invalidations += len(tags)
+
+  def after_fork(self):
+    self.store.after_fork()
+
+  def stats(self):
+    with self.lock:
+      uncached, spent = self.uncached_seconds, self.spent_seconds
+      return {
+        "backend" : self.store.name,
+        "hits" : self.hits,
+        "misses" : self.misses,
+        "bypassed" : self.bypassed,
+        "invalidations" : self.invalidations,
+        "entries" : len(self.store),
+        "render_seconds_uncached" : uncached,
+        "render_seconds" : spent,
+        # negative when lookups cost more than the rendering they replace
+        "render_time_saved" : (1 - spent / uncached) if uncached else 0.0,
+      }
+
+
+class FragmentCacheExtension(Extension):
+  # {% cache key[, ttl[, tags]] %} ... {% endcache %}
+  tags = {'cache'}
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [parser.parse_expression()]
+    for default in (nodes.Const(None), nodes.List([])):
+      args.append(parser.parse_expression() if parser.stream.skip_if('comma') else default)
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(self.call_method('_cache', args), [], [], body).set_lineno(lineno)
+
+  def _cache(self, key, ttl, tags, caller):
+    return current_app.extensions['fragment_cache'].render(key, ttl, tags, caller)
@@ -0,0 +1,345 @@
+import csv
+import math
+import os
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, or_, select, tuple_
+
+from models import db, Venue, Geocode
+
+#----------------------------------------------------------------------------#
+# Proximity search.
+#
+# Venues carry a latitude and longitude, looked up by city and state in the
+# offline Geocode table (loaded from geocodes.csv by `flask geo load`, a
+# required deploy step: it also places the venues written before it ran),
+# and the geohash of that point. Cities missing from the table fall back to
+# the geocodes.csv shipped with the app, so venues written to a freshly
+# migrated database are placed too. A geohash names a cell of a grid that halves
+# in latitude or longitude with every bit, so the venues in a cell share its
+# hash as a prefix and sit next to each other in the geohash index.
+#
+# within() covers the circle around a point with a few grid cells, reads
+# each cell as a range scan on ix_Venue_geohash (geohash, latitude,
+# longitude) and keeps the venues whose exact (haversine) distance is inside
+# the radius; only the ones returned are then read from the table.
+# nearest() widens the radius until it holds k venues. No PostGIS needed.
+#----------------------------------------------------------------------------#
+
+EARTH_RADIUS_KM = 6371.0088
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# ~5m cells; coarser cells are prefixes of this
+GEOHASH_LENGTH = 9
+# the finest grid whose cover of the search box has at most this many cells
+MAX_CELLS = 32
+MAX_RADIUS_KM = 500
+# where nearest() starts looking
+KNN_START_KM = 2
+
+GEOCODES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geocodes.csv')
+BATCH_SIZE = 10000
+
+COLUMNS = (
+  Venue.id,
+  Venue.name,
+  Venue.city,
+  Venue.state,
+  Venue.address,
+  Venue.latitude,
+  Venue.longitude,
+  Venue.upcoming_shows_count.label('num_upcoming_shows'),
+)
+
+
+def encode(latitude, longitude, length=GEOHASH_LENGTH):
+  # the geohash of the cell of the given length holding the point
+  lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+  chars, bits, value, even = [], 0, 0, True
+  while len(chars) < length:
+    # bits alternate, longitude first
+    interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+    middle = (interval[0] + interval[1]) / 2
+    value <<= 1
+    if coordinate >= middle:
+      value |= 1
+      interval[0] = middle
+    else:
+      interval[1] = middle
+    even = not even
+    bits += 1
+    if bits == 5:
+      chars.append(BASE32[value])
+      bits, value = 0, 0
+  return ''.join(chars)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+  # great-circle (haversine) distance
+  phi1, phi2 = math.radians(lat1), math.radians(lat2)
+  dphi = phi2 - phi1
+  dlambda = math.radians(lng2 - lng1)
+  a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+  # (south, west, north, east) around the circle; west > east when the box
+  # crosses the antimeridian
+  angle = radius_km / EARTH_RADIUS_KM
+  south = latitude - math.degrees(angle)
+  north = latitude + math.degrees(angle)
+  if south <= -90 or north >= 90 or angle >= math.pi / 2:
+    # the circle holds a pole: every longitude
+    return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+  spread = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+  if spread >= 180:
+    return south, -180.0, north, 180.0
+  west, east = longitude - spread, longitude + spread
+  if west < -180:
+    west += 360
+  if east > 180:
+    east -= 360
+  return south, west, north, east
+
+
+def _grid(length):
+  # (cell height, cell width, rows, columns) of the geohash grid
+  lat_bits = 5 * length // 2
+  lng_bits = 5 * length - lat_bits
+  return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits, 2 ** lat_bits, 2 ** lng_bits
+
+
+def _spans(low, high, origin, size, count):
+  return range(int((low - origin) // size), min(int((high - origin) // size), count - 1) + 1)
+
+
+def cover(south, west, north, east, max_cells=MAX_CELLS):
+  # the geohashes of the finest grid covering the box with at most
+  # max_cells cells; the 32 one-character cells cover the globe
+  for length in range(GEOHASH_LENGTH, 0, -1):
+    height, width, row_count, column_count = _grid(length)
+    rows = _spans(south, north, -90.0, height, row_count)
+    lng_spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+    columns = [column for low, high in lng_spans for column in _spans(low, high, -180.0, width, column_count)]
+    if len(rows) * len(columns) <= max_cells or length == 1:
+      return sorted(set(
+        encode(-90.0 + (row + 0.5) * height, -180.0 + (column + 0.5) * width, length)
+        for row in rows for column in columns))
+
+
+def _successor(cell):
+  # the first geohash of the same length after every one starting with
+  # `cell`, or None after the last cell
+  for at in range(len(cell) - 1, -1, -1):
+    index = BASE32.index(cell[at])
+    if index < len(BASE32) - 1:
+      return cell[:at] + BASE32[index + 1] + BASE32[0] * (len(cell) - at - 1)
+  return None
+
+
+def cell_ranges(cells):
+  # [low, high) geohash ranges holding the cells; neighbours in index order
+  # share one range scan
+  ranges = []
+  for cell in sorted(cells):
+    if ranges and ranges[-1][1] == cell:
+      ranges[-1][1] = _successor(cell)
+    else:
+      ranges.append([cell, _successor(cell)])
+  return ranges
+
+
+def _in_ranges(ranges):
+  return or_(*[
+    Venue.geohash >= low if high is None else and_(Venue.geohash >= low, Venue.geohash < high)
+    for low, high in ranges])
+
+
+def _candidates(latitude, longitude, radius_km):
+  # (distance_km, id) of the venues within radius_km, nearest first, and the
+  # number of rows read. ix_Venue_geohash covers the query, so the table
+  # itself is never read.
+  south, west, north, east = bounding_box(latitude, longitude, radius_km)
+  box = [Venue.latitude.between(south, north)]
+  if west <= east:
+    box.append(Venue.longitude.between(west, east))
+  else:
+    box.append(or_(Venue.longitude >= west, Venue.longitude <= east))
+  rows = db.session.execute(select(Venue.id, Venue.latitude, Venue.longitude)
+    .where(_in_ranges(cell_ranges(cover(south, west, north, east))), *box)).all()
+
+  found = []
+  for venue_id, venue_latitude, venue_longitude in rows:
+    distance = distance_km(latitude, longitude, venue_latitude, venue_longitude)
+    if distance <= radius_km:
+      found.append((distance, venue_id))
+  found.sort()
+  return found, len(rows)
+
+
+def _details(found):
+  # the venues of (distance_km, id) pairs, in order, from one query
+  if not found:
+    return []
+  rows = db.session.execute(select(*COLUMNS).where(Venue.id.in_([venue_id for _, venue_id in found])))
+  venues = dict((row.id, dict(row._mapping)) for row in rows)
+  for distance, venue_id in found:
+    venues[venue_id]["distance_km"] = round(distance, 3)
+  return [venues[venue_id] for _, venue_id in found]
+
+
+def within(latitude, longitude, radius_km, limit=None):
+  # The first `limit` venues within radius_km of the point, nearest first,
+  # each with its distance_km; how many there are in all; and the number of
+  # rows read to find them.
+  found, scanned = _candidates(latitude, longitude, radius_km)
+  return _details(found[:limit]), len(found), scanned
+
+
+def nearest(latitude, longitude, k, max_radius_km=MAX_RADIUS_KM):
+  # The k venues nearest the point, no further than max_radius_km, and the
+  # number of rows read. Once a radius holds k venues, no venue outside it
+  # can be nearer than the k-th.
+  radius = min(KNN_START_KM, max_radius_km)
+  scanned = 0
+  while True:
+    found, read = _candidates(latitude, longitude, radius)
+    scanned += read
+    if len(found) >= k or radius >= max_radius_km:
+      return _details(found[:k]), scanned
+    # grow to where the density seen so far puts k venues
+    growth = 1.5 * math.sqrt(k / len(found)) if found else 4
+    radius = min(radius * min(max(growth, 1.5), 4), max_radius_km)
+
+#----------------------------------------------------------------------------#
+# Geocoding.
+#----------------------------------------------------------------------------#
+
+def _key(city, state):
+  # Geocode rows are keyed by (upper-case state, lower-case city)
+  return (state or '').strip().upper(), (city or '').strip().lower()
+
+
+_bundled = None
+
+
+def bundled():
+  # {(state, city): (latitude, longitude)} of the shipped geocodes.csv, read once
+  global _bundled
+  if _bundled is None:
+    _bundled = dict((key, (row['latitude'], row['longitude'])) for key, row in read_geocodes().items())
+  return _bundled
+
+
+def locate(city, state):
+  # (latitude, longitude) of a city from the Geocode table, else from the
+  # shipped geocodes.csv, or None
+  geocode = Geocode.query.get(_key(city, state))
+  if geocode is None:
+    return bundled().get(_key(city, state))
+  return geocode.latitude, geocode.longitude
+
+
+def position(point):
+  # the latitude, longitude and geohash columns for a point (or None)
+  if point is None:
+    return {"latitude": None, "longitude": None, "geohash": None}
+  return {"latitude": point[0], "longitude": point[1], "geohash": encode(*point)}
+
+
+def place(venue):
+  # call after setting a venue's city and state, before committing
+  for column, value in position(locate(venue.city, venue.state)).items():
+    setattr(venue, column, value)
+
+
+def place_rows(rows):
+  # adds the position columns to a batch of venue rows (dicts), one query
+  keys = set(_key(row.get('city'), row.get('state')) for row in rows)
+  points = dict(((state, city), (latitude, longitude)) for state, city, latitude, longitude in
+    db.session.query(Geocode.state, Geocode.city, Geocode.latitude, Geocode.longitude)
+      .filter(tuple_(Geocode.state, Geocode.city).in_(keys)))
+  for row in rows:
+    key = _key(row.get('city'), row.get('state'))
+    row.update(position(points.get(key) or bundled().get(key)))
+
+
+def read_geocodes(path=GEOCODES_CSV):
+  # {(state, city): Geocode row} of a city,state,latitude,longitude CSV file
+  with open(path, newline='') as f:
+    rows = dict()
+    for row in csv.DictReader(f):
+      state, city = _key(row['city'], row['state'])
+      rows[(state, city)] = {"state": state, "city": city,
+                             "latitude": float(row['latitude']), "longitude": float(row['longitude'])}
+  return rows
+
+
+def load_geocodes(path=GEOCODES_CSV):
+  # upserts the city,state,latitude,longitude rows of a CSV file; returns
+  # how many were read
+  rows = read_geocodes(path)
+  keys = list(rows)
+  for start in range(0, len(keys), BATCH_SIZE):
+    batch = keys[start:start + BATCH_SIZE]
+    Geocode.query.filter(tuple_(Geocode.state, Geocode.city).in_(batch)).delete(synchronize_session=False)
+    db.session.execute(Geocode.__table__.insert(), [rows[key] for key in batch])
+  db.session.commit()
+  return len(rows)
+
+
+def fill(everything=False):
+  # Geocodes the venues without a position (every venue with everything=True)
+  # in batches; returns (placed, unknown): venues given a position, and
+  # venues whose city isn't in the Geocode table or geocodes.csv.
+  points = dict(bundled())
+  points.update(((state, city), (latitude, longitude)) for state, city, latitude, longitude in
+    db.session.query(Geocode.state, Geocode.city, Geocode.latitude, Geocode.longitude))
+  update = Venue.__table__.update().where(Venue.id == bindparam('venue_id')).values(
+    latitude=bindparam('latitude'), longitude=bindparam('longitude'), geohash=bindparam('geohash'))
+  placed = unknown = 0
+  last_id = 0
+  while True:
+    query = db.session.query(Venue.id, Venue.city, Venue.state).filter(Venue.id > last_id)
+    if not everything:
+      query = query.filter(Venue.geohash.is_(None))
+    batch = query.order_by(Venue.id).limit(BATCH_SIZE).all()
+    if not batch:
+      return placed, unknown
+    last_id = batch[-1].id
+    values = []
+    for venue in batch:
+      point = points.get(_key(venue.city, venue.state))
+      if point is None:
+        unknown += 1
+        if not everything:
+          continue
+      values.append(dict(position(point), venue_id=venue.id))
+    if values:
+      db.session.execute(update, values)
+      placed += sum(1 for value in values if value['geohash'])
+    db.session.commit()
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+geo_cli = AppGroup('geo', help='Geocode venues for proximity search.')
+
+
+@geo_cli.command('load')
+@click.argument('path', default=GEOCODES_CSV, type=click.Path(exists=True, dir_okay=False))
+def load_command(path):
+  """Load a city,state,latitude,longitude CSV into the Geocode table and place new venues."""
+  loaded = load_geocodes(path)
+  placed, unknown = fill()
+  click.echo('Loaded %d geocode(s); placed %d venue(s), %d in unknown cities.' % (loaded, placed, unknown))
+
+
+@geo_cli.command('fill')
+@click.option('--all', 'everything', is_flag=True, help='Re-geocode venues that already have a position.')
+def fill_command(everything):
+  """Give venues the position of their city from the Geocode table."""
+  placed, unknown = fill(everything)
+  click.echo('Placed %d venue(s); %d in cities with no geocode.' % (placed, unknown))
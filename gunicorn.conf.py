@@ -0,0 +1,55 @@
+#----------------------------------------------------------------------------#
+# gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# The app is imported once in the master (preload_app) and forked, so a new
+# worker is ready as soon as it starts. Each worker serves requests from a
+# small thread pool; size workers x threads to fit DB_POOL_SIZE +
+# DB_MAX_OVERFLOW connections per worker under the database's limit.
+#
+# With more than one worker the page cache must be one they share: a
+# per-process ('memory') cache only hears of the writes its own worker
+# handled and serves the rest stale for up to CACHE_TTL. CACHE_BACKEND
+# defaults to 'sqlite' here, and an explicit 'memory' is refused.
+#----------------------------------------------------------------------------#
+import multiprocessing
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+if workers > 1:
+  os.environ.setdefault('CACHE_BACKEND', 'sqlite')
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then so slow leaks never build up, staggered so
+# they do not all restart at once
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+  # nothing opened in the master may be shared across processes: drop the
+  # inherited pooled connections and cache handles
+  from wsgi import app
+  from models import db
+  with app.app_context():
+    for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+      db.get_engine(app, bind=bind).dispose()
+  app.extensions['page_cache'].after_fork()
+  app.extensions['fragment_cache'].after_fork()
+
+
+def when_ready(server):
+  # the worker count can also come from the command line (-w)
+  from wsgi import app
+  if server.num_workers > 1 and app.extensions['page_cache'].name == 'memory':
+    raise RuntimeError('CACHE_BACKEND=memory is per process; use sqlite or null with %d workers'
+                       % server.num_workers)
@@ -0,0 +1,305 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+
+import bookings
+import cache
+import calendars
+import counters
+import geo
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#
+# Loads venues, artists or shows from CSV or JSONL in batches. Every row goes
+# through the same WTForms form as the web pages (phone format, URLs, state
+# choices, genres), outside of any request. Valid rows are written with one
+# COPY per batch on PostgreSQL and one executemany INSERT elsewhere; rejected
+# rows are written, with their errors, to a JSONL file next to the input.
+#
+# Shows get the checks of a batch booking (bookings.py): their venue and
+# artist must exist and are locked, and a show may not overlap one already
+# booked, or an earlier row. Once a batch of shows is in, the counters of
+# the venues and artists it touches are recounted and their cached pages
+# invalidated; the web workers only see that through a page cache they
+# share with the command (CACHE_BACKEND=sqlite and the same CACHE_PATH).
+#
+# A batch the database refuses (a duplicate id, say) is split until the
+# rows at fault are found; they go to the rejects file like any other.
+#----------------------------------------------------------------------------#
+
+BATCH_SIZE = 5000
+
+FORMS = {
+  'venues': (VenueForm, Venue),
+  'artists': (ArtistForm, Artist),
+  'shows': (ShowForm, Show),
+}
+
+COLUMNS = {
+  'venues': ['name', 'city', 'state', 'address', 'phone', 'genres', 'image_link',
+             'facebook_link', 'website_link', 'seeking_talent', 'seeking_description'],
+  'artists': ['name', 'city', 'state', 'phone', 'genres', 'image_link',
+              'facebook_link', 'website_link', 'seeking_venue', 'seeking_description'],
+  'shows': ['artist_id', 'venue_id', 'start_time', 'duration'],
+}
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'on')
+
+
+def read_rows(path):
+  with open(path, newline='') as f:
+    if path.endswith(('.jsonl', '.ndjson')):
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+    else:
+      for row in csv.DictReader(f):
+        if row.get('genres') is not None:
+          row['genres'] = [genre for genre in row['genres'].split(';') if genre]
+        yield row
+
+
+def to_formdata(row):
+  # flattens a raw row into what a browser would have posted
+  formdata = MultiDict()
+  for key, value in row.items():
+    if value is None:
+      continue
+    if isinstance(value, list):
+      for item in value:
+        formdata.add(key, str(item))
+    elif isinstance(value, bool):
+      if value:
+        formdata.add(key, 'y')
+    elif key.startswith('seeking_') and key != 'seeking_description':
+      if str(value).strip().lower() in TRUE_VALUES:
+        formdata.add(key, 'y')
+    elif key == 'start_time':
+      try:
+        value = datetime.fromisoformat(str(value)).strftime('%Y-%m-%d %H:%M:%S')
+      except ValueError:
+        pass
+      formdata.add(key, value)
+    else:
+      formdata.add(key, str(value))
+  return formdata
+
+
+def validate(kind, row):
+  # returns (values, errors) for one raw row
+  form_class, _ = FORMS[kind]
+  form = form_class(formdata=to_formdata(row), meta={'csrf': False})
+  if not form.validate():
+    return None, form.errors
+  values = dict((column, getattr(form, column).data) for column in COLUMNS[kind])
+  if kind == 'shows':
+    try:
+      values['artist_id'] = int(values['artist_id'])
+      values['venue_id'] = int(values['venue_id'])
+    except (TypeError, ValueError):
+      return None, {'id': ['artist_id and venue_id must be integers']}
+    duration = values.pop('duration')
+    values['end_time'] = values['start_time'] + (timedelta(minutes=duration) if duration else DEFAULT_SHOW_DURATION)
+  if row.get('id') not in (None, ''):
+    values['id'] = int(row['id'])
+  return values, None
+
+
+def missing_references(rows):
+  # set-based check that every referenced venue and artist exists: two IN
+  # queries per batch, which lock the rows found, so concurrent bookings
+  # are checked in turn
+  venue_ids = set(row['venue_id'] for row in rows)
+  artist_ids = set(row['artist_id'] for row in rows)
+  found_venues = set(id for (id,) in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids)).with_for_update())
+  found_artists = set(id for (id,) in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids)).with_for_update())
+  return venue_ids - found_venues, artist_ids - found_artists
+
+
+def check_shows(batch, rejects):
+  # the values of the batch's shows that can be booked; the others go to rejects
+  rows = [values for values, _ in batch]
+  missing_venues, missing_artists = missing_references(rows)
+  calendar = bookings.existing_calendar(rows)
+  kept = []
+  for number, (values, raw) in enumerate(batch, 1):
+    errors = {}
+    if values['venue_id'] in missing_venues:
+      errors['venue_id'] = ['Venue %d does not exist' % values['venue_id']]
+    if values['artist_id'] in missing_artists:
+      errors['artist_id'] = ['Artist %d does not exist' % values['artist_id']]
+    if values['end_time'] - values['start_time'] > MAX_SHOW_DURATION:
+      errors['duration'] = ['A show must last at most %d hours' % (MAX_SHOW_DURATION.total_seconds() // 3600)]
+    if not errors:
+      errors = bookings.claim_slot(calendar, values, 'row %d of its batch' % number)
+    if errors:
+      rejects.append((raw, errors))
+    else:
+      kept.append(values)
+  return kept
+
+
+def invalidate_pages(rows):
+  # the cached venue and artist pages and calendar months the shows are on
+  current_app.extensions['page_cache'].invalidate(
+    *set([cache.venue_key(row['venue_id']) for row in rows] + [cache.artist_key(row['artist_id']) for row in rows])
+    | calendars.keys((row['venue_id'], row['start_time'], row['end_time']) for row in rows))
+
+
+def _copy_value(value):
+  if value is None:
+    return None
+  if isinstance(value, list):
+    return '{' + ','.join('"' + item.replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value) + '}'
+  if isinstance(value, datetime):
+    return value.isoformat(' ')
+  return value
+
+
+def copy_rows(model, columns, rows):
+  # PostgreSQL COPY ... FROM STDIN; NULLs are written as unquoted empty fields
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  for row in rows:
+    writer.writerow(['' if row[column] is None else _copy_value(row[column]) for column in columns])
+  buffer.seek(0)
+  statement = 'COPY "%s" (%s) FROM STDIN WITH (FORMAT csv)' % (
+    model.__tablename__, ', '.join('"%s"' % column for column in columns))
+  cursor = db.session.connection().connection.cursor()
+  cursor.copy_expert(statement, buffer)
+
+
+def insert_rows(model, rows):
+  # one COPY or executemany per set of columns: rows without an id must
+  # leave the column out, or COPY writes NULL into it instead of using the
+  # sequence. The rows with ids go first, and the sequence is moved past
+  # them before the others take theirs.
+  groups = {}
+  for row in rows:
+    groups.setdefault(tuple(sorted(row)), []).append(row)
+  for columns, group in sorted(groups.items(), key=lambda item: 'id' not in item[0]):
+    if 'id' not in columns and len(groups) > 1:
+      reset_sequence(model)
+    if db.engine.dialect.name == 'postgresql':
+      copy_rows(model, columns, group)
+    else:
+      db.session.execute(model.__table__.insert(), group)
+
+
+def reset_sequence(model):
+  # rows loaded with explicit ids leave the Postgres id sequence behind
+  if db.engine.dialect.name == 'postgresql':
+    db.session.execute(text(
+      "SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), COALESCE(MAX(id), 1)) FROM \"{0}\""
+      .format(model.__tablename__)))
+
+
+def _load_batch(kind, batch, rejects):
+  _, model = FORMS[kind]
+  if kind == 'shows':
+    rows = check_shows(batch, rejects)
+  else:
+    rows = [values for values, _ in batch]
+  if not rows:
+    db.session.rollback()
+    return 0
+  if kind == 'venues':
+    geo.place_rows(rows)
+  insert_rows(model, rows)
+  if kind == 'shows':
+    counters.recount(set(row['venue_id'] for row in rows), set(row['artist_id'] for row in rows))
+  db.session.commit()
+  if kind == 'shows':
+    invalidate_pages(rows)
+  return len(rows)
+
+
+def load_batch(kind, batch, rejects):
+  # Loads a batch in one transaction. If the database refuses it (a
+  # duplicate id, a unique key, a reference the checks missed), it is rolled
+  # back and loaded in halves, down to the rows at fault, which are rejected
+  # with the database's error. The halves commit on their own.
+  checked = []
+  try:
+    loaded = _load_batch(kind, batch, checked)
+  except IntegrityError as error:
+    db.session.rollback()
+    if len(batch) == 1:
+      rejects.append((batch[0][1], {'database': [str(error.orig).strip()]}))
+      return 0
+    middle = len(batch) // 2
+    return load_batch(kind, batch[:middle], rejects) + load_batch(kind, batch[middle:], rejects)
+  rejects.extend(checked)
+  return loaded
+
+
+def import_file(kind, path, batch_size=BATCH_SIZE, rejects_path=None, echo=None):
+  # returns (loaded, rejected, seconds)
+  if rejects_path is None:
+    rejects_path = os.path.splitext(path)[0] + '.rejects.jsonl'
+  started = time.perf_counter()
+  loaded = rejected = 0
+  explicit_ids = False
+
+  with open(rejects_path, 'w') as rejects_file:
+    def write_rejects(rejects):
+      for raw, errors in rejects:
+        rejects_file.write(json.dumps({'row': raw, 'errors': errors}, default=str) + '\n')
+      return len(rejects)
+
+    batch, rejects = [], []
+    for raw in read_rows(path):
+      values, errors = validate(kind, raw)
+      if errors:
+        rejects.append((raw, errors))
+        continue
+      explicit_ids = explicit_ids or 'id' in values
+      batch.append((values, raw))
+      if len(batch) >= batch_size:
+        loaded += load_batch(kind, batch, rejects)
+        rejected += write_rejects(rejects)
+        batch, rejects = [], []
+        if echo:
+          echo('%d rows loaded, %.0f rows/s' % (loaded, loaded / (time.perf_counter() - started)))
+    if batch:
+      loaded += load_batch(kind, batch, rejects)
+    rejected += write_rejects(rejects)
+
+  if explicit_ids:
+    reset_sequence(FORMS[kind][1])
+    db.session.commit()
+  if not rejected:
+    os.remove(rejects_path)
+  return loaded, rejected, time.perf_counter() - started
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@click.command('import')
+@with_appcontext
+@click.argument('kind', type=click.Choice(sorted(FORMS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True, help='Rows per COPY/INSERT.')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows (default: <path>.rejects.jsonl).')
+def import_command(kind, path, batch_size, rejects_path):
+  """Bulk-load venues, artists or shows from a CSV or JSONL file."""
+  loaded, rejected, seconds = import_file(kind, path, batch_size, rejects_path, echo=click.echo)
+  click.echo('Loaded %d %s in %.1fs (%.0f rows/s), rejected %d.'
+             % (loaded, kind, seconds, loaded / seconds if seconds else 0, rejected))
+  if rejected:
+    click.echo('Rejected rows written to %s' % (rejects_path or os.path.splitext(path)[0] + '.rejects.jsonl'))
@@ -0,0 +1,338 @@
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_app_context, has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy import and_, event, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import db, Job
+
+#----------------------------------------------------------------------------#
+# Background jobs.
+#
+# Side effects that need not hold up a response (cache warming, counter
+# recounts) are queued as rows of the Job table with enqueue(), inside the
+# transaction of the change that calls for them: a job exists if and only
+# if that change was committed, and survives restarts. A key makes
+# enqueueing idempotent: a second job with the same key is not added.
+#
+# Each web process runs JOBS_WORKERS threads, started on its first request
+# (after gunicorn has forked) and woken when a commit queued something; in
+# a request, only once it is over, so the jobs run after whatever the
+# handler did past its commit (invalidating the pages they warm, say).
+# A worker claims a batch of jobs with an UPDATE that only takes those still
+# queued (on PostgreSQL, a SKIP LOCKED select picks them), so any number of
+# threads and processes can share the table. A failed job is retried
+# after an exponential backoff until it has had max_attempts; a job left
+# running by a worker that died is claimed again after JOBS_LOCK_TIMEOUT.
+#
+# Handlers are registered by kind with @handler and receive the payload,
+# inside an app context; their writes are committed with the job. They
+# may run more than once, so they must be safe to repeat.
+#
+# Jobs registered with @periodic are queued once per interval by whichever
+# worker gets there first: the key, kind and period, keeps out the rest.
+#----------------------------------------------------------------------------#
+
+HANDLERS = {}
+PERIODIC = {}
+STATUSES = ('queued', 'running', 'done', 'failed')
+RETRY_BACKOFF = timedelta(seconds=2)
+MAX_BACKOFF = timedelta(minutes=10)
+MAX_ERROR_LENGTH = 4000
+# jobs a worker claims at once: one round trip to claim them all
+CLAIM_BATCH = 10
+# dialects with INSERT ... ON CONFLICT DO NOTHING
+INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def handler(kind, max_attempts=None):
+  # registers the decorated function as the handler of `kind`
+  def register(function):
+    HANDLERS[kind] = (function, max_attempts)
+    return function
+  return register
+
+
+def periodic(kind, interval, max_attempts=None):
+  # registers a handler of `kind` whose job is queued every `interval`
+  def register(function):
+    PERIODIC[kind] = interval
+    return handler(kind, max_attempts)(function)
+  return register
+
+
+def schedule(scheduled, now=None):
+  # queues the periodic jobs whose period began since they were last queued
+  # here; `scheduled` remembers {kind: period} between calls
+  if now is None:
+    now = time.time()
+  due = False
+  for kind, interval in PERIODIC.items():
+    period = int(now // interval.total_seconds())
+    if scheduled.get(kind) != period:
+      enqueue(kind, {}, key='%s:%d' % (kind, period))
+      scheduled[kind] = period
+      due = True
+  if due:
+    db.session.commit()
+
+
+def enqueue(kind, payload, key=None, delay=None):
+  # adds a job to the session; the caller commits it with its own changes
+  if kind not in HANDLERS:
+    raise ValueError('No handler for job kind %r' % kind)
+  now = datetime.now()
+  values = dict(kind=kind, payload=payload, key=key, status='queued', attempts=0,
+                max_attempts=HANDLERS[kind][1] or current_app.config['JOBS_MAX_ATTEMPTS'],
+                run_at=now + delay if delay else now, created_at=now)
+  if key is None:
+    db.session.execute(Job.__table__.insert().values(**values))
+  elif db.engine.dialect.name in INSERTS:
+    insert = INSERTS[db.engine.dialect.name](Job.__table__).values(**values)
+    db.session.execute(insert.on_conflict_do_nothing(index_elements=['key']))
+  elif db.session.query(Job.id).filter(Job.key == key).first() is None:
+    db.session.execute(Job.__table__.insert().values(**values))
+  db.session.info['jobs_enqueued'] = True
+
+
+def _claimable(now, lock_timeout):
+  return or_(
+    and_(Job.status == 'queued', Job.run_at <= now),
+    and_(Job.status == 'running', Job.locked_at < now - lock_timeout),
+  )
+
+
+def claim(worker, lock_timeout, limit=CLAIM_BATCH):
+  # claims up to `limit` due jobs for `worker`, oldest first, and returns
+  # their (id, kind, payload, attempts, max_attempts)
+  now = datetime.now()
+  due = select(Job.id).where(_claimable(now, lock_timeout)).order_by(Job.run_at, Job.id).limit(limit)
+  if db.engine.dialect.name == 'postgresql':
+    due = due.with_for_update(skip_locked=True)
+  ids = db.session.execute(due).scalars().all()
+  claimed = []
+  if ids:
+    # another worker may have claimed some of them since: keep the rest
+    db.session.execute(update(Job)
+      .where(Job.id.in_(ids), _claimable(now, lock_timeout))
+      .values(status='running', locked_at=now, locked_by=worker, attempts=Job.attempts + 1)
+      .execution_options(synchronize_session=False))
+    claimed = db.session.execute(
+      select(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+      .where(Job.id.in_(ids), Job.locked_by == worker, Job.locked_at == now)
+      .order_by(Job.run_at, Job.id)).all()
+  db.session.commit()
+  return claimed
+
+
+def run(job):
+  # runs a claimed job and records how it went, with the handler's writes;
+  # returns its new status
+  job_id, kind, payload, attempts, max_attempts = job
+  try:
+    if kind not in HANDLERS:
+      raise LookupError('No handler for job kind %r' % kind)
+    HANDLERS[kind][0](payload)
+    values = dict(status='done', finished_at=datetime.now(), last_error=None)
+  except Exception:
+    db.session.rollback()
+    error = traceback.format_exc()[-MAX_ERROR_LENGTH:]
+    current_app.logger.warning('Job %d (%s) failed, attempt %d of %d:\n%s', job_id, kind, attempts, max_attempts, error)
+    if attempts >= max_attempts or kind not in HANDLERS:
+      values = dict(status='failed', finished_at=datetime.now(), last_error=error)
+    else:
+      backoff = min(RETRY_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+      values = dict(status='queued', run_at=datetime.now() + backoff, last_error=error)
+  db.session.execute(update(Job).where(Job.id == job_id).values(locked_at=None, locked_by=None, **values)
+    .execution_options(synchronize_session=False))
+  db.session.commit()
+  return values['status']
+
+
+def work(worker, lock_timeout):
+  # claims and runs a batch of due jobs; returns how many ran
+  claimed = claim(worker, lock_timeout)
+  for job in claimed:
+    run(job)
+  return len(claimed)
+
+
+class Pool(object):
+  # JOBS_WORKERS threads in this process that run due jobs until stopped
+
+  def __init__(self, app, workers, poll_interval, lock_timeout):
+    self.app = app
+    self.workers = workers
+    self.poll_interval = poll_interval
+    self.lock_timeout = lock_timeout
+    self.condition = threading.Condition()
+    self.threads = []
+    self.pid = None
+    self.stopping = False
+    self.scheduled = {}
+    self.schedule_lock = threading.Lock()
+
+  def start(self):
+    # threads do not survive a fork, so a forked process starts its own
+    if self.pid == os.getpid() or not self.workers:
+      return
+    with self.condition:
+      if self.pid == os.getpid() or not self.workers:
+        return
+      self.pid = os.getpid()
+      self.stopping = False
+      self.threads = [threading.Thread(target=self._work, args=('%s:%d:%d' % (socket.gethostname(), self.pid, number),),
+                                       name='job-worker-%d' % number, daemon=True)
+                      for number in range(self.workers)]
+    for thread in self.threads:
+      thread.start()
+
+  def wake(self):
+    with self.condition:
+      self.condition.notify_all()
+
+  def stop(self, timeout=None):
+    with self.condition:
+      self.stopping = True
+      self.condition.notify_all()
+    for thread in self.threads:
+      thread.join(timeout)
+    self.pid = None
+
+  def _work(self, worker):
+    while not self.stopping:
+      with self.app.app_context():
+        try:
+          with self.schedule_lock:
+            schedule(self.scheduled)
+          busy = work(worker, self.lock_timeout)
+        except Exception:
+          self.app.logger.exception('Job worker %s could not claim a job', worker)
+          busy = False
+        finally:
+          db.session.remove()
+      if not busy:
+        with self.condition:
+          if not self.stopping:
+            self.condition.wait(self.poll_interval)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+  # a commit that queued jobs wakes this process's workers, at the end of
+  # the request if there is one
+  if session.info.pop('jobs_enqueued', False) and has_app_context():
+    if has_request_context():
+      request.environ['fyyur.jobs_wake'] = True
+      return
+    pool = current_app.extensions.get('jobs')
+    if pool is not None:
+      pool.wake()
+
+
+def _wake_after_request(exception=None):
+  if request.environ.pop('fyyur.jobs_wake', False):
+    current_app.extensions['jobs'].wake()
+
+
+def init_app(app):
+  pool = Pool(app, app.config['JOBS_WORKERS'], app.config['JOBS_POLL_INTERVAL'],
+              timedelta(seconds=app.config['JOBS_LOCK_TIMEOUT']))
+  app.before_request(pool.start)
+  app.teardown_request(_wake_after_request)
+  return pool
+
+
+def stats(now=None):
+  # queue depth by kind and status, and throughput over the last minute and hour
+  if now is None:
+    now = datetime.now()
+  depth = db.session.query(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status).all()
+  oldest = db.session.query(func.min(Job.run_at)).filter(Job.status == 'queued', Job.run_at <= now).scalar()
+  finished = dict(
+    (label, dict(db.session.query(Job.status, func.count())
+                 .filter(Job.finished_at >= now - window).group_by(Job.status).all()))
+    for label, window in (('minute', timedelta(minutes=1)), ('hour', timedelta(hours=1))))
+  return depth, oldest, finished
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+jobs_cli = AppGroup('jobs', help='Inspect and run the background job queue.')
+
+
+@jobs_cli.command('status')
+def status_command():
+  """Show queue depth by kind and status, and recent throughput."""
+  now = datetime.now()
+  depth, oldest, finished = stats(now)
+  by_kind = {}
+  for kind, status, count in depth:
+    by_kind.setdefault(kind, dict.fromkeys(STATUSES, 0))[status] = count
+  click.echo('%-24s %8s %8s %8s %8s' % (('kind',) + STATUSES))
+  for kind in sorted(by_kind):
+    click.echo('%-24s %8d %8d %8d %8d' % ((kind,) + tuple(by_kind[kind][status] for status in STATUSES)))
+  click.echo('Oldest due job waiting: %s' % ('%.1fs' % (now - oldest).total_seconds() if oldest else 'none'))
+  for label, seconds in (('minute', 60), ('hour', 3600)):
+    done, failed = finished[label].get('done', 0), finished[label].get('failed', 0)
+    click.echo('Last %s: %d done (%.2f/s), %d failed' % (label, done, done / float(seconds), failed))
+
+
+@jobs_cli.command('work')
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True, help='Worker threads.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due.')
+def work_command(workers, burst):
+  """Run jobs in the foreground, e.g. with JOBS_WORKERS=0 on the web processes."""
+  app = current_app._get_current_object()
+  lock_timeout = timedelta(seconds=app.config['JOBS_LOCK_TIMEOUT'])
+  if burst:
+    ran = 0
+    while True:
+      batch = work('%s:%d:cli' % (socket.gethostname(), os.getpid()), lock_timeout)
+      if not batch:
+        break
+      ran += batch
+    click.echo('Ran %d job(s).' % ran)
+    return
+  pool = Pool(app, workers, app.config['JOBS_POLL_INTERVAL'], lock_timeout)
+  pool.start()
+  try:
+    while True:
+      pool.threads[0].join(1.0)
+  except KeyboardInterrupt:
+    pool.stop()
+
+
+@jobs_cli.command('retry')
+@click.option('--kind', help='Only jobs of this kind.')
+def retry_command(kind):
+  """Queue the failed jobs again."""
+  query = db.session.query(Job).filter(Job.status == 'failed')
+  if kind:
+    query = query.filter(Job.kind == kind)
+  retried = query.update({Job.status: 'queued', Job.attempts: 0, Job.run_at: datetime.now(), Job.finished_at: None},
+                         synchronize_session=False)
+  db.session.commit()
+  click.echo('Queued %d failed job(s) again.' % retried)
+
+
+@jobs_cli.command('purge')
+@click.option('--days', type=float, default=None, help='Keep finished jobs this long [JOBS_KEEP_DAYS].')
+def purge_command(days):
+  """Delete finished jobs, done or failed, older than --days."""
+  if days is None:
+    days = current_app.config['JOBS_KEEP_DAYS']
+  purged = db.session.query(Job).filter(Job.status.in_(('done', 'failed')),
+                                        Job.finished_at < datetime.now() - timedelta(days=days)) \
+    .delete(synchronize_session=False)
+  db.session.commit()
+  click.echo('Purged %d finished job(s).' % purged)
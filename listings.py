@@ -0,0 +1,207 @@
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import String, and_, cast, false, func, literal, null, or_, select, true, union_all
+
+from models import db, Venue, Artist, Show
+
+SHOWS_PER_PAGE = 30
+
+#----------------------------------------------------------------------------#
+# Listings.
+#
+# /venues and /artists take genre, city, state and seeking filters in the
+# query string. Genre matches use the GIN index on genres on PostgreSQL
+# (ix_Venue_genres, ix_Artist_genres), city and state the (state, city)
+# index. facets() counts the matching rows per genre, state, city and
+# seeking value in one query.
+#----------------------------------------------------------------------------#
+
+FILTERS = ('genre', 'city', 'state', 'seeking')
+SEEKING = {
+  Venue: Venue.seeking_talent,
+  Artist: Artist.seeking_venue,
+}
+TRUTHY = ('1', 'true', 'yes')
+FALSY = ('0', 'false', 'no')
+
+
+def parse_filters(args):
+  # the listing filters given in `args` (request.args); blank ones are dropped
+  filters = {}
+  for name in FILTERS:
+    value = (args.get(name) or '').strip()
+    if not value:
+      continue
+    if name == 'seeking':
+      if value.lower() not in TRUTHY + FALSY:
+        continue
+      value = value.lower() in TRUTHY
+    filters[name] = value
+  return filters
+
+
+def conditions(model, filters):
+  where = []
+  if 'genre' in filters:
+    where.append(has_genre(model, filters['genre']))
+  if 'state' in filters:
+    where.append(model.state == filters['state'])
+  if 'city' in filters:
+    where.append(model.city == filters['city'])
+  if 'seeking' in filters:
+    where.append(func.coalesce(SEEKING[model], false()) == filters['seeking'])
+  return where
+
+
+def venue_areas(filters=None):
+  # Builds the /venues listing: every (city, state) area with its venues and
+  # each venue's number of upcoming shows, in a single query over Venue.
+  rows = db.session.query(
+    Venue.id,
+    Venue.name,
+    Venue.city,
+    Venue.state,
+    Venue.upcoming_shows_count.label('num_upcoming_shows'),
+    Venue.updated_at
+  ).filter(*conditions(Venue, filters or {})) \
+   .order_by(Venue.state, Venue.city, Venue.name, Venue.id).all()
+
+  areas = []
+  for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
+    areas.append({
+      "city" : city,
+      "state" : state,
+      "venues" : [{
+        "id" : venue.id,
+        "name" : venue.name,
+        "num_upcoming_shows" : venue.num_upcoming_shows,
+        "updated_at" : venue.updated_at
+      } for venue in venues]
+    })
+  return areas
+
+
+def artist_list(filters=None):
+  # the /artists listing, in id order
+  rows = db.session.query(Artist.id, Artist.name, Artist.updated_at) \
+    .filter(*conditions(Artist, filters or {})) \
+    .order_by(Artist.id).all()
+  return [dict(row._mapping) for row in rows]
+
+
+def facets(model, filters=None):
+  # Result counts among the rows matching `filters`: the total, and per
+  # genre, state, (city, state) and seeking value, most common first. One
+  # statement: a UNION ALL of GROUP BYs over the matching rows. Archived rows
+  # are left out here, as deletes.hide_archived only rewrites plain SELECTs.
+  matched = select(
+    model.genres,
+    model.city,
+    model.state,
+    func.coalesce(SEEKING[model], false()).label('seeking'),
+  ).where(model.archived_at.is_(None), *conditions(model, filters or {})).cte('matched')
+  genres = genre_values(matched.c.genres)
+  count = func.count().label('count')
+  statement = union_all(
+    select(literal('total'), cast(null(), String), cast(null(), String), count).select_from(matched),
+    select(literal('genre'), genres.c.value, cast(null(), String), count)
+      .select_from(matched).join(genres, true()).group_by(genres.c.value),
+    select(literal('state'), matched.c.state, cast(null(), String), count)
+      .group_by(matched.c.state),
+    select(literal('city'), matched.c.city, matched.c.state, count)
+      .group_by(matched.c.city, matched.c.state),
+    select(literal('seeking'), cast(matched.c.seeking, String), cast(null(), String), count)
+      .group_by(matched.c.seeking),
+  )
+
+  result = {"total": 0, "genre": [], "state": [], "city": [], "seeking": []}
+  for facet, value, state, n in db.session.execute(statement):
+    if facet == 'total':
+      result['total'] = n
+    elif value is None:
+      continue
+    elif facet == 'city':
+      result['city'].append({"value": value, "state": state, "count": n})
+    else:
+      if facet == 'seeking':
+        # booleans come back as 'true'/'false' (PostgreSQL) or '1'/'0' (SQLite)
+        value = value.lower() in TRUTHY
+      result[facet].append({"value": value, "count": n})
+  for facet in ('genre', 'state', 'city', 'seeking'):
+    result[facet].sort(key=lambda item: (-item['count'], str(item['value'])))
+  return result
+
+
+def genre_values(genres):
+  # genres as a table-valued function with one "value" row per genre,
+  # for joining against the row that holds them
+  if db.engine.dialect.name == 'postgresql':
+    return func.unnest(genres).table_valued('value').render_derived()
+  return func.json_each(genres).table_valued('value')
+
+
+def has_genre(model, genre):
+  # genres is a text[] on PostgreSQL and a JSON array on SQLite
+  if db.engine.dialect.name == 'postgresql':
+    return model.genres.contains([genre])
+  values = func.json_each(model.genres).table_valued('value')
+  return select(literal(1)).select_from(values).where(values.c.value == genre).exists()
+
+
+def encode_cursor(show):
+  # keyset cursor pointing just past the given feed row
+  return show["start_time"].isoformat() + '_' + str(show["id"])
+
+
+def decode_cursor(cursor):
+  start_time, show_id = cursor.rsplit('_', 1)
+  return datetime.fromisoformat(start_time), int(show_id)
+
+
+def show_feed(when=None, cursor=None, per_page=SHOWS_PER_PAGE, now=None):
+  # One page of the /shows feed, keyset-paginated on (start_time, id).
+  # `when` is None for every show, 'upcoming' or 'past'. Upcoming shows are
+  # listed soonest first, everything else newest first. Shows of archived
+  # venues and artists are left out here: deletes.hide_archived doesn't
+  # reach the joins of a column query.
+  # Returns (shows, next_cursor); next_cursor is None on the last page.
+  if now is None:
+    now = datetime.now()
+
+  query = db.session.query(
+    Show.id,
+    Show.start_time,
+    Show.venue_id,
+    Venue.name.label('venue_name'),
+    Show.artist_id,
+    Artist.name.label('artist_name'),
+    Artist.image_link.label('artist_image_link')
+  ).join(Venue, Venue.id == Show.venue_id) \
+   .join(Artist, Artist.id == Show.artist_id) \
+   .filter(Venue.archived_at.is_(None), Artist.archived_at.is_(None))
+
+  if when == 'upcoming':
+    query = query.filter(Show.start_time > now)
+  elif when == 'past':
+    query = query.filter(Show.start_time <= now)
+
+  ascending = when == 'upcoming'
+  if cursor:
+    start_time, show_id = decode_cursor(cursor)
+    if ascending:
+      query = query.filter(or_(Show.start_time > start_time,
+                               and_(Show.start_time == start_time, Show.id > show_id)))
+    else:
+      query = query.filter(or_(Show.start_time < start_time,
+                               and_(Show.start_time == start_time, Show.id < show_id)))
+
+  if ascending:
+    query = query.order_by(Show.start_time, Show.id)
+  else:
+    query = query.order_by(Show.start_time.desc(), Show.id.desc())
+
+  rows = query.limit(per_page + 1).all()
+  shows = [dict(row._mapping) for row in rows[:per_page]]
+  next_cursor = encode_cursor(shows[-1]) if len(rows) > per_page else None
+  return shows, next_cursor
@@ -0,0 +1,260 @@
+import math
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from forms import Genres
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#
+# Ranks the venues seeking talent for an artist, and the artists seeking a
+# venue for a venue. A candidate's score is a weighted sum of
+#
+# - genre overlap: the Jaccard index of the two genre bitmasks, one bit per
+#   member of forms.Genres;
+# - location: 1 in the same city, 0.5 in the same state;
+# - history: the past shows the two have played together, log-scaled.
+#
+# Each side lives in memory as NumPy arrays (ids, genre masks, city and
+# state codes, seeking flags) and candidates are scored BATCH_SIZE rows at a
+# time. Before every ranking the arrays pick up the rows whose updated_at
+# moved since the last look, through the updated_at index: creates and
+# edits from any worker land in place, without a rebuild. Deleted rows are
+# dropped when a ranking comes across them.
+#----------------------------------------------------------------------------#
+
+WEIGHTS = {
+  "genre": 0.6,
+  "location": 0.25,
+  "history": 0.15,
+}
+# past shows together at which history counts in full
+HISTORY_CAP = 5
+BATCH_SIZE = 65536
+SCORE_DECIMALS = 6
+LOAD_BATCH_SIZE = 10000
+# a row committed just after a refresh can carry an updated_at from before
+# it; each refresh looks back this far past the previous one to catch it
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+GENRE_BITS = dict((genre, 1 << bit) for bit, genre in enumerate(Genres.fetch_genres()))
+# set bits of every possible mask
+POPCOUNT = np.array([bin(mask).count('1') for mask in range(1 << len(GENRE_BITS))], dtype=np.uint8)
+
+
+def genre_mask(genres):
+  # genres outside forms.Genres are left out
+  mask = 0
+  for genre in genres or ():
+    mask |= GENRE_BITS.get(genre, 0)
+  return mask
+
+
+class Side(object):
+  # One model's rows as columns. Rows are never moved, so `rows` maps an id
+  # to its position for as long as the process lives; deleted rows stay as
+  # inactive holes.
+
+  def __init__(self, model, seeking):
+    self.model = model
+    self.seeking_column = seeking
+    self.size = 0
+    self.rows = {}
+    self.ids = np.zeros(0, dtype=np.int64)
+    self.masks = np.zeros(0, dtype=np.uint32)
+    self.cities = np.zeros(0, dtype=np.int32)
+    self.states = np.zeros(0, dtype=np.int32)
+    self.seeking = np.zeros(0, dtype=bool)
+    self.refreshed_at = None
+
+  def _grow(self, needed):
+    capacity = len(self.ids)
+    if needed <= capacity:
+      return
+    capacity = max(needed, capacity * 2, 1024)
+    for name in ('ids', 'masks', 'cities', 'states', 'seeking'):
+      column = getattr(self, name)
+      grown = np.zeros(capacity, dtype=column.dtype)
+      grown[:self.size] = column[:self.size]
+      setattr(self, name, grown)
+
+  def upsert(self, rows, codes):
+    # rows of (id, genres, city, state, seeking)
+    self._grow(self.size + len(rows))
+    for entity_id, genres, city, state, seeking in rows:
+      row = self.rows.get(entity_id)
+      if row is None:
+        row = self.rows[entity_id] = self.size
+        self.size += 1
+      self.ids[row] = entity_id
+      self.masks[row] = genre_mask(genres)
+      self.cities[row], self.states[row] = codes.place(city, state)
+      self.seeking[row] = bool(seeking)
+
+  def remove(self, entity_id):
+    row = self.rows.get(entity_id)
+    if row is not None:
+      self.seeking[row] = False
+
+  def refresh(self, codes):
+    # loads the rows changed since the last refresh, a range scan on the
+    # updated_at index, or every row the first time, in id order batches;
+    # returns how many
+    columns = (self.model.id, self.model.genres, self.model.city, self.model.state, self.seeking_column)
+    started = datetime.now()
+    if self.refreshed_at is not None:
+      rows = db.session.execute(select(*columns)
+        .where(self.model.updated_at >= self.refreshed_at - REFRESH_OVERLAP)).all()
+      self.upsert(rows, codes)
+      self.refreshed_at = started
+      return len(rows)
+
+    loaded, last_id = 0, 0
+    while True:
+      rows = db.session.execute(select(*columns).where(self.model.id > last_id)
+        .order_by(self.model.id).limit(LOAD_BATCH_SIZE)).all()
+      if not rows:
+        break
+      self.upsert(rows, codes)
+      last_id = rows[-1].id
+      loaded += len(rows)
+    self.refreshed_at = started
+    return loaded
+
+
+class Codes(object):
+  # cities and states as small integers, so they compare as arrays
+
+  def __init__(self):
+    self.codes = {}
+
+  def code(self, key):
+    return self.codes.setdefault(key, len(self.codes) + 1)
+
+  def place(self, city, state):
+    # (city code, state code); 0 stands for unknown and matches nothing
+    state = (state or '').strip().upper()
+    city = (city or '').strip().lower()
+    if not state:
+      return 0, 0
+    return (self.code((state, city)) if city else 0), self.code((state,))
+
+
+class Matchmaker(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.codes = Codes()
+    self.venues = Side(Venue, Venue.seeking_talent)
+    self.artists = Side(Artist, Artist.seeking_venue)
+
+  def refresh(self):
+    with self.lock:
+      return self.venues.refresh(self.codes) + self.artists.refresh(self.codes)
+
+  def score(self, candidates, entity, history, limit):
+    # (ids, scores) of the `limit` best candidates for `entity`, a (genres,
+    # city, state) row, scored BATCH_SIZE rows at a time
+    mask = np.uint32(genre_mask(entity[0]))
+    city, state = self.codes.place(entity[1], entity[2])
+    # an unknown place matches nothing, unknown candidates included
+    city, state = city or -1, state or -1
+    best_ids, best_scores = [], []
+    with self.lock:
+      history_rows = np.array([candidates.rows.get(other_id, -1) for other_id in history], dtype=np.int64)
+      history_bonus = np.array([WEIGHTS["history"] * history_score(shows) for shows in history.values()])
+      for start in range(0, candidates.size, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, candidates.size)
+        masks = candidates.masks[start:end]
+        union = POPCOUNT[masks | mask]
+        genre = POPCOUNT[masks & mask] / np.maximum(union, 1)
+        location = np.where(candidates.cities[start:end] == city, 1.0,
+                            np.where(candidates.states[start:end] == state, 0.5, 0.0))
+        scores = WEIGHTS["genre"] * genre + WEIGHTS["location"] * location
+        played = (history_rows >= start) & (history_rows < end)
+        scores[history_rows[played] - start] += history_bonus[played]
+        # equal scores must compare equal for the tie-break on id
+        scores = np.round(scores, SCORE_DECIMALS)
+        scores[~candidates.seeking[start:end]] = -np.inf
+        ids = candidates.ids[start:end]
+        if len(scores) > limit:
+          # the `limit` best, and everything tied with the last of them
+          threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+          keep = scores >= threshold
+          ids, scores = ids[keep], scores[keep]
+        best_ids.append(ids)
+        best_scores.append(scores)
+    if not best_ids:
+      return [], []
+    ids, scores = np.concatenate(best_ids), np.concatenate(best_scores)
+    keep = np.isfinite(scores)
+    ids, scores = ids[keep], scores[keep]
+    # highest score first, then lowest id
+    order = np.lexsort((ids, -scores))[:limit]
+    return ids[order].tolist(), scores[order].tolist()
+
+  def rank(self, for_artist, entity_id, limit):
+    # The top `limit` seeking venues for an artist (for_artist=True) or
+    # seeking artists for a venue, as dicts with their score and its parts;
+    # None if the entity doesn't exist.
+    self.refresh()
+    model, candidates = (Artist, self.venues) if for_artist else (Venue, self.artists)
+    other = candidates.model
+    entity = db.session.query(model.genres, model.city, model.state).filter(model.id == entity_id).first()
+    if entity is None:
+      return None
+    history = past_shows_together(for_artist, entity_id)
+
+    while True:
+      ids, scores = self.score(candidates, entity, history, limit)
+      rows = dict((row.id, row) for row in db.session.query(
+        other.id, other.name, other.city, other.state, other.genres, other.image_link)
+        .filter(other.id.in_(ids)))
+      gone = [candidate_id for candidate_id in ids if candidate_id not in rows]
+      if not gone:
+        break
+      # deleted since they were loaded: forget them and rank again
+      with self.lock:
+        for candidate_id in gone:
+          candidates.remove(candidate_id)
+
+    mask = genre_mask(entity.genres)
+    city, state = self.codes.place(entity.city, entity.state)
+    results = []
+    for candidate_id, score in zip(ids, scores):
+      row = rows[candidate_id]
+      masks = genre_mask(row.genres)
+      union = bin(masks | mask).count('1')
+      row_city, row_state = self.codes.place(row.city, row.state)
+      results.append({
+        "id" : row.id,
+        "name" : row.name,
+        "city" : row.city,
+        "state" : row.state,
+        "genres" : row.genres,
+        "image_link" : row.image_link,
+        "score" : score,
+        "genre_overlap" : round(bin(masks & mask).count('1') / union, 4) if union else 0.0,
+        "same_city" : bool(city) and row_city == city,
+        "same_state" : bool(state) and row_state == state,
+        "past_shows_together" : history.get(candidate_id, 0),
+      })
+    return results
+
+
+def history_score(shows):
+  return min(1.0, math.log1p(shows) / math.log1p(HISTORY_CAP))
+
+
+def past_shows_together(for_artist, entity_id, now=None):
+  # {other id: past shows together}, a range scan on (artist_id | venue_id, start_time)
+  if now is None:
+    now = datetime.now()
+  own, other = (Show.artist_id, Show.venue_id) if for_artist else (Show.venue_id, Show.artist_id)
+  rows = db.session.query(other, func.count()) \
+    .filter(own == entity_id, Show.start_time <= now).group_by(other)
+  return dict((other_id, count) for other_id, count in rows)
@@ -0,0 +1,242 @@
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#
+# Counts and times every SQL statement run while handling a request, through
+# cursor events on the `db` engine. Each response carries the totals in a
+# Server-Timing header and /metrics exports them, along with per-route latency
+# histograms, connection pool gauges and page and fragment cache counters, in
+# the Prometheus text format.
+#
+# A request that runs the same statement shape (literals stripped) more than
+# SQL_NPLUSONE_THRESHOLD times is logged as a likely N+1; 0 turns it off.
+#
+# Metrics live in the process: with several gunicorn workers, scrape each one
+# or accept per-worker numbers.
+#----------------------------------------------------------------------------#
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s)\s*,?)+\)')
+
+
+def statement_shape(statement):
+  # the statement with literals and IN (...) lists folded, so that repeats
+  # of one query with different ids look the same
+  shape = LITERALS.sub('?', statement)
+  shape = PLACEHOLDER_LISTS.sub('(?)', shape)
+  return ' '.join(shape.split())
+
+
+class Histogram(object):
+  # observed from several threads: request handlers and pool checkouts
+  def __init__(self, buckets):
+    self.lock = threading.Lock()
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    with self.lock:
+      self.count += 1
+      self.sum += value
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          self.counts[i] += 1
+
+  def snapshot(self):
+    # (counts, count, sum) read together
+    with self.lock:
+      return list(self.counts), self.count, self.sum
+
+
+class Metrics(object):
+  def __init__(self, nplusone_threshold=0, logger=None):
+    self.nplusone_threshold = nplusone_threshold
+    self.logger = logger
+    self.lock = threading.Lock()
+    self.latency = {}      # (endpoint, method) -> Histogram of seconds
+    self.queries = {}      # endpoint -> Histogram of statements per request
+    self.responses = Counter()   # (endpoint, method, status)
+    self.sql_seconds = Counter()  # endpoint -> seconds spent in SQL
+    self.nplusone = Counter()     # endpoint -> requests flagged as N+1
+    self.pools = {}        # name -> engine, for the pool gauges
+    self.gauges = []       # (name, help, label, callable returning {label value: number})
+
+  # -- request bookkeeping ---------------------------------------------------
+
+  def start_request(self):
+    g.metrics_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    g.sql_shapes = Counter()
+
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_count' in g:
+      conn.info.setdefault('metrics_started', []).append((context, time.perf_counter()))
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    self._finish_statement(conn, context, statement)
+
+  def handle_error(self, exception_context):
+    # a statement that raises never reaches after_cursor_execute: without
+    # this its start time would stay on the connection's stack for good
+    if exception_context.connection is not None and exception_context.execution_context is not None:
+      self._finish_statement(exception_context.connection, exception_context.execution_context,
+                             exception_context.statement)
+
+  def _finish_statement(self, conn, context, statement):
+    # pops the start time pushed for `context`, if it is still there: errors
+    # raised before the cursor ran or after after_cursor_execute have none
+    started = conn.info.get('metrics_started')
+    if not (started and started[-1][0] is context):
+      return
+    _, at = started.pop()
+    if not (has_request_context() and 'sql_count' in g):
+      return
+    g.sql_seconds += time.perf_counter() - at
+    g.sql_count += 1
+    if self.nplusone_threshold and statement:
+      g.sql_shapes[statement_shape(statement)] += 1
+
+  def finish_request(self, response):
+    if 'metrics_started' not in g:
+      return response
+    elapsed = time.perf_counter() - g.metrics_started
+    endpoint = request.endpoint or 'unknown'
+    response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries", app;dur=%.2f'
+                         % (g.sql_seconds * 1000, g.sql_count, elapsed * 1000))
+
+    repeated = []
+    if self.nplusone_threshold:
+      repeated = [(shape, n) for shape, n in g.sql_shapes.items() if n > self.nplusone_threshold]
+    with self.lock:
+      key = (endpoint, request.method)
+      self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+      self.queries.setdefault(endpoint, Histogram(QUERY_BUCKETS)).observe(g.sql_count)
+      self.responses[(endpoint, request.method, response.status_code)] += 1
+      self.sql_seconds[endpoint] += g.sql_seconds
+      if repeated:
+        self.nplusone[endpoint] += 1
+    if repeated and self.logger is not None:
+      for shape, n in repeated:
+        self.logger.warning('Possible N+1 in %s %s: statement ran %d times: %s',
+                            request.method, request.path, n, shape[:500])
+    return response
+
+  # -- exposition ------------------------------------------------------------
+
+  def watch_pool(self, name, engine):
+    self.pools[name] = engine
+
+  def add_gauge(self, name, help, label, read):
+    self.gauges.append((name, help, label, read))
+
+  def render(self, page_cache=None, fragment_cache=None):
+    lines = []
+
+    def family(name, kind, help):
+      lines.append('# HELP %s %s' % (name, help))
+      lines.append('# TYPE %s %s' % (name, kind))
+
+    def labels(**values):
+      return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in sorted(values.items())) + '}'
+
+    def histogram(name, hist, **values):
+      counts, total, seconds = hist.snapshot()
+      for bound, count in zip(hist.buckets, counts):
+        lines.append('%s_bucket%s %d' % (name, labels(le=bound, **values), count))
+      lines.append('%s_bucket%s %d' % (name, labels(le='+Inf', **values), total))
+      lines.append('%s_sum%s %.6f' % (name, labels(**values), seconds))
+      lines.append('%s_count%s %d' % (name, labels(**values), total))
+
+    with self.lock:
+      family('fyyur_request_duration_seconds', 'histogram', 'Time to build a response, by route.')
+      for (endpoint, method), hist in sorted(self.latency.items()):
+        histogram('fyyur_request_duration_seconds', hist, endpoint=endpoint, method=method)
+      family('fyyur_requests_total', 'counter', 'Responses sent, by route and status.')
+      for (endpoint, method, status), n in sorted(self.responses.items()):
+        lines.append('fyyur_requests_total%s %d' % (labels(endpoint=endpoint, method=method, status=status), n))
+      family('fyyur_request_sql_queries', 'histogram', 'SQL statements run per request, by route.')
+      for endpoint, hist in sorted(self.queries.items()):
+        histogram('fyyur_request_sql_queries', hist, endpoint=endpoint)
+      family('fyyur_request_sql_seconds_total', 'counter', 'Time spent executing SQL, by route.')
+      for endpoint, seconds in sorted(self.sql_seconds.items()):
+        lines.append('fyyur_request_sql_seconds_total%s %.6f' % (labels(endpoint=endpoint), seconds))
+      family('fyyur_nplusone_requests_total', 'counter', 'Requests that repeated one statement shape past the N+1 threshold.')
+      for endpoint, n in sorted(self.nplusone.items()):
+        lines.append('fyyur_nplusone_requests_total%s %d' % (labels(endpoint=endpoint), n))
+
+    gauges = (('size', 'Configured pool size.'),
+              ('checkedout', 'Connections in use.'),
+              ('checkedin', 'Idle connections in the pool.'),
+              ('overflow', 'Connections opened beyond the pool size.'))
+    for stat, help in gauges:
+      family('fyyur_db_pool_%s' % stat, 'gauge', help)
+      for name, engine in sorted(self.pools.items()):
+        # NullPool and StaticPool (SQLite) have no counters
+        method = getattr(engine.pool, stat, None)
+        if callable(method):
+          lines.append('fyyur_db_pool_%s%s %d' % (stat, labels(engine=name), method()))
+
+    family('fyyur_db_pool_wait_seconds', 'histogram', 'Time spent waiting to check a connection out of the pool.')
+    for name, engine in sorted(self.pools.items()):
+      hist = getattr(engine.pool, 'wait_histogram', None)
+      if hist is not None:
+        histogram('fyyur_db_pool_wait_seconds', hist, engine=name)
+
+    for name, help, label, read in self.gauges:
+      family(name, 'gauge', help)
+      for key, value in sorted(read().items()):
+        lines.append('%s%s %s' % (name, labels(**{label: key}), '+Inf' if value == float('inf') else value))
+
+    if page_cache is not None:
+      stats = page_cache.stats()
+      for stat, kind in (('hits', 'counter'), ('misses', 'counter'), ('invalidations', 'counter'), ('entries', 'gauge')):
+        name = 'fyyur_page_cache_%s%s' % (stat, '_total' if kind == 'counter' else '')
+        family(name, kind, 'Page cache %s.' % stat)
+        lines.append('%s%s %d' % (name, labels(backend=stats['backend']), stats[stat]))
+
+    if fragment_cache is not None:
+      stats = fragment_cache.stats()
+      for stat, kind in (('hits', 'counter'), ('misses', 'counter'), ('bypassed', 'counter'),
+                         ('invalidations', 'counter'), ('entries', 'gauge')):
+        name = 'fyyur_fragment_cache_%s%s' % (stat, '_total' if kind == 'counter' else '')
+        family(name, kind, 'Template fragment cache %s.' % stat)
+        lines.append('%s%s %d' % (name, labels(backend=stats['backend']), stats[stat]))
+      family('fyyur_fragment_cache_render_seconds_total', 'counter',
+             'Time in cached template blocks: as rendered, and as it would have been uncached.')
+      lines.append('fyyur_fragment_cache_render_seconds_total%s %.6f' % (labels(backend=stats['backend'], mode='cached'), stats['render_seconds']))
+      lines.append('fyyur_fragment_cache_render_seconds_total%s %.6f' % (labels(backend=stats['backend'], mode='uncached'), stats['render_seconds_uncached']))
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app, db):
+  # registers the request hooks and the cursor listeners; returns the Metrics
+  metrics = Metrics(app.config.get('SQL_NPLUSONE_THRESHOLD', 0), app.logger)
+  with app.app_context():
+    engines = [('primary', db.engine)] + [(bind, db.get_engine(app, bind=bind))
+                                          for bind in sorted(app.config.get('SQLALCHEMY_BINDS') or {})]
+  for name, engine in engines:
+    event.listen(engine, 'before_cursor_execute', metrics.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    event.listen(engine, 'handle_error', metrics.handle_error)
+    metrics.watch_pool(name, engine)
+  router = app.extensions.get('replica_router')
+  if router is not None:
+    metrics.add_gauge('fyyur_db_replica_lag_seconds', 'Seconds a replica trails the primary (-1 = unreachable).',
+                      'replica', router.lag_gauges)
+  app.before_request(metrics.start_request)
+  app.after_request(metrics.finish_request)
+  return metrics
@@ -0,0 +1,58 @@
+"""SQLite search index triggers: update triggers fire only for the indexed columns
+
+Revision ID: 2f6d8a3b1c47
+Revises: f4a7c2e9b160
+Create Date: 2026-10-19 09:12:04.530918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f6d8a3b1c47'
+down_revision = 'f4a7c2e9b160'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_TABLES = {
+    'venue_search': ('Venue', ['name', 'city']),
+    'artist_search': ('Artist', ['name']),
+}
+
+
+def _create_triggers(fts, table, columns, update):
+    cols = ', '.join(columns)
+    new = ', '.join('new.' + c for c in columns)
+    old = ', '.join('old.' + c for c in columns)
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{table}" BEGIN
+        INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+    END""")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{table}" BEGIN
+        INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+    END""")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER {update} ON "{table}" BEGIN
+        INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+        INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+    END""")
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for fts, (table, columns) in SQLITE_TABLES.items():
+        op.execute(f'DROP TRIGGER IF EXISTS {fts}_au')
+        # a41f0c3d9e12 rebuilt Venue and Artist in batch mode, which drops
+        # their triggers: put all three back, and reindex the rows written
+        # in the meantime
+        _create_triggers(fts, table, columns, 'UPDATE OF ' + ', '.join(columns))
+        op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for fts, (table, columns) in SQLITE_TABLES.items():
+        op.execute(f'DROP TRIGGER IF EXISTS {fts}_au')
+        _create_triggers(fts, table, columns, 'UPDATE')
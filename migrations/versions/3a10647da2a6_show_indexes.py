@@ -0,0 +1,36 @@
+"""indexes on Show for per-venue/per-artist time ranges and start_time ordering
+
+Revision ID: 3a10647da2a6
+Revises: 8b18342c5b8d
+Create Date: 2026-10-18 17:42:09.560318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a10647da2a6'
+down_revision = '8b18342c5b8d'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = {
+    'ix_Show_venue_id_start_time': ['venue_id', 'start_time'],
+    'ix_Show_artist_id_start_time': ['artist_id', 'start_time'],
+    'ix_Show_start_time': ['start_time'],
+}
+
+
+def upgrade():
+    # db.create_all() already builds these on databases created from the models
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('Show')}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'Show', columns)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name='Show')
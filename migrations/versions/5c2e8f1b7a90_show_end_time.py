@@ -0,0 +1,38 @@
+"""show end_time for double-booking checks
+
+Revision ID: 5c2e8f1b7a90
+Revises: d34d2f6aa393
+Create Date: 2026-10-18 20:02:11.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f1b7a90'
+down_revision = 'd34d2f6aa393'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = {column['name'] for column in sa.inspect(bind).get_columns('Show')}
+    if 'end_time' not in existing:
+        op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+
+    # existing shows get the default two hours
+    if bind.dialect.name == 'sqlite':
+        # same text layout SQLAlchemy writes for DateTime on SQLite
+        op.execute("""UPDATE "Show" SET end_time = strftime('%Y-%m-%d %H:%M:%f000', start_time, '+120 minutes') WHERE end_time IS NULL""")
+    else:
+        op.execute("""UPDATE "Show" SET end_time = start_time + interval '120 minutes' WHERE end_time IS NULL""")
+
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_column('end_time')
@@ -0,0 +1,29 @@
+"""heartbeat row for measuring replica lag
+
+Revision ID: 7e41c09d2b6f
+Revises: 5c2e8f1b7a90
+Create Date: 2026-10-18 21:14:52.730118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e41c09d2b6f'
+down_revision = '5c2e8f1b7a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'ReplicaHeartbeat' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('ReplicaHeartbeat',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('beat_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('ReplicaHeartbeat')
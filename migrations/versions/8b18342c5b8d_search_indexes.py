@@ -0,0 +1,65 @@
+"""search indexes on Venue name/city and Artist name
+
+Revision ID: 8b18342c5b8d
+Revises: 9d1d91430a47
+Create Date: 2026-10-18 17:05:47.118730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b18342c5b8d'
+down_revision = '9d1d91430a47'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_TABLES = {
+    'venue_search': ('Venue', ['name', 'city']),
+    'artist_search': ('Artist', ['name']),
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index('ix_Venue_city_trgm', 'Venue', ['city'], postgresql_using='gin',
+                        postgresql_ops={'city': 'gin_trgm_ops'})
+        op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+    elif dialect == 'sqlite':
+        for fts, (table, columns) in SQLITE_TABLES.items():
+            cols = ', '.join(columns)
+            new = ', '.join('new.' + c for c in columns)
+            old = ', '.join('old.' + c for c in columns)
+            op.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {cols}, content='{table}', content_rowid='id', tokenize='trigram')""")
+            op.execute(f"""CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{table}" BEGIN
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+            END""")
+            op.execute(f"""CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{table}" BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+            END""")
+            op.execute(f"""CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON "{table}" BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+            END""")
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+        op.drop_index('ix_Venue_city_trgm', table_name='Venue')
+        op.drop_index('ix_Venue_name_trgm', table_name='Venue')
+    elif dialect == 'sqlite':
+        for fts in SQLITE_TABLES:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
@@ -0,0 +1,48 @@
+"""updated_at on Venue, Artist and Show for conditional GETs
+
+Revision ID: a41f0c3d9e12
+Revises: 7e41c09d2b6f
+Create Date: 2026-10-18 22:41:07.204913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f0c3d9e12'
+down_revision = '7e41c09d2b6f'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table in TABLES:
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        if 'updated_at' not in existing:
+            op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+        # existing rows count as changed now
+        if bind.dialect.name == 'sqlite':
+            # same text layout SQLAlchemy writes for DateTime on SQLite
+            op.execute("""UPDATE "%s" SET updated_at = strftime('%%Y-%%m-%%d %%H:%%M:%%f000', 'now', 'localtime') WHERE updated_at IS NULL""" % table)
+        else:
+            op.execute("""UPDATE "%s" SET updated_at = localtimestamp WHERE updated_at IS NULL""" % table)
+
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+        index = 'ix_%s_updated_at' % table
+        if index not in {index['name'] for index in sa.inspect(bind).get_indexes(table)}:
+            op.create_index(index, table, ['updated_at'])
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index('ix_%s_updated_at' % table, table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
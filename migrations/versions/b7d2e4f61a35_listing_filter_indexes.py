@@ -0,0 +1,38 @@
+"""indexes for the genre, state and city listing filters
+
+Revision ID: b7d2e4f61a35
+Revises: a41f0c3d9e12
+Create Date: 2026-10-18 23:26:40.118362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f61a35'
+down_revision = 'a41f0c3d9e12'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist')
+
+
+def upgrade():
+    bind = op.get_bind()
+    for table in TABLES:
+        existing = {index['name'] for index in sa.inspect(bind).get_indexes(table)}
+        # db.create_all() already builds this one on databases created from the models
+        if 'ix_%s_state_city' % table not in existing:
+            op.create_index('ix_%s_state_city' % table, table, ['state', 'city'])
+        # genres @> ARRAY[...]; SQLite keeps genres as JSON text and scans it
+        if bind.dialect.name == 'postgresql' and 'ix_%s_genres' % table not in existing:
+            op.create_index('ix_%s_genres' % table, table, ['genres'], postgresql_using='gin')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table in TABLES:
+        if bind.dialect.name == 'postgresql':
+            op.drop_index('ix_%s_genres' % table, table_name=table)
+        op.drop_index('ix_%s_state_city' % table, table_name=table)
@@ -0,0 +1,46 @@
+"""Job table for the background job queue
+
+Revision ID: c5e1a9d04b73
+Revises: e3b9a7c15d28
+Create Date: 2026-10-19 02:41:07.915362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1a9d04b73'
+down_revision = 'e3b9a7c15d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'Job' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('Job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=80), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('locked_by', sa.String(length=120), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('key')
+        )
+        # workers claim by (status, run_at); throughput counts by finished_at
+        op.create_index('ix_Job_status_run_at', 'Job', ['status', 'run_at'])
+        op.create_index('ix_Job_finished_at', 'Job', ['finished_at'])
+
+
+def downgrade():
+    op.drop_index('ix_Job_finished_at', table_name='Job')
+    op.drop_index('ix_Job_status_run_at', table_name='Job')
+    op.drop_table('Job')
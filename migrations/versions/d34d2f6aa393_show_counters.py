@@ -0,0 +1,60 @@
+"""denormalized upcoming/past show counters on Venue and Artist
+
+Revision ID: d34d2f6aa393
+Revises: 3a10647da2a6
+Create Date: 2026-10-18 18:21:36.904417
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd34d2f6aa393'
+down_revision = '3a10647da2a6'
+branch_labels = None
+depends_on = None
+
+
+COUNTED = (('Venue', 'venue_id'), ('Artist', 'artist_id'))
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for table, _ in COUNTED:
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        with op.batch_alter_table(table) as batch_op:
+            if 'upcoming_shows_count' not in existing:
+                batch_op.add_column(sa.Column('upcoming_shows_count', sa.Integer(), nullable=False, server_default='0'))
+            if 'past_shows_count' not in existing:
+                batch_op.add_column(sa.Column('past_shows_count', sa.Integer(), nullable=False, server_default='0'))
+
+    if 'CounterWatermark' not in inspector.get_table_names():
+        op.create_table('CounterWatermark',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+    now = datetime.now()
+    watermark = sa.table('CounterWatermark', sa.column('id', sa.Integer), sa.column('rolled_over_at', sa.DateTime))
+    bind.execute(watermark.delete())
+    bind.execute(watermark.insert().values(id=1, rolled_over_at=now))
+    for table, fk in COUNTED:
+        bind.execute(sa.text(f'''
+            UPDATE "{table}" SET
+              upcoming_shows_count = (SELECT COUNT(*) FROM "Show" WHERE "Show".{fk} = "{table}".id AND "Show".start_time > :now),
+              past_shows_count = (SELECT COUNT(*) FROM "Show" WHERE "Show".{fk} = "{table}".id AND "Show".start_time <= :now)
+        ''').bindparams(sa.bindparam('now', type_=sa.DateTime())), {'now': now})
+
+
+def downgrade():
+    op.drop_table('CounterWatermark')
+    for table, _ in COUNTED:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
@@ -0,0 +1,54 @@
+"""Venue latitude, longitude and geohash, and the Geocode table
+
+Revision ID: e3b9a7c15d28
+Revises: b7d2e4f61a35
+Create Date: 2026-10-19 00:12:53.480216
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b9a7c15d28'
+down_revision = 'b7d2e4f61a35'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (
+    ('latitude', sa.Float()),
+    ('longitude', sa.Float()),
+    ('geohash', sa.String(length=12)),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table('Geocode'):
+        op.create_table('Geocode',
+            sa.Column('state', sa.String(length=120), nullable=False),
+            sa.Column('city', sa.String(length=120), nullable=False),
+            sa.Column('latitude', sa.Float(), nullable=False),
+            sa.Column('longitude', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('state', 'city')
+        )
+
+    existing = {column['name'] for column in inspector.get_columns('Venue')}
+    for name, type_ in COLUMNS:
+        if name not in existing:
+            op.add_column('Venue', sa.Column(name, type_, nullable=True))
+
+    # /venues/nearby range-scans geohash prefixes; latitude and longitude
+    # make the index cover that scan
+    if 'ix_Venue_geohash' not in {index['name'] for index in sa.inspect(bind).get_indexes('Venue')}:
+        op.create_index('ix_Venue_geohash', 'Venue', ['geohash', 'latitude', 'longitude'])
+    # the positions are filled by `flask geo load` (geocodes.csv)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    with op.batch_alter_table('Venue') as batch_op:
+        for name, _ in reversed(COLUMNS):
+            batch_op.drop_column(name)
+    op.drop_table('Geocode')
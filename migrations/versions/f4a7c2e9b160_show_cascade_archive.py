@@ -0,0 +1,57 @@
+"""Show foreign keys ON DELETE CASCADE, and archived_at on Venue and Artist
+
+Revision ID: f4a7c2e9b160
+Revises: c5e1a9d04b73
+Create Date: 2026-10-19 04:26:38.104752
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a7c2e9b160'
+down_revision = 'c5e1a9d04b73'
+branch_labels = None
+depends_on = None
+
+# (column, referred table, constraint name); the names are PostgreSQL's defaults
+FOREIGN_KEYS = (
+    ('artist_id', 'Artist', 'Show_artist_id_fkey'),
+    ('venue_id', 'Venue', 'Show_venue_id_fkey'),
+)
+# the names batch mode gives SQLite's unnamed constraints, so they can be dropped
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def _set_ondelete(ondelete):
+    # recreates the Show foreign keys that don't already have `ondelete`
+    foreign_keys = sa.inspect(op.get_bind()).get_foreign_keys('Show')
+    stale = [fk for fk in foreign_keys
+             if (fk['options'].get('ondelete') or '').upper() != (ondelete or '')]
+    if not stale:
+        return
+    # SQLite can't alter constraints: batch mode copies "Show" into a new table
+    with op.batch_alter_table('Show', naming_convention=NAMING_CONVENTION) as batch_op:
+        for fk in stale:
+            column = fk['constrained_columns'][0]
+            name = fk['name'] or NAMING_CONVENTION['fk'] % {'table_name': 'Show', 'column_0_name': column}
+            batch_op.drop_constraint(name, type_='foreignkey')
+        for column, referred, name in FOREIGN_KEYS:
+            if column in [fk['constrained_columns'][0] for fk in stale]:
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _set_ondelete('CASCADE')
+    inspector = sa.inspect(op.get_bind())
+    for table in ('Venue', 'Artist'):
+        if 'archived_at' not in {column['name'] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('archived_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('archived_at')
+    _set_ondelete(None)
@@ -1,41 +1,65 @@
-from flask import Flask
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import database
 
 #----------------------------------------------------------------------------#
-# App Config.
+# Extensions, bound to an app by app.create_app().
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db=SQLAlchemy(app)
-migrate = Migrate(app, db)
-
-# TODO: connect to a local postgresql database
+moment = Moment()
+db=database.RoutingSQLAlchemy()
+migrate = Migrate()
 
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+# Shows run from start_time to end_time. The cap on their length bounds the
+# range scans that look for overlapping bookings (see bookings.py).
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+MAX_SHOW_DURATION = timedelta(hours=12)
+
+def default_end_time(context):
+  return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
 class Show(db.Model):
   __tablename__ = 'Show'
   
   id = db.Column(db.Integer, primary_key = True)
-  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable = False)
-  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable = False)
+  # deleting a venue or artist deletes their shows in the database (see deletes.py)
+  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable = False)
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable = False)
   start_time = db.Column(db.DateTime(), default=datetime.now(), nullable = False) 
+  end_time = db.Column(db.DateTime(), default=default_end_time, nullable = False)
+  # bumped on every change; the conditional GET validators read it (see conditional.py)
+  updated_at = db.Column(db.DateTime(), default=datetime.now, onupdate=datetime.now, nullable=False, index=True)
+
+  __table_args__ = (
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_Show_start_time', 'start_time'),
+  )
+
 
+  @property
+  def duration(self):
+    return self.end_time - self.start_time
 
   def __repr__(self):
-      return f'<Show - artist_id {self.artist_id}, venue_id {self.venue_id}, start_time {self.start_time}>'
+      return f'<Show - artist_id {self.artist_id}, venue_id {self.venue_id}, start_time {self.start_time}, end_time {self.end_time}>'
       
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    # listing filters; genres has a GIN index on PostgreSQL (see the migrations).
+    # The geohash index covers the /venues/nearby candidate scan.
+    __table_args__ = (
+      db.Index('ix_Venue_state_city', 'state', 'city'),
+      db.Index('ix_Venue_geohash', 'geohash', 'latitude', 'longitude'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -43,13 +67,25 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String()))
+    genres = db.Column(db.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite'))
     facebook_link = db.Column(db.String(120))
     image_link = db.Column(db.String(500)) 
     website_link = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String())
-    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete, save-update')
+    # position of the venue's city, from the Geocode table; /venues/nearby
+    # range-scans the geohash index (see geo.py)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    # denormalized show counters, maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped on every change, counter updates included (see conditional.py)
+    updated_at = db.Column(db.DateTime(), default=datetime.now, onupdate=datetime.now, nullable=False, index=True)
+    # set when deleted in DELETE_MODE=archive, until the purge job runs
+    archived_at = db.Column(db.DateTime())
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete, save-update', passive_deletes=True)
 
     def __repr__(self):
       return f'<Venue: id - {self.id}, name - {self.name}, city - {self.city}, genre - {self.genres}, seeking_talent - {self.seeking_talent} >'
@@ -57,23 +93,92 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    # listing filters; genres has a GIN index on PostgreSQL (see the migrations)
+    __table_args__ = (
+      db.Index('ix_Artist_state_city', 'state', 'city'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String()))
+    genres = db.Column(db.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite'))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String())
-    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete, save-update')
+    # denormalized show counters, maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped on every change, counter updates included (see conditional.py)
+    updated_at = db.Column(db.DateTime(), default=datetime.now, onupdate=datetime.now, nullable=False, index=True)
+    # set when deleted in DELETE_MODE=archive, until the purge job runs
+    archived_at = db.Column(db.DateTime())
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete, save-update', passive_deletes=True)
     
 
     def __repr__(self):
       return f'<Artist: id - {self.id}, name - {self.name}, city - {self.city}, genre - {self.genres}, seeking_venue - {self.seeking_venue} >'
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
-db.create_all()    
\ No newline at end of file
+class CounterWatermark(db.Model):
+    # Single row: shows starting after rolled_over_at are counted as upcoming,
+    # the rest as past. The roll-over job moves it forward.
+    __tablename__ = 'CounterWatermark'
+
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+      return f'<CounterWatermark: rolled_over_at - {self.rolled_over_at} >'
+
+class ReplicaHeartbeat(db.Model):
+    # Single row bumped on the primary; how far a replica's copy trails it is
+    # that replica's lag (see database.ReplicaRouter).
+    __tablename__ = 'ReplicaHeartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime(), nullable=False)
+    
+
+class Geocode(db.Model):
+    # Offline geocoding: where each known city is, loaded from geocodes.csv
+    # by `flask geo load`. Cities are stored lower-case, states upper-case.
+    __tablename__ = 'Geocode'
+
+    state = db.Column(db.String(120), primary_key=True)
+    city = db.Column(db.String(120), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+      return f'<Geocode: {self.city}, {self.state} - {self.latitude}, {self.longitude} >'
+
+class Job(db.Model):
+    # Background work (see jobs.py), written in the same transaction as the
+    # change that calls for it. Workers claim queued jobs by (status, run_at);
+    # a key, when given, is unique and makes enqueueing idempotent.
+    __tablename__ = 'Job'
+    __table_args__ = (
+      db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+      db.Index('ix_Job_finished_at', 'finished_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.JSON(), nullable=False)
+    key = db.Column(db.String(255), unique=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime(), nullable=False, default=datetime.now)
+    locked_at = db.Column(db.DateTime())
+    locked_by = db.Column(db.String(120))
+    last_error = db.Column(db.Text())
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.now)
+    finished_at = db.Column(db.DateTime())
+
+    def __repr__(self):
+      return f'<Job: id - {self.id}, kind - {self.kind}, status - {self.status}, attempts - {self.attempts} >'
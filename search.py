@@ -0,0 +1,145 @@
+from sqlalchemy import or_, func, text
+
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Search.
+#
+# Venue (name, city) and Artist (name) search, ranked, with each result's
+# number of upcoming shows read from its counter column in the same query.
+#
+# - PostgreSQL: ILIKE served by pg_trgm GIN indexes, ranked by similarity().
+#   The extension and indexes are created by a Flask-Migrate revision.
+# - SQLite: FTS5 tables with the trigram tokenizer, ranked by bm25.
+# - Anything else, and terms shorter than a trigram: plain ILIKE.
+#----------------------------------------------------------------------------#
+
+SEARCHABLE = {
+  'venue': (Venue, (Venue.name, Venue.city)),
+  'artist': (Artist, (Artist.name,)),
+}
+
+# FTS5 external-content tables kept in step with Venue/Artist by triggers.
+# The same statements are run by the search index migration. The update
+# triggers only fire for the indexed columns: counter bumps, updated_at
+# touches and archiving leave the index alone.
+SQLITE_INDEX_DDL = [
+  """CREATE VIRTUAL TABLE IF NOT EXISTS venue_search USING fts5(
+       name, city, content='Venue', content_rowid='id', tokenize='trigram')""",
+  """CREATE TRIGGER IF NOT EXISTS venue_search_ai AFTER INSERT ON "Venue" BEGIN
+       INSERT INTO venue_search(rowid, name, city) VALUES (new.id, new.name, new.city);
+     END""",
+  """CREATE TRIGGER IF NOT EXISTS venue_search_ad AFTER DELETE ON "Venue" BEGIN
+       INSERT INTO venue_search(venue_search, rowid, name, city) VALUES ('delete', old.id, old.name, old.city);
+     END""",
+  """CREATE TRIGGER IF NOT EXISTS venue_search_au AFTER UPDATE OF name, city ON "Venue" BEGIN
+       INSERT INTO venue_search(venue_search, rowid, name, city) VALUES ('delete', old.id, old.name, old.city);
+       INSERT INTO venue_search(rowid, name, city) VALUES (new.id, new.name, new.city);
+     END""",
+  """CREATE VIRTUAL TABLE IF NOT EXISTS artist_search USING fts5(
+       name, content='Artist', content_rowid='id', tokenize='trigram')""",
+  """CREATE TRIGGER IF NOT EXISTS artist_search_ai AFTER INSERT ON "Artist" BEGIN
+       INSERT INTO artist_search(rowid, name) VALUES (new.id, new.name);
+     END""",
+  """CREATE TRIGGER IF NOT EXISTS artist_search_ad AFTER DELETE ON "Artist" BEGIN
+       INSERT INTO artist_search(artist_search, rowid, name) VALUES ('delete', old.id, old.name);
+     END""",
+  """CREATE TRIGGER IF NOT EXISTS artist_search_au AFTER UPDATE OF name ON "Artist" BEGIN
+       INSERT INTO artist_search(artist_search, rowid, name) VALUES ('delete', old.id, old.name);
+       INSERT INTO artist_search(rowid, name) VALUES (new.id, new.name);
+     END""",
+]
+
+# trigram indexes can only answer terms at least this long
+MIN_INDEXED_TERM = 3
+
+_sqlite_index_ready = set()
+
+
+def ensure_sqlite_index():
+  # Databases built by db.create_all() rather than migrations get the FTS5
+  # tables on first search; the rebuild fills them from existing rows.
+  url = str(db.engine.url)
+  if url in _sqlite_index_ready:
+    return
+  with db.engine.begin() as conn:
+    trigger = conn.execute(text(
+      "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'artist_search_au'")).scalar()
+    if trigger is None:
+      for statement in SQLITE_INDEX_DDL:
+        conn.execute(text(statement))
+      conn.execute(text("INSERT INTO venue_search(venue_search) VALUES ('rebuild')"))
+      conn.execute(text("INSERT INTO artist_search(artist_search) VALUES ('rebuild')"))
+    elif 'UPDATE OF' not in trigger:
+      # built before the update triggers were narrowed to the indexed columns
+      conn.execute(text('DROP TRIGGER venue_search_au'))
+      conn.execute(text('DROP TRIGGER artist_search_au'))
+      for statement in SQLITE_INDEX_DDL:
+        conn.execute(text(statement))
+  _sqlite_index_ready.add(url)
+
+
+def reset_sqlite_index():
+  # forget which databases were checked, e.g. after db.drop_all() removed the triggers
+  _sqlite_index_ready.clear()
+
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _like_search(kind, term):
+  model, columns = SEARCHABLE[kind]
+  pattern = '%' + escape_like(term) + '%'
+  query = db.session.query(
+    model.id,
+    model.name,
+    model.upcoming_shows_count.label('num_upcoming_shows')
+  ).filter(or_(*[column.ilike(pattern, escape='\\') for column in columns]))
+
+  if term and db.engine.dialect.name == 'postgresql':
+    rank = func.greatest(*[func.similarity(func.coalesce(column, ''), term) for column in columns])
+    query = query.order_by(rank.desc(), model.name, model.id)
+  else:
+    query = query.order_by(model.name, model.id)
+  return query.all()
+
+
+def _fts_search(kind, term):
+  ensure_sqlite_index()
+  model, columns = SEARCHABLE[kind]
+  statement = text("""
+    SELECT entity.id, entity.name, entity.upcoming_shows_count AS num_upcoming_shows
+    FROM {kind}_search AS matches
+    JOIN "{table}" AS entity ON entity.id = matches.rowid
+    WHERE {kind}_search MATCH :query AND entity.archived_at IS NULL
+    ORDER BY matches.rank, entity.name, entity.id
+  """.format(kind=kind, table=model.__tablename__))
+  # quote the term as a single FTS5 phrase so user input is never parsed as syntax
+  query = '"' + term.replace('"', '""') + '"'
+  return db.session.execute(statement, {'query': query}).all()
+
+
+def search(kind, term):
+  # Returns the {"count", "data"} structure the search templates render.
+  term = term.strip()
+  if db.engine.dialect.name == 'sqlite' and len(term) >= MIN_INDEXED_TERM:
+    rows = _fts_search(kind, term)
+  else:
+    rows = _like_search(kind, term)
+  return {
+    "count" : len(rows),
+    "data" : [{
+      "id" : row.id,
+      "name" : row.name,
+      "num_upcoming_shows" : row.num_upcoming_shows
+    } for row in rows]
+  }
+
+
+def search_venues(term):
+  return search('venue', term)
+
+
+def search_artists(term):
+  return search('artist', term)
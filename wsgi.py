@@ -0,0 +1,9 @@
+#----------------------------------------------------------------------------#
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Builds the app without touching the database; run `flask db upgrade`
+# (FLASK_APP=app) as a release step instead.
+#----------------------------------------------------------------------------#
+from app import create_app
+
+app = create_app()